@@ -0,0 +1,101 @@
+"""Import time of the SDK, the cold start cost paid by every function using it.
+
+    python -m benchmarks.import_time --runs 20
+
+Every measure runs in a fresh interpreter. `--top` lists the modules taking
+the most time to import according to `python -X importtime`.
+"""
+import argparse
+import json
+import subprocess
+import sys
+from typing import List
+
+from .run import _percentile
+
+# statements timed in a fresh interpreter each
+STATEMENTS = {
+    "import deta": "import deta",
+    "deta.AsyncBase": "import deta; deta.AsyncBase",
+}
+
+_MEASURE = """
+import sys, time
+started = time.perf_counter()
+{statement}
+print(time.perf_counter() - started, "aiohttp" in sys.modules)
+"""
+
+
+def measure(statement: str, runs: int) -> dict:
+    seconds = []
+    aiohttp_loaded = False
+    for _ in range(runs):
+        out = subprocess.run(
+            [sys.executable, "-c", _MEASURE.format(statement=statement)],
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout.split()
+        seconds.append(float(out[0]))
+        aiohttp_loaded = out[1] == "True"
+    return {
+        "runs": runs,
+        "p50_ms": _percentile(seconds, 50) * 1000,
+        "p95_ms": _percentile(seconds, 95) * 1000,
+        "min_ms": min(seconds) * 1000,
+        "aiohttp_loaded": aiohttp_loaded,
+    }
+
+
+def top_modules(statement: str, count: int) -> List[dict]:
+    """Modules with the highest cumulative import time, from `-X importtime`."""
+    err = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", statement],
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stderr
+    modules = []
+    for line in err.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        # import time: <self us> | <cumulative us> | <indented module name>
+        head, cumulative_us, name = line.split("|")
+        modules.append({
+            "module": name.strip(),
+            "self_ms": int(head.split(":")[1]) / 1000,
+            "cumulative_ms": int(cumulative_us) / 1000,
+        })
+    modules.sort(key=lambda m: m["cumulative_ms"], reverse=True)
+    return modules[:count]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--top", type=int, default=0, help="list the slowest modules of `import deta`")
+    parser.add_argument("--json", action="store_true", help="print results as json")
+    args = parser.parse_args()
+
+    results = {name: measure(statement, args.runs) for name, statement in STATEMENTS.items()}
+    top = top_modules(STATEMENTS["import deta"], args.top) if args.top else []
+
+    if args.json:
+        print(json.dumps({"imports": results, "top": top}, indent=2))
+        return
+
+    print(f"{'statement':<20} {'p50 ms':>8} {'p95 ms':>8} {'min ms':>8}  aiohttp")
+    for name, r in results.items():
+        print(
+            f"{name:<20} {r['p50_ms']:>8.1f} {r['p95_ms']:>8.1f} {r['min_ms']:>8.1f}  "
+            f"{'loaded' if r['aiohttp_loaded'] else '-'}"
+        )
+    if top:
+        print(f"\n{'module':<40} {'self ms':>8} {'total ms':>9}")
+        for m in top:
+            print(f"{m['module']:<40} {m['self_ms']:>8.1f} {m['cumulative_ms']:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
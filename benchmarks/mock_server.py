@@ -0,0 +1,143 @@
+"""Local stand-in for the Deta Base and Drive HTTP APIs.
+
+It keeps everything in memory and can inject latency, limit bandwidth and
+fail requests at random, so the SDK hot paths can be measured offline:
+
+    python -m benchmarks.mock_server --port 8080 --latency 0.02
+
+and point the SDK at it with `DETA_BASE_HOST=http://127.0.0.1:8080` and
+`DETA_DRIVE_HOST=http://127.0.0.1:8080`.
+"""
+import argparse
+import random
+import ssl
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Union
+
+from deta.fake import FakeBackend
+
+
+class MockDetaServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(
+        self,
+        address=("127.0.0.1", 0),
+        *,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        bandwidth: Union[int, None] = None,
+        error_rate: float = 0.0,
+        certfile: Union[str, None] = None,
+        keyfile: Union[str, None] = None,
+    ):
+        super().__init__(address, _Handler)
+        # the same backend serves the in-process fake transport, both stay in sync
+        self.backend = FakeBackend()
+        self.latency = latency
+        self.jitter = jitter
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+        self.scheme = "http"
+        if certfile:
+            context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            context.load_cert_chain(certfile, keyfile)
+            self.socket = context.wrap_socket(self.socket, server_side=True)
+            self.scheme = "https"
+
+    @property
+    def host(self) -> str:
+        """Host to give the SDK to talk to this server."""
+        return "{}://{}:{}".format(self.scheme, *self.server_address[:2])
+
+    def start(self) -> "MockDetaServer":
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # headers and body are written separately, don't let them wait on delayed acks
+    disable_nagle_algorithm = True
+    server: MockDetaServer
+
+    def log_message(self, format, *args):
+        pass
+
+    def _throttle(self, size: int):
+        if self.server.bandwidth:
+            time.sleep(size / self.server.bandwidth)
+
+    def _send(self, status: int, headers: dict, body: bytes):
+        self._throttle(len(body))
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _handle(self, method: str):
+        server = self.server
+        size = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(size)
+        self._throttle(size)
+        delay = server.latency + random.uniform(0, server.jitter)
+        if delay:
+            time.sleep(delay)
+        if server.error_rate and random.random() < server.error_rate:
+            return self._send(500, {"Content-Type": "application/json"}, b'{"errors": ["Injected error"]}')
+        self._send(*server.backend.handle(method, self.path, dict(self.headers), body))
+
+    def do_GET(self):
+        self._handle("GET")
+
+    def do_PUT(self):
+        self._handle("PUT")
+
+    def do_POST(self):
+        self._handle("POST")
+
+    def do_PATCH(self):
+        self._handle("PATCH")
+
+    def do_DELETE(self):
+        self._handle("DELETE")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every request")
+    parser.add_argument("--jitter", type=float, default=0.0, help="random extra seconds, up to")
+    parser.add_argument("--bandwidth", type=int, default=None, help="bytes per second for bodies")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests failing with 500")
+    parser.add_argument("--certfile", default=None, help="serve https with this certificate")
+    parser.add_argument("--keyfile", default=None)
+    args = parser.parse_args()
+
+    server = MockDetaServer(
+        (args.host, args.port),
+        latency=args.latency,
+        jitter=args.jitter,
+        bandwidth=args.bandwidth,
+        error_rate=args.error_rate,
+        certfile=args.certfile,
+        keyfile=args.keyfile,
+    )
+    print(f"Serving on {server.host}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""Benchmarks of the SDK hot paths against the local stand-in server.
+
+    python -m benchmarks.run --latency 0.001 --iterations 200
+
+Every benchmark reports its throughput and latency percentiles, `--json`
+prints them in a form that can be kept and compared between runs.
+"""
+import argparse
+import json
+import os
+import time
+from typing import Callable, List
+
+from deta import Deta
+
+from .mock_server import MockDetaServer
+
+
+def _percentile(values: List[float], percent: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percent / 100))]
+
+
+def bench(name: str, fn: Callable[[int], None], iterations: int, nbytes: int = 0) -> dict:
+    """Run `fn` `iterations` times and measure it, `nbytes` is the data moved per run."""
+    latencies = []
+    errors = 0
+    started = time.perf_counter()
+    for i in range(iterations):
+        t = time.perf_counter()
+        try:
+            fn(i)
+        except Exception:
+            errors += 1
+        latencies.append(time.perf_counter() - t)
+    seconds = time.perf_counter() - started
+    return {
+        "name": name,
+        "iterations": iterations,
+        "errors": errors,
+        "ops_per_second": iterations / seconds,
+        "mb_per_second": nbytes * iterations / seconds / 1024 / 1024 if nbytes else None,
+        "p50_ms": _percentile(latencies, 50) * 1000,
+        "p95_ms": _percentile(latencies, 95) * 1000,
+        "p99_ms": _percentile(latencies, 99) * 1000,
+    }
+
+
+def run(server: MockDetaServer, iterations: int, scan_items: int, file_size: int) -> List[dict]:
+    # errors are only injected into the measured requests
+    error_rate, server.error_rate = server.error_rate, 0.0
+    deta = Deta("bench_key")
+    db = deta.Base("bench", host=server.host)
+    drive = deta.Drive("bench", host=server.host)
+    results = []
+
+    item = {"payload": "x" * 100}
+    batch = [dict(item, key=f"many-{n}") for n in range(25)]
+    data = os.urandom(file_size)
+    uploads = iterations // 4 or 1
+    for i in range(iterations):
+        db.put(item, f"get-{i}")
+    for start in range(0, scan_items, 25):
+        db.put_many([{"key": f"scan-{n:08d}", "n": n} for n in range(start, min(start + 25, scan_items))])
+    for i in range(uploads):
+        drive.put(f"download-{i}", data)
+    server.error_rate = error_rate
+
+    results.append(bench("base.put", lambda i: db.put(item, f"put-{i}"), iterations))
+    results.append(bench("base.get", lambda i: db.get(f"get-{i}"), iterations))
+    results.append(bench("base.put_many", lambda i: db.put_many(batch), iterations))
+    scan_query = {"key?pfx": "scan-"}
+    results.append(
+        bench(
+            "base.fetch_scan",
+            lambda i: sum(1 for _ in db.iter_fetch(scan_query)),
+            max(1, iterations // 20),
+        )
+    )
+    results.append(bench("drive.put", lambda i: drive.put(f"upload-{i}", data), uploads, file_size))
+    results.append(bench("drive.get", lambda i: drive.get(f"download-{i}").read(), uploads, file_size))
+    return results
+
+
+def _print_table(results: List[dict]):
+    print(f"{'benchmark':<18}{'ops/s':>10}{'MB/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'errors':>8}")
+    for r in results:
+        mbs = f"{r['mb_per_second']:.1f}" if r["mb_per_second"] is not None else "-"
+        print(
+            f"{r['name']:<18}{r['ops_per_second']:>10.1f}{mbs:>9}"
+            f"{r['p50_ms']:>9.2f}{r['p95_ms']:>9.2f}{r['p99_ms']:>9.2f}{r['errors']:>8}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--scan-items", type=int, default=5000)
+    parser.add_argument("--file-size", type=int, default=1024 * 1024)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every request")
+    parser.add_argument("--jitter", type=float, default=0.0, help="random extra seconds, up to")
+    parser.add_argument("--bandwidth", type=int, default=None, help="bytes per second for bodies")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests failing with 500")
+    parser.add_argument("--json", action="store_true", help="print results as json")
+    args = parser.parse_args()
+
+    server = MockDetaServer(
+        latency=args.latency,
+        jitter=args.jitter,
+        bandwidth=args.bandwidth,
+        error_rate=args.error_rate,
+    ).start()
+    try:
+        results = run(server, args.iterations, args.scan_items, args.file_size)
+    finally:
+        server.stop()
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        _print_table(results)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,22 +1,33 @@
 import os
-import urllib.error
-import urllib.request
 import json
-from typing import Union
-
-from .base import _Base
-from .drive import _Drive
+import threading
+from typing import Union, List, Iterable
+
+from .base import _Base, DEFAULT_BASE_HOST
+from .circuit import CircuitBreaker, CircuitOpenError
+from .cache import DiskCache
+from .drive import _Drive, DEFAULT_DRIVE_HOST
+from .hedging import Hedging
+from .instrumentation import RequestRecord, RequestHook
+from .metrics import Metrics
+from .service import warmup as _warmup
+from .timeouts import Timeouts, DeadlineExceeded, deadline
+from .transport import Transport
 from .utils import _get_project_key_id
 
 
-try:
-    from ._async.client import AsyncBase  # pyright: ignore
-except ImportError:
-    pass
-
 __version__ = "1.2.0"
 
 
+def __getattr__(name: str):
+    # the async clients import aiohttp, which is slow to import, only load them on first use
+    if name in ("AsyncBase", "AsyncDrive"):
+        from ._async import client
+
+        return getattr(client, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
 def Base(name: str):
     project_key, project_id = _get_project_key_id()
     return _Base(name, project_key, project_id)
@@ -28,25 +39,120 @@ def Drive(name: str):
 
 
 class Deta:
-    def __init__(self, project_key: Union[str, None] = None, *, project_id: Union[str, None] = None):
+    def __init__(
+        self,
+        project_key: Union[str, None] = None,
+        *,
+        project_id: Union[str, None] = None,
+        transport: Union[Transport, None] = None,
+        hooks: Union[List[RequestHook], None] = None,
+        metrics: bool = False,
+        warmup: bool = False,
+        hedging: Union[Hedging, None] = None,
+        timeouts: Union[Timeouts, None] = None,
+        circuit_breaker: Union[CircuitBreaker, None] = None,
+    ):
         project_key, project_id = _get_project_key_id(project_key, project_id)
         self.project_key = project_key
         self.project_id = project_id
+        # sends the requests of all the clients, e.g. `deta.fake.FakeTransport` in tests
+        self.transport = transport
+        # called with a `RequestRecord` of every request of the clients, they share this list
+        self.hooks = list(hooks or [])
+        # aggregates of all the requests, exportable in the Prometheus format, opt-in
+        self.metrics = Metrics() if metrics else None
+        if self.metrics:
+            self.hooks.append(self.metrics)
+        # sends the slow reads of the Bases twice, see `deta.hedging`
+        self.hedging = hedging
+        # connect, read and total timeouts of each request of the clients
+        self.timeouts = timeouts
+        # fails the requests to unhealthy hosts fast, shared by the clients
+        self.circuit_breaker = circuit_breaker
+        if warmup:
+            self.warmup(background=True)
+
+    def warmup(
+        self,
+        hosts: Union[Iterable[str], None] = None,
+        *,
+        connections: int = 1,
+        background: bool = False,
+    ):
+        """Open connections to the Base and Drive hosts ahead of time, DNS lookup and TLS
+        handshake included, so that the first requests of the clients don't pay for them.
+        `hosts` defaults to the Base and Drive hosts.
+        `connections` is the number of connections opened per host, one per thread making requests.
+        `background` opens them in a thread and returns it right away.
+        Returns the number of connections opened, or the thread.
+        """
+        if self.transport:
+            return 0
+        hosts = list(hosts or [
+            os.getenv("DETA_BASE_HOST") or DEFAULT_BASE_HOST,
+            os.getenv("DETA_DRIVE_HOST") or DEFAULT_DRIVE_HOST,
+        ])
+        if not background:
+            return _warmup(hosts, connections)
+        thread = threading.Thread(target=_warmup, args=(hosts, connections), daemon=True)
+        thread.start()
+        return thread
 
     def Base(self, name: str, host: Union[str, None] = None):
-        return _Base(name, self.project_key, self.project_id, host)
+        return _Base(
+            name,
+            self.project_key,
+            self.project_id,
+            host,
+            transport=self.transport,
+            hooks=self.hooks,
+            hedging=self.hedging,
+            timeouts=self.timeouts,
+            circuit_breaker=self.circuit_breaker,
+        )
 
     def AsyncBase(self, name: str, host: Union[str, None] = None):
         from ._async.client import _AsyncBase
 
-        return _AsyncBase(name, self.project_key, self.project_id, host)
+        return _AsyncBase(
+            name,
+            self.project_key,
+            self.project_id,
+            host,
+            transport=self.transport,
+            hooks=self.hooks,
+            hedging=self.hedging,
+            timeouts=self.timeouts,
+            circuit_breaker=self.circuit_breaker,
+        )
 
-    def Drive(self, name: str, host: Union[str, None] = None):
+    def AsyncDrive(self, name: str, host: Union[str, None] = None):
+        from ._async.client import _AsyncDrive
+
+        return _AsyncDrive(
+            name,
+            self.project_key,
+            self.project_id,
+            host,
+            transport=self.transport,
+            hooks=self.hooks,
+            timeouts=self.timeouts,
+            circuit_breaker=self.circuit_breaker,
+        )
+
+    def Drive(self, name: str, host: Union[str, None] = None, cache: Union[DiskCache, None] = None):
+        if cache and self.metrics:
+            self.metrics.track_cache(cache)
         return _Drive(
             name=name,
             project_key=self.project_key,
             project_id=self.project_id,
             host=host,
+            cache=cache,
+            transport=self.transport,
+            hooks=self.hooks,
+            timeouts=self.timeouts,
+            circuit_breaker=self.circuit_breaker,
         )
 
     def send_email(self, to, subject, message, charset="UTF-8"):
@@ -54,6 +160,9 @@ class Deta:
 
 
 def send_email(to, subject, message, charset="UTF-8"):
+    import urllib.error
+    import urllib.request
+
     pid = os.getenv("AWS_LAMBDA_FUNCTION_NAME")
     url = os.getenv("DETA_MAILER_URL")
     api_key = os.getenv("DETA_PROJECT_KEY")
@@ -1,12 +1,26 @@
-from typing import Union, List
+from typing import Union, List, Iterable, Callable, Awaitable, Any
+from pathlib import Path
+import asyncio
+import contextlib
 import datetime
+import inspect
+import json
 import os
-from urllib.parse import quote
+import time
+from urllib.parse import quote, urlencode
 
 import aiohttp
+from multidict import CIMultiDict as _CIMultiDict, CIMultiDictProxy as _CIMultiDictProxy
+from yarl import URL as _URL
 
 from deta.utils import _get_project_key_id
-from deta.base import FetchResponse, Util, insert_ttl, BASE_TTL_ATTTRIBUTE
+from deta.base import Util, insert_ttl, _fetch_response, BASE_TTL_ATTTRIBUTE
+from deta.drive import _destination, _content_encoding, _Decompressor, DOWNLOAD_CHUNK_SIZE
+from deta.service import CustomJSONEncoder
+from deta import tracing
+from deta.circuit import CircuitBreaker
+from deta.instrumentation import RequestRecord, RequestHook, _emit
+from deta.timeouts import Timeouts, _end, _timeout, _timeout_error
 
 
 def AsyncBase(name: str):
@@ -14,44 +28,344 @@ def AsyncBase(name: str):
     return _AsyncBase(name, project_key, project_id)
 
 
-class _AsyncBase:
-    def __init__(self, name: str, project_key: str, project_id: str, host: Union[str, None] = None):
+def AsyncDrive(name: str):
+    project_key, project_id = _get_project_key_id()
+    return _AsyncDrive(name, project_key, project_id)
+
+
+def _with_scheme(host: str) -> str:
+    # hosts default to https, plain http is only meant for local test servers
+    return host if host.startswith(("http://", "https://")) else f"https://{host}"
+
+
+def _json_dumps(data) -> bytes:
+    return json.dumps(data, cls=CustomJSONEncoder).encode("utf-8")
+
+
+def _trace_config() -> aiohttp.TraceConfig:
+    """Fill the `RequestRecord` passed as `trace_request_ctx` with the phase timings."""
+    trace = aiohttp.TraceConfig()
+
+    def on(signal):
+        def register(callback):
+            async def handler(session, ctx, params):
+                if isinstance(ctx.trace_request_ctx, RequestRecord):
+                    callback(ctx, ctx.trace_request_ctx, time.perf_counter())
+
+            signal.append(handler)
+            return callback
+
+        return register
+
+    @on(trace.on_request_start)
+    def request_start(ctx, record, now):
+        ctx.mark = now
+
+    @on(trace.on_connection_create_start)
+    def connection_create_start(ctx, record, now):
+        ctx.mark = now
+
+    @on(trace.on_connection_create_end)
+    def connection_create_end(ctx, record, now):
+        record.timings["connect"] = now - ctx.mark
+        record.reused = False
+        ctx.mark = ctx.sending = now
+
+    @on(trace.on_connection_reuseconn)
+    def connection_reuseconn(ctx, record, now):
+        record.reused = True
+        ctx.mark = ctx.sending = now
+
+    def sent(ctx, record, now):
+        record.timings["send"] = now - getattr(ctx, "sending", ctx.mark)
+        ctx.mark = now
+
+    # the headers signal is missing from old aiohttp versions
+    if hasattr(trace, "on_request_headers_sent"):
+        on(trace.on_request_headers_sent)(sent)
+    on(trace.on_request_chunk_sent)(sent)
+
+    @on(trace.on_request_end)
+    def request_end(ctx, record, now):
+        record.timings["wait"] = now - ctx.mark
+
+    return trace
+
+
+class _AsyncService:
+    # 'base' or 'drive', reported in the request records
+    service = ""
+    # keyword arguments of the session
+    _session_options = {}
+
+    def __init__(
+        self,
+        host: str,
+        name: str,
+        project_id: str,
+        headers: dict,
+        transport=None,
+        hooks: Union[List[RequestHook], None] = None,
+        hedging=None,
+        timeouts: Union[Timeouts, None] = None,
+        circuit_breaker: Union[CircuitBreaker, None] = None,
+    ):
+        self._host = host
+        self.name = name
+        self._path = f"/v1/{project_id}/{name}"
+        self._base_url = f"{_with_scheme(host)}{self._path}"
+        self._headers = headers
+        # a `deta.transport.Transport` sending the requests instead of the session
+        self._transport = transport
+        # called with a `RequestRecord` of every request
+        self.hooks = hooks if hooks is not None else []
+        # a `deta.hedging.Hedging` sending slow reads twice
+        self.hedging = hedging
+        # connect, read and total timeouts of each request, the session ones by default
+        self.timeouts = timeouts or Timeouts()
+        # fails requests fast while the host is unhealthy
+        self.circuit_breaker = circuit_breaker
+        self._session = None if transport else aiohttp.ClientSession(
+            headers=headers,
+            raise_for_status=True,
+            trace_configs=[_trace_config()],
+            **self._session_options,
+        )
+
+    async def close(self) -> None:
+        if self._session:
+            await self._session.close()
+
+    def _timeout(self, end: Union[float, None]) -> dict:
+        # keyword arguments of a session request, none keeps the timeout of the session
+        timeouts = self.timeouts
+        if end is None and timeouts.connect is None and timeouts.read is None:
+            return {}
+        return {
+            "timeout": aiohttp.ClientTimeout(
+                total=_timeout(None, end), connect=timeouts.connect, sock_read=timeouts.read
+            )
+        }
+
+    @contextlib.asynccontextmanager
+    async def _request(
+        self,
+        method: str,
+        path: str,
+        *,
+        params: Union[dict, None] = None,
+        json: Union[dict, None] = None,
+        op: Union[str, None] = None,
+    ):
+        """Send a request, the response is only valid inside the context.
+        Raises `aiohttp.ClientResponseError` for error statuses either way.
+        """
+        record = RequestRecord(op or method.lower(), self.service, self.name, method, path)
+        body = _json_dumps(json) if json is not None else None
+        record.bytes_out = len(body) if body else 0
+        # the deadline of the operation shortened by the total timeout
+        end = _end(self.timeouts.total)
+        with tracing.request_span(record):
+            start = time.perf_counter()
+            allowed = False
+            try:
+                if self.circuit_breaker:
+                    self.circuit_breaker.allow(self._host)
+                    allowed = True
+                if not self._transport:
+                    async with self._session.request(  # pyright: ignore
+                        method,
+                        f"{self._base_url}{path}",
+                        params=params,
+                        data=body,
+                        trace_request_ctx=record,
+                        **self._timeout(end),
+                    ) as resp:
+                        record.status = resp.status
+                        yield _Response(record, resp, resp.read, resp.content)
+                    return
+
+                url = f"{self._path}{path}"
+                if params:
+                    url += "?" + urlencode(params)
+                timeouts = Timeouts(
+                    connect=_timeout(self.timeouts.connect, end),
+                    read=_timeout(self.timeouts.read, end),
+                    total=_timeout(None, end),
+                )
+                res = await asyncio.wait_for(
+                    self._transport.arequest(self._host, method, url, dict(self._headers), body, timeouts),
+                    timeouts.total,
+                )
+                record.timings["wait"] = time.perf_counter() - start
+                record.status = res.status
+                try:
+                    if res.status >= 400:
+                        request_info = aiohttp.RequestInfo(
+                            _URL(f"{self._base_url}{path}"),
+                            method,
+                            _CIMultiDictProxy(_CIMultiDict(self._headers)),
+                        )
+                        raise aiohttp.ClientResponseError(
+                            request_info, (), status=res.status, message=res.reason, headers=res.headers
+                        )
+
+                    async def read():
+                        return await asyncio.wait_for(_maybe_await(res.read()), _timeout(None, end))
+
+                    yield _Response(record, res, read, _TransportStream(res))
+                finally:
+                    await _maybe_await(res.close())
+            except BaseException as e:
+                if isinstance(e, aiohttp.ClientResponseError):
+                    record.status = e.status
+                record.error = e
+                if isinstance(e, asyncio.TimeoutError):
+                    # not a `TimeoutError` before Python 3.11
+                    record.error = _timeout_error(e, end)
+                    if record.error is not e:
+                        raise record.error from e
+                raise
+            finally:
+                record.duration = time.perf_counter() - start
+                if allowed:
+                    if isinstance(record.error, asyncio.CancelledError):
+                        self.circuit_breaker.release(self._host)  # pyright: ignore
+                    else:
+                        self.circuit_breaker.record(self._host, record)  # pyright: ignore
+                if self.hooks:
+                    _emit(self.hooks, record)
+
+
+    async def _read(self, op: str, read: Callable[[], Awaitable[Any]]):
+        """Await `read`, an idempotent read, hedged when the client has a `hedging` policy."""
+        if not self.hedging:
+            return await read()
+        return await self.hedging.arun((self.service, self.name, op), read)
+
+
+class _Response:
+    """Response with the interface of the aiohttp responses used by the clients,
+    timing the reads and decodes into its `RequestRecord`.
+    """
+
+    def __init__(self, record: RequestRecord, res, read: Callable[[], Awaitable[bytes]], content):
+        self._record = record
+        self._read = read
+        self.status = res.status
+        self.headers = res.headers
+        # streamed bodies are read by the caller, count them from their length
+        self.content = content
+        record.bytes_in = int(res.headers.get("Content-Length") or 0)
+
+    async def read(self) -> bytes:
+        start = time.perf_counter()
+        body = await self._read()
+        self._record.timings["read"] = time.perf_counter() - start
+        self._record.bytes_in = len(body)
+        return body
+
+    async def json(self):
+        body = await self.read()
+        start = time.perf_counter()
+        payload = json.loads(body)
+        self._record.timings["decode"] = time.perf_counter() - start
+        return payload
+
+
+async def _maybe_await(value):
+    # the responses of `Transport.arequest` can read and close the body with coroutines
+    return await value if inspect.isawaitable(value) else value
+
+
+class _TransportStream:
+    """Body of a transport response with the interface of `aiohttp.StreamReader`."""
+
+    def __init__(self, res):
+        self._res = res
+
+    async def iter_chunked(self, n: int):
+        while True:
+            chunk = await _maybe_await(self._res.read(n))
+            if not chunk:
+                break
+            yield chunk
+
+
+class _DecompressingStream:
+    """Body stream decompressing another one, with the `iter_chunked` of `aiohttp.StreamReader`."""
+
+    def __init__(self, stream, encoding: str):
+        self._stream = stream
+        self._encoding = encoding
+
+    async def iter_chunked(self, n: int):
+        decompressor = _Decompressor(self._encoding)
+        async for chunk in self._stream.iter_chunked(n):
+            data = decompressor.decompress(chunk)
+            if data:
+                yield data
+        data = decompressor.flush()
+        if data:
+            yield data
+
+
+class _AsyncBase(_AsyncService):
+    service = "base"
+
+    def __init__(
+        self,
+        name: str,
+        project_key: str,
+        project_id: str,
+        host: Union[str, None] = None,
+        transport=None,
+        hooks: Union[List[RequestHook], None] = None,
+        hedging=None,
+        timeouts: Union[Timeouts, None] = None,
+        circuit_breaker: Union[CircuitBreaker, None] = None,
+    ):
         if not project_key:
             raise AssertionError("No Base name provided")
 
         host = host or os.getenv("DETA_BASE_HOST") or "database.deta.sh"
-        self._base_url = f"https://{host}/v1/{project_id}/{name}"
-
-        self.util = Util()
-        self.__ttl_attribute = BASE_TTL_ATTTRIBUTE
-
-        self._session = aiohttp.ClientSession(
-            headers={
+        super().__init__(
+            host,
+            name,
+            project_id,
+            {
                 "Content-type": "application/json",
                 "X-API-Key": project_key,
             },
-            raise_for_status=True,
+            transport,
+            hooks,
+            hedging,
+            timeouts,
+            circuit_breaker,
         )
 
-    async def close(self) -> None:
-        await self._session.close()
+        self.util = Util()
+        self.__ttl_attribute = BASE_TTL_ATTTRIBUTE
 
     async def get(self, key: str):
         key = quote(key, safe="")
 
-        try:
-            async with self._session.get(f"{self._base_url}/items/{key}") as resp:
-                return await resp.json()
-        except aiohttp.ClientResponseError as e:
-            if e.status == 404:
-                return
-            else:
-                raise e
+        async def read():
+            try:
+                async with self._request("GET", f"/items/{key}", op="get") as resp:
+                    return await resp.json()
+            except aiohttp.ClientResponseError as e:
+                if e.status == 404:
+                    return
+                else:
+                    raise e
+
+        return await self._read("get", read)
 
     async def delete(self, key: str):
         key = quote(key, safe="")
 
-        async with self._session.delete(f"{self._base_url}/items/{key}"):
+        async with self._request("DELETE", f"/items/{key}", op="delete"):
             return
 
     async def insert(
@@ -72,9 +386,7 @@ class _AsyncBase:
 
         insert_ttl(data, self.__ttl_attribute,
                    expire_in=expire_in, expire_at=expire_at)
-        async with self._session.post(
-            f"{self._base_url}/items", json={"item": data}
-        ) as resp:
+        async with self._request("POST", "/items", json={"item": data}, op="insert") as resp:
             return await resp.json()
 
     async def put(
@@ -96,9 +408,7 @@ class _AsyncBase:
 
         insert_ttl(data, self.__ttl_attribute,
                    expire_in=expire_in, expire_at=expire_at)
-        async with self._session.put(
-            f"{self._base_url}/items", json={"items": [data]}
-        ) as resp:
+        async with self._request("PUT", "/items", json={"items": [data]}, op="put") as resp:
             if resp.status == 207:
                 resp_json = await resp.json()
                 if "processed" in resp_json:
@@ -124,9 +434,7 @@ class _AsyncBase:
             )
             _items.append(data)
 
-        async with self._session.put(
-            f"{self._base_url}/items", json={"items": _items}
-        ) as resp:
+        async with self._request("PUT", "/items", json={"items": _items}, op="put_many") as resp:
             return await resp.json()
 
     async def fetch(
@@ -136,6 +444,7 @@ class _AsyncBase:
         limit: int = 1000,
         last: Union[str, None] = None,
         desc: bool = False,
+        columns: Union[List[str], bool, None] = None,
     ):
         payload = {}
         if query:
@@ -147,12 +456,13 @@ class _AsyncBase:
         if desc:
             payload["sort"] = "desc" 
 
-        async with self._session.post(f"{self._base_url}/query", json=payload) as resp:
-            resp_json = await resp.json()
-            paging = resp_json.get("paging")
-            return FetchResponse(
-                paging.get("size"), paging.get("last"), resp_json.get("items")
-            )
+        async def read():
+            async with self._request("POST", "/query", json=payload, op="fetch") as resp:
+                resp_json = await resp.json()
+                paging = resp_json.get("paging")
+                return _fetch_response(paging, resp_json.get("items"), columns)
+
+        return await self._read("fetch", read)
 
     async def update(
         self,
@@ -197,4 +507,128 @@ class _AsyncBase:
 
         key = quote(key, safe="")
 
-        await self._session.patch(f"{self._base_url}/items/{key}", json=payload)
+        async with self._request("PATCH", f"/items/{key}", json=payload, op="update"):
+            return
+
+
+class _AsyncDrive(_AsyncService):
+    service = "drive"
+    # files are decompressed like by the sync client, not by aiohttp
+    _session_options = {"auto_decompress": False}
+
+    def __init__(
+        self,
+        name: str,
+        project_key: str,
+        project_id: str,
+        host: Union[str, None] = None,
+        transport=None,
+        hooks: Union[List[RequestHook], None] = None,
+        timeouts: Union[Timeouts, None] = None,
+        circuit_breaker: Union[CircuitBreaker, None] = None,
+    ):
+        if not name:
+            raise AssertionError("No Drive name provided")
+
+        host = host or os.getenv("DETA_DRIVE_HOST") or "drive.deta.sh"
+        super().__init__(
+            host,
+            name,
+            project_id,
+            {"X-API-Key": project_key},
+            transport,
+            hooks,
+            timeouts=timeouts,
+            circuit_breaker=circuit_breaker,
+        )
+
+    async def get(self, name: str, *, decompress: Union[bool, None] = None):
+        """Get/Download a file from drive.
+        `decompress` controls decompression of files put with `compress`, like in `Drive.get`.
+        Returns the content of the file, None if it does not exist.
+        """
+        try:
+            async with self._request(
+                "GET", "/files/download", params={"name": name}, op="get"
+            ) as resp:
+                encoding = _content_encoding(resp.headers.get("Content-Encoding"), decompress)
+                body = await resp.read()
+        except aiohttp.ClientResponseError as e:
+            if e.status == 404:
+                return
+            else:
+                raise e
+        if encoding is None:
+            return body
+        decompressor = _Decompressor(encoding)
+        return decompressor.decompress(body) + decompressor.flush()
+
+    @tracing.traced("deta.drive.get_many")
+    async def get_many(
+        self,
+        names: Iterable[str],
+        dest_dir: Union[str, Path, None] = None,
+        *,
+        callback: Union[Callable[[str, aiohttp.StreamReader], Awaitable[None]], None] = None,
+        concurrency: int = 8,
+        decompress: Union[bool, None] = None,
+    ):
+        """Get/Download many files from drive.
+        `dest_dir` is the directory files are written to, keeping the path in their name.
+        `callback` is awaited with the name and the body stream of each file instead,
+        only its `iter_chunked` when the file may need decompressing.
+        `concurrency` is the number of files downloaded at the same time.
+        `decompress` controls decompression of files put with `compress`, like in `Drive.get`.
+        Returns a dict with 'downloaded' and 'missing' names and 'failed' files with their error.
+        """
+        if (dest_dir is None) == (callback is None):
+            raise AssertionError("Provide either dest_dir or callback")
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def download(name):
+            async with semaphore:
+                path = _destination(dest_dir, name) if dest_dir is not None else None
+                try:
+                    async with self._request(
+                        "GET", "/files/download", params={"name": name}, op="get"
+                    ) as resp:
+                        content = resp.content
+                        encoding = _content_encoding(resp.headers.get("Content-Encoding"), decompress)
+                        if encoding is not None:
+                            content = _DecompressingStream(content, encoding)
+                        if callback:
+                            await callback(name, content)
+                        else:
+                            await _write_body(path, content)
+                except aiohttp.ClientResponseError as e:
+                    if e.status == 404:
+                        return False
+                    raise e
+                return True
+
+        names = list(names)
+        results = await asyncio.gather(
+            *(download(name) for name in names), return_exceptions=True
+        )
+        result = {"downloaded": [], "missing": [], "failed": {}}
+        for name, found in zip(names, results):
+            if isinstance(found, BaseException):
+                result["failed"][name] = str(found)
+            else:
+                result["downloaded" if found else "missing"].append(name)
+        return result
+
+
+async def _write_body(path: Path, stream: aiohttp.StreamReader):
+    # write next to the destination and rename, a failed download leaves no partial file
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f".{path.name}.tmp-{id(stream)}")
+    try:
+        with open(tmp, "wb") as f:
+            async for chunk in stream.iter_chunked(DOWNLOAD_CHUNK_SIZE):
+                f.write(chunk)
+        os.replace(tmp, path)
+    except BaseException:
+        if tmp.exists():
+            os.remove(tmp)
+        raise
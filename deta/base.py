@@ -1,20 +1,45 @@
 import os
+import csv
+import json
+import time
+import tempfile
 import datetime
-from typing import Union, List, Tuple, Optional
+import itertools
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from pathlib import Path
+from typing import Union, List, Tuple, Optional, Iterable
 from urllib.parse import quote
 
+from .instrumentation import RequestHook
+from . import tracing
 from .service import _Service, JSON_MIME
+from .utils import _parallel_chain, _in_context
 
 # timeout for Base service in seconds
 BASE_SERVICE_TIMEOUT = 300
+DEFAULT_BASE_HOST = "database.deta.sh"
 BASE_TTL_ATTTRIBUTE = "__expires"
 
+_MISSING = object()
+
 
 class FetchResponse:
-    def __init__(self, count=0, last=None, items=[]):
+    """A single page of fetched items.
+    Items are kept either as a list of dicts or, when built with `columns`,
+    as one list per field. Iterating a columnar response builds item dicts lazily,
+    with only the fields each item has, `missing` holding the positions of the
+    items lacking each field. Columns are built from the decoded page, they
+    don't lower the memory needed to fetch it.
+    """
+
+    __slots__ = ("_count", "_last", "_items", "_columns", "_missing")
+
+    def __init__(self, count=0, last=None, items=None, *, columns=None, missing=None):
         self._count = count
         self._last = last
-        self._items = items
+        self._items = items if items is not None or columns is not None else []
+        self._columns = columns
+        self._missing = missing or {}
 
     @property
     def count(self):
@@ -26,8 +51,40 @@ class FetchResponse:
 
     @property
     def items(self):
+        if self._items is None:
+            # built once, the columns are left as they are
+            self._items = list(self)
         return self._items
 
+    @property
+    def columns(self):
+        """Per-field lists of values, missing fields are filled with `None`."""
+        if self._columns is None:
+            return _to_columns(self._items)
+        return self._columns
+
+    def __len__(self):
+        return self._count if self._items is None else len(self._items)
+
+    def __iter__(self):
+        if self._items is not None:
+            return iter(self._items)
+        fields = list(self._columns)
+        rows = (dict(zip(fields, row)) for row in zip(*self._columns.values()))
+        if not self._missing:
+            return rows
+        return self._without_missing(rows)
+
+    def _without_missing(self, rows):
+        for i, item in enumerate(rows):
+            for field, positions in self._missing.items():
+                if i in positions:
+                    del item[field]
+            yield item
+
+    def __repr__(self):
+        return "FetchResponse(count={!r}, last={!r})".format(self._count, self._last)
+
     def __eq__(self, other):
         return (
             self.count == other.count
@@ -36,6 +93,52 @@ class FetchResponse:
         )
 
 
+def _to_columns(items: List[dict], fields: Union[List[str], None] = None):
+    if fields is None:
+        fields = []
+        seen = set()
+        for item in items:
+            for field in item:
+                if field not in seen:
+                    seen.add(field)
+                    fields.append(field)
+    return {field: [item.get(field) for item in items] for field in fields}
+
+
+def _missing(items: List[dict], fields: Iterable[str]) -> dict:
+    """Positions of the items lacking each of `fields`, for the fields some items lack."""
+    missing = {}
+    for field in fields:
+        positions = {i for i, item in enumerate(items) if field not in item}
+        if positions:
+            missing[field] = positions
+    return missing
+
+
+def _csv_row(item: dict) -> dict:
+    return {k: json.dumps(v) if isinstance(v, (dict, list)) else v for k, v in item.items()}
+
+
+def _csv_record(row: dict) -> dict:
+    # a blank key cell leaves the key to the service instead of sending ""
+    if row.get("key") == "":
+        del row["key"]
+    return row
+
+
+class _ByteCounter:
+    """Text file writing utf-8 to a binary file and counting the bytes written."""
+
+    def __init__(self, f):
+        self._f = f
+        self.bytes = 0
+
+    def write(self, s: str) -> int:
+        data = s.encode("utf-8")
+        self.bytes += len(data)
+        return self._f.write(data)
+
+
 class Util:
     class Trim:
         pass
@@ -72,16 +175,34 @@ class Util:
 
 
 class _Base(_Service):
-    def __init__(self, name: str, project_key: str, project_id: str, host: Union[str, None] = None):
+    service = "base"
+
+    def __init__(
+        self,
+        name: str,
+        project_key: str,
+        project_id: str,
+        host: Union[str, None] = None,
+        transport=None,
+        hooks: Union[List[RequestHook], None] = None,
+        hedging=None,
+        timeouts=None,
+        circuit_breaker=None,
+    ):
         assert name, "No Base name provided"
 
-        host = host or os.getenv("DETA_BASE_HOST") or "database.deta.sh"
+        host = host or os.getenv("DETA_BASE_HOST") or DEFAULT_BASE_HOST
         super().__init__(
             project_key=project_key,
             project_id=project_id,
             host=host,
             name=name,
             timeout=BASE_SERVICE_TIMEOUT,
+            transport=transport,
+            hooks=hooks,
+            hedging=hedging,
+            timeouts=timeouts,
+            circuit_breaker=circuit_breaker,
         )
         self.__ttl_attribute = "__expires"
         self.util = Util()
@@ -92,7 +213,7 @@ class _Base(_Service):
 
         # encode key
         key = quote(key, safe="")
-        _, res = self._request("/items/{}".format(key), "GET")
+        _, res = self._read("/items/{}".format(key), "GET", op="get")
         return res or None
 
     def delete(self, key: str):
@@ -104,7 +225,7 @@ class _Base(_Service):
 
         # encode key
         key = quote(key, safe="")
-        self._request("/items/{}".format(key), "DELETE")
+        self._request("/items/{}".format(key), "DELETE", op="delete")
         return None
 
     def insert(
@@ -126,7 +247,7 @@ class _Base(_Service):
         insert_ttl(data, self.__ttl_attribute,
                    expire_in=expire_in, expire_at=expire_at)
         code, res = self._request(
-            "/items", "POST", {"item": data}, content_type=JSON_MIME
+            "/items", "POST", {"item": data}, content_type=JSON_MIME, op="insert"
         )
         if code == 201:
             return res
@@ -157,7 +278,7 @@ class _Base(_Service):
         insert_ttl(data, self.__ttl_attribute,
                    expire_in=expire_in, expire_at=expire_at)
         code, res = self._request(
-            "/items", "PUT", {"items": [data]}, content_type=JSON_MIME
+            "/items", "PUT", {"items": [data]}, content_type=JSON_MIME, op="put"
         )
 
         if code == 207 and "processed" in res:
@@ -173,6 +294,20 @@ class _Base(_Service):
         expire_at: Union[int, float, datetime.datetime, None] = None,
     ):
         assert len(items) <= 25, "We can't put more than 25 items at a time."
+        _items = self._prepare_items(items, expire_in=expire_in, expire_at=expire_at)
+
+        _, res = self._request(
+            "/items", "PUT", {"items": _items}, content_type=JSON_MIME, op="put_many"
+        )
+        return res
+
+    def _prepare_items(
+        self,
+        items: Iterable[Union[dict, list, str, int, bool]],
+        *,
+        expire_in: Union[int, None] = None,
+        expire_at: Union[int, float, datetime.datetime, None] = None,
+    ) -> List[dict]:
         _items = []
         for i in items:
             data = i
@@ -182,11 +317,104 @@ class _Base(_Service):
                 data, self.__ttl_attribute, expire_in=expire_in, expire_at=expire_at
             )
             _items.append(data)
+        return _items
 
+    @tracing.traced("deta.base.import_file")
+    def import_file(
+        self,
+        path: Union[str, Path],
+        format: Union[str, None] = None,
+        *,
+        concurrency: int = 4,
+        checkpoint: Union[str, Path, bool] = True,
+        expire_in: Union[int, None] = None,
+        expire_at: Union[int, float, datetime.datetime, None] = None,
+    ) -> dict:
+        """
+        import items from a jsonl or csv file, streaming it in batches of 25 items.
+            `format` is "jsonl" or "csv", guessed from the file extension if not provided.
+            `concurrency` is the number of batches written at the same time.
+            `checkpoint` is the file where progress is recorded, defaults to `<path>.checkpoint`.
+            An interrupted import started again with the same checkpoint skips the items already written,
+            items of the batches in flight when it stopped are written again.
+            Pass `False` to disable checkpointing.
+        Returns a dict with the number of `items` written, `failed` items, `seconds` taken and `items_per_second`.
+        """
+        format = format or os.path.splitext(str(path))[1].lstrip(".").lower()
+        if format not in ("jsonl", "csv"):
+            raise ValueError("format should be one of 'jsonl' or 'csv'")
+        assert concurrency > 0, "concurrency should be at least 1"
+
+        if checkpoint is True:
+            checkpoint = str(path) + ".checkpoint"
+        offset = 0
+        if checkpoint and os.path.exists(checkpoint):
+            with open(checkpoint) as f:
+                offset = json.load(f)["offset"]
+
+        started = time.monotonic()
+        failed = 0
+        with open(path, encoding="utf-8", newline="") as f:
+            if format == "csv":
+                records = map(_csv_record, csv.DictReader(f))
+            else:
+                records = (json.loads(line) for line in f if line.strip())
+            records = itertools.islice(records, offset, None)
+
+            pending = {}
+            finished = {}
+            submitted = committed = 0
+            position = offset
+            exhausted = False
+            with ThreadPoolExecutor(concurrency) as executor:
+                while not exhausted or pending:
+                    # backpressure, only read ahead while writers have room
+                    while not exhausted and len(pending) < concurrency * 2:
+                        batch = list(itertools.islice(records, 25))
+                        if not batch:
+                            exhausted = True
+                            break
+                        items = self._prepare_items(
+                            batch, expire_in=expire_in, expire_at=expire_at
+                        )
+                        future = executor.submit(_in_context(self._put_batch), items)
+                        pending[future] = (submitted, len(batch))
+                        submitted += 1
+                    if not pending:
+                        break
+
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        seq, size = pending.pop(future)
+                        failed += future.result()
+                        finished[seq] = size
+
+                    # batches finish out of order, the checkpoint only moves past
+                    # a batch once every batch before it has been written
+                    while committed in finished:
+                        position += finished.pop(committed)
+                        committed += 1
+                    if checkpoint:
+                        _write_checkpoint(checkpoint, position)
+
+        if checkpoint and os.path.exists(checkpoint):
+            os.remove(checkpoint)
+
+        count = position - offset
+        seconds = time.monotonic() - started
+        tracing.current_span().set_attributes({"deta.items": count, "deta.failed": failed})
+        return {
+            "items": count - failed,
+            "failed": failed,
+            "seconds": seconds,
+            "items_per_second": count / seconds if seconds else 0.0,
+        }
+
+    def _put_batch(self, items: List[dict]) -> int:
         _, res = self._request(
-            "/items", "PUT", {"items": _items}, content_type=JSON_MIME
+            "/items", "PUT", {"items": items}, content_type=JSON_MIME, op="put_many"
         )
-        return res
+        return len((res or {}).get("failed", {}).get("items", []))  # pyright: ignore
 
     def _fetch(
         self,
@@ -205,8 +433,8 @@ class _Base(_Service):
         if query:
             payload["query"] = query if isinstance(query, list) else [query]
 
-        _, res = self._request(
-            "/query", "POST", payload, content_type=JSON_MIME)
+        _, res = self._read(
+            "/query", "POST", payload, content_type=JSON_MIME, op="fetch")
 
         return res
 
@@ -217,20 +445,226 @@ class _Base(_Service):
         limit: int = 1000,
         last: Union[str, None] = None,
         desc: bool = False,
-
+        columns: Union[List[str], bool, None] = None,
     ):
         """
         fetch items from the database.
             `query` is an optional filter or list of filters. Without filter, it will return the whole db.
+            `columns` returns the page in columnar form, one list per field, instead of one dict per item.
+            Pass a list of field names to keep only those fields or `True` to keep all of them.
         """
 
         res = self._fetch(query, limit, last, desc)
 
         paging = res.get("paging")  # pyright: ignore
 
-        return FetchResponse(paging.get("size"),
-                             paging.get("last"),
-                             res.get("items"))  # pyright: ignore
+        return _fetch_response(paging, res.get("items"), columns)  # pyright: ignore
+
+    def _pages(
+        self,
+        query: Union[dict, list, None] = None,
+        *,
+        limit: int = 1000,
+        desc: bool = False,
+    ):
+        """Fetch page after page until the last one, yields the items of each page."""
+        # a generator can't keep its span current across yields,
+        # it is only made current while the next page is fetched
+        span = tracing.start_span("deta.base.scan", {"deta.name": self.name})
+        pages = items = 0
+        last = None
+        try:
+            while True:
+                with tracing.use_span(span):
+                    res = self._fetch(query, limit, last, desc)
+                pages += 1
+                items += len(res.get("items") or [])  # pyright: ignore
+                yield res.get("items") or []  # pyright: ignore
+                last = res.get("paging", {}).get("last")  # pyright: ignore
+                if not last:
+                    return
+        finally:
+            span.set_attributes({"deta.pages": pages, "deta.items": items})
+            span.end()
+
+    def iter_fetch(
+        self,
+        query: Union[dict, list, None] = None,
+        *,
+        limit: int = 1000,
+        desc: bool = False,
+    ):
+        """
+        fetch all items matching `query`, following pagination.
+            `limit` is the page size, only one page is held in memory at a time.
+        """
+        for items in self._pages(query, limit=limit, desc=desc):
+            yield from items
+
+    def _scan(self, query: Union[dict, list, None] = None, field: Union[str, None] = None):
+        """Yields `(key, value)` of `field` for every item matching `query`.
+        The OR-branches of a list query are scanned concurrently and an item matching
+        more than one branch is only yielded once. Items are dropped as soon as the
+        field is read, so only one page per branch is held in memory.
+        """
+        branches = query if isinstance(query, list) and len(query) > 1 else [query]
+
+        def scan(branch):
+            for items in self._pages(branch):
+                yield [
+                    (i["key"], _get_field(i, field) if field else _MISSING)
+                    for i in items
+                ]
+
+        seen = set() if len(branches) > 1 else None
+        for page in _parallel_chain([scan(b) for b in branches]):
+            for key, value in page:
+                if seen is not None:
+                    if key in seen:
+                        continue
+                    seen.add(key)
+                yield key, value
+
+    @tracing.traced("deta.base.count")
+    def count(self, query: Union[dict, list, None] = None) -> int:
+        """Count the items matching `query` without keeping them in memory."""
+        total = 0
+        for _ in self._scan(query):
+            total += 1
+        return total
+
+    @tracing.traced("deta.base.sum")
+    def sum(self, field: str, query: Union[dict, list, None] = None) -> Union[int, float]:
+        """Sum of the numeric values of `field` over the items matching `query`.
+        Items where `field` is missing or not a number are skipped.
+        """
+        total = 0
+        for _, value in self._scan(query, field):
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                total += value
+        return total
+
+    @tracing.traced("deta.base.min")
+    def min(self, field: str, query: Union[dict, list, None] = None):
+        """Smallest value of `field` over the items matching `query`, `None` if there is none.
+        Numbers and strings are compared, numbers first, other values are skipped.
+        """
+        return self._reduce(field, query, lambda a, b: b if b < a else a)
+
+    @tracing.traced("deta.base.max")
+    def max(self, field: str, query: Union[dict, list, None] = None):
+        """Largest value of `field` over the items matching `query`, `None` if there is none.
+        Numbers and strings are compared, strings last, other values are skipped.
+        """
+        return self._reduce(field, query, lambda a, b: b if b > a else a)
+
+    def _reduce(self, field: str, query: Union[dict, list, None], fn):
+        # (kind, value) pairs, fields of a schemaless Base can hold values which don't compare
+        result = _MISSING
+        for _, value in self._scan(query, field):
+            if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+                continue
+            value = (isinstance(value, str), value)
+            result = value if result is _MISSING else fn(result, value)
+        return None if result is _MISSING else result[1]
+
+    @tracing.traced("deta.base.group_count")
+    def group_count(self, field: str, query: Union[dict, list, None] = None) -> dict:
+        """Number of items per distinct value of `field` over the items matching `query`.
+        Items where `field` is missing are skipped, values are keyed by their JSON form,
+        so that `true`, `1` and `"1"` are counted apart.
+        """
+        groups = {}
+        for _, value in self._scan(query, field):
+            if value is _MISSING:
+                continue
+            value = json.dumps(value, sort_keys=True)
+            groups[value] = groups.get(value, 0) + 1
+        return groups
+
+    @tracing.traced("deta.base.export")
+    def export(
+        self,
+        path: Union[str, Path],
+        format: str = "jsonl",
+        *,
+        query: Union[dict, list, None] = None,
+        partitions: Union[List[Union[str, Tuple[str, str]]], None] = None,
+        columns: Union[List[str], None] = None,
+    ) -> dict:
+        """
+        export all items matching `query` to a file, page by page.
+            `format` is one of "jsonl" (one item per line), "csv" or "columnar"
+            (one line per page holding a JSON object of per-field lists).
+            `partitions` splits the scan into key ranges scanned in parallel, each one a
+            key prefix or a `(start, end)` tuple of keys. They should not overlap.
+            `columns` selects the fields to export. For csv, it defaults to all the fields
+            of the items, "key" first and the others sorted, found by spilling the items to a
+            temporary file first.
+        Returns a dict with the number of `items` and `bytes` written, `seconds` taken and `items_per_second`.
+        """
+        if format not in ("jsonl", "csv", "columnar"):
+            raise ValueError("format should be one of 'jsonl', 'csv' or 'columnar'")
+
+        scans = [self._pages(q) for q in _partition_queries(query, partitions)]
+
+        started = time.monotonic()
+        count = 0
+        with open(path, "wb") as raw:
+            f = _ByteCounter(raw)
+            if format == "csv":
+                count = self._export_csv(f, _parallel_chain(scans), columns)
+            else:
+                for items in _parallel_chain(scans):
+                    if not items:
+                        continue
+                    if format == "jsonl":
+                        for item in items:
+                            if columns:
+                                item = {c: item[c] for c in columns if c in item}
+                            f.write(json.dumps(item))
+                            f.write("\n")
+                    else:
+                        f.write(json.dumps(_to_columns(items, columns)))
+                        f.write("\n")
+                    count += len(items)
+            written = f.bytes
+
+        seconds = time.monotonic() - started
+        tracing.current_span().set_attributes({"deta.items": count, "deta.bytes": written})
+        return {
+            "items": count,
+            "bytes": written,
+            "seconds": seconds,
+            "items_per_second": count / seconds if seconds else 0.0,
+        }
+
+    @staticmethod
+    def _export_csv(f: _ByteCounter, pages: Iterable[List[dict]], columns: Union[List[str], None]) -> int:
+        count = 0
+        if columns:
+            writer = csv.DictWriter(f, columns)
+            writer.writeheader()
+            for items in pages:
+                writer.writerows(_csv_row({c: item[c] for c in columns if c in item}) for item in items)
+                count += len(items)
+            return count
+
+        # the header needs the fields of all the items, whichever page comes first
+        fields = set()
+        with tempfile.TemporaryFile() as spill:
+            for items in pages:
+                for item in items:
+                    fields.update(item)
+                    spill.write(json.dumps(item).encode("utf-8"))
+                    spill.write(b"\n")
+                count += len(items)
+            spill.seek(0)
+            writer = csv.DictWriter(f, sorted(fields, key=lambda field: (field != "key", field)))
+            writer.writeheader()
+            for line in spill:
+                writer.writerow(_csv_row(json.loads(line)))
+        return count
 
     def update(
         self,
@@ -276,15 +710,75 @@ class _Base(_Service):
             expire_at=expire_at,
         )
 
-        encoded_key = quote(key, safe="")
-        code, _ = self._request(
-            "/items/{}".format(encoded_key), "PATCH", payload, content_type=JSON_MIME
-        )
+        code = self._patch(key, payload)
         if code == 200:
             return None
         elif code == 404:
             raise Exception("Key '{}' not found".format(key))
 
+    def _patch(self, key: str, payload: dict) -> int:
+        encoded_key = quote(key, safe="")
+        code, _ = self._request(
+            "/items/{}".format(encoded_key), "PATCH", payload, content_type=JSON_MIME, op="update"
+        )
+        return code
+
+    def buffer(self, *, interval: float = 1.0, max_keys: int = 100, concurrency: int = 4):
+        """Buffer of increments, appends and prepends to items of this Base, merged per
+        key and attribute in memory and sent as one update per key, see `UpdateBuffer`.
+        """
+        from .updates import UpdateBuffer
+
+        return UpdateBuffer(self, interval=interval, max_keys=max_keys, concurrency=concurrency)
+
+
+def _get_field(item: dict, field: str):
+    """Value of `field` in `item`, nested fields are addressed with dots like in queries."""
+    if field in item:
+        return item[field]
+    value = item
+    for part in field.split("."):
+        if not isinstance(value, dict) or part not in value:
+            return _MISSING
+        value = value[part]
+    return value
+
+
+def _partition_queries(
+    query: Union[dict, list, None],
+    partitions: Union[List[Union[str, Tuple[str, str]]], None],
+) -> List[Union[dict, list, None]]:
+    """Split `query` into one query per key partition."""
+    if not partitions:
+        return [query]
+    branches = query if isinstance(query, list) else [query or {}]
+    queries = []
+    for p in partitions:
+        if isinstance(p, str):
+            cond = {"key?pfx": p}
+        else:
+            cond = {"key?r": list(p)}
+        queries.append([dict(b, **cond) for b in branches])
+    return queries
+
+
+def _write_checkpoint(path: Union[str, Path], offset: int):
+    # write to a temporary file first so an interruption never leaves a broken checkpoint
+    tmp = "{}.tmp".format(path)
+    with open(tmp, "w") as f:
+        json.dump({"offset": offset}, f)
+    os.replace(tmp, path)
+
+
+def _fetch_response(paging: dict, items: List[dict], columns: Union[List[str], bool, None] = None):
+    if not columns:
+        return FetchResponse(paging.get("size"), paging.get("last"), items)
+    fields = None if columns is True else list(columns)
+    page = _to_columns(items, fields)
+    return FetchResponse(
+        paging.get("size"), paging.get("last"), columns=page, missing=_missing(items, page)
+    )
+
 
 def insert_ttl(item, ttl_attribute, expire_in=None, expire_at=None):
     if expire_in and expire_at:
@@ -0,0 +1,167 @@
+import os
+import json
+import time
+import hashlib
+import tempfile
+import threading
+from pathlib import Path
+from typing import Union, BinaryIO
+
+# chunk size used to copy downloads into the cache
+CACHE_COPY_CHUNK_SIZE = 1024 * 1024
+
+
+class DiskCache:
+    """Size bounded on-disk cache for drive downloads.
+
+    File contents are stored once per sha256 digest under `objects/` and each
+    cached file name points to its digest and validators (ETag, Last-Modified)
+    in `index/`. Least recently used contents are evicted once `max_size` bytes
+    are exceeded. All writes go through a temporary file and an atomic rename.
+
+    `max_age` is the number of seconds a cached file is served without asking
+    drive whether it changed. After that, it is revalidated with a conditional
+    request when drive provided validators for it.
+    """
+
+    def __init__(
+        self,
+        path: Union[str, Path],
+        max_size: int = 1024 * 1024 * 1024,
+        *,
+        max_age: float = 0,
+    ):
+        self.path = Path(path)
+        self.max_size = max_size
+        self.max_age = max_age
+        self._objects = self.path / "objects"
+        self._index = self.path / "index"
+        self._objects.mkdir(parents=True, exist_ok=True)
+        self._index.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        # lookups answered from the cache or not, counted by the Drive clients
+        self.hits = 0
+        self.misses = 0
+        self._count_lock = threading.Lock()
+
+    def _index_path(self, key: str) -> Path:
+        return self._index / (hashlib.sha256(key.encode()).hexdigest() + ".json")
+
+    def lookup(self, key: str) -> Union[dict, None]:
+        """Return the index entry of `key` if its content is still cached."""
+        try:
+            with open(self._index_path(key)) as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if not (self._objects / entry["sha256"]).exists():
+            return None
+        return entry
+
+    def is_fresh(self, entry: dict) -> bool:
+        return time.time() - entry["stored_at"] < self.max_age
+
+    def get_path(self, entry: dict) -> Path:
+        """Local path of the cached content of `entry`, it can be mmap-ed."""
+        return self._objects / entry["sha256"]
+
+    def open(self, entry: dict) -> BinaryIO:
+        """Open the cached content of `entry`, raises `FileNotFoundError` if it was evicted since its lookup."""
+        path = self.get_path(entry)
+        # not evicted between the update of its last use and its opening, open files stay readable
+        with self._lock:
+            # mtime tracks the last use for eviction
+            os.utime(path)
+            return open(path, "rb")
+
+    def count(self, hit: bool):
+        """Count a lookup answered from the cache, or not, from any thread."""
+        with self._count_lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def store(
+        self,
+        key: str,
+        stream,
+        *,
+        etag=None,
+        last_modified=None,
+        content_encoding=None,
+    ) -> dict:
+        """Copy `stream` into the cache and return the new index entry of `key`."""
+        digest = hashlib.sha256()
+        size = 0
+        fd, tmp = tempfile.mkstemp(dir=self._objects, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                while True:
+                    chunk = stream.read(CACHE_COPY_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    digest.update(chunk)
+                    f.write(chunk)
+                    size += len(chunk)
+            os.replace(tmp, self._objects / digest.hexdigest())
+        except BaseException:
+            os.remove(tmp)
+            raise
+
+        entry = {
+            "sha256": digest.hexdigest(),
+            "size": size,
+            "etag": etag,
+            "last_modified": last_modified,
+            "content_encoding": content_encoding,
+            "stored_at": time.time(),
+        }
+        self._write_entry(key, entry)
+        self.evict(keep=entry["sha256"])
+        return entry
+
+    def touch(self, key: str, entry: dict) -> dict:
+        """Mark `entry` as fresh again after a successful revalidation."""
+        entry = dict(entry, stored_at=time.time())
+        self._write_entry(key, entry)
+        return entry
+
+    def discard(self, key: str):
+        try:
+            os.remove(self._index_path(key))
+        except FileNotFoundError:
+            pass
+
+    def _write_entry(self, key: str, entry: dict):
+        fd, tmp = tempfile.mkstemp(dir=self._index, prefix=".tmp-")
+        with os.fdopen(fd, "w") as f:
+            json.dump(entry, f)
+        os.replace(tmp, self._index_path(key))
+
+    def evict(self, keep: Union[str, None] = None):
+        """Remove least recently used contents until the cache fits in `max_size`.
+        `keep` is the digest of a content that should not be removed.
+        """
+        with self._lock:
+            objects = []
+            total = 0
+            for path in self._objects.iterdir():
+                if path.name.startswith(".tmp-"):
+                    continue
+                try:
+                    stat = path.stat()
+                except FileNotFoundError:
+                    continue
+                total += stat.st_size
+                if path.name != keep:
+                    objects.append((stat.st_mtime, stat.st_size, path))
+            objects.sort()
+            for _, size, path in objects:
+                if total <= self.max_size:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
@@ -0,0 +1,164 @@
+"""Circuit breaker failing requests fast while the Base or Drive service is unhealthy.
+
+    from deta import Deta
+    from deta.circuit import CircuitBreaker
+
+    deta = Deta(circuit_breaker=CircuitBreaker(failure_rate=0.5, open_for=30))
+
+The outcomes of the last `window` requests to each host are kept. Once enough
+of them failed, or took longer than `slow_call` seconds, the circuit of the
+host opens and its requests raise `CircuitOpenError` without being sent, for
+`open_for` seconds. Then a few probe requests are let through: the circuit
+closes if they succeed and opens again otherwise. Errors, timeouts and 5xx
+statuses are failures, other statuses are answers of a healthy service.
+
+`Drive.get` with a `DiskCache` returns the cached copy of a file, fresh or
+not, instead of raising while the circuit is open.
+"""
+import threading
+import time
+from collections import deque
+from typing import Callable, Union
+
+from .instrumentation import RequestRecord
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    def __init__(self, host: str, retry_after: float):
+        super().__init__(f"Circuit open for {host}, retry in {retry_after:.1f}s")
+        self.host = host
+        # seconds until requests are let through again
+        self.retry_after = retry_after
+
+
+class _Circuit:
+    __slots__ = ("state", "outcomes", "opened_at", "probes", "passed")
+
+    def __init__(self, window: int):
+        self.state = CLOSED
+        # (failed, slow) of the last requests
+        self.outcomes = deque(maxlen=window)
+        self.opened_at = 0.0
+        # probes in flight and probes which succeeded while half open
+        self.probes = 0
+        self.passed = 0
+
+
+class CircuitBreaker:
+    """Per-host circuit breaker shared by the clients of a `Deta`.
+
+    A circuit opens when at least `min_calls` of the last `window` requests were
+    sent and `failure_rate` of them failed, or `slow_rate` of them took longer
+    than `slow_call` seconds, which isn't checked by default. It lets `probes`
+    requests through after `open_for` seconds and closes once they succeeded.
+    """
+
+    def __init__(
+        self,
+        *,
+        failure_rate: float = 0.5,
+        slow_call: Union[float, None] = None,
+        slow_rate: float = 0.5,
+        window: int = 20,
+        min_calls: int = 10,
+        open_for: float = 30,
+        probes: int = 1,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        assert 0 < failure_rate <= 1, "failure_rate should be between 0 and 1"
+        assert 0 < slow_rate <= 1, "slow_rate should be between 0 and 1"
+        assert 0 < min_calls <= window, "min_calls should be between 1 and window"
+        self.failure_rate = failure_rate
+        self.slow_call = slow_call
+        self.slow_rate = slow_rate
+        self.window = window
+        self.min_calls = min_calls
+        self.open_for = open_for
+        self.probes = probes
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._circuits = {}
+
+    def _circuit(self, host: str) -> _Circuit:
+        circuit = self._circuits.get(host)
+        if circuit is None:
+            circuit = self._circuits[host] = _Circuit(self.window)
+        return circuit
+
+    def state(self, host: str) -> str:
+        """'closed', 'open' or 'half_open'."""
+        with self._lock:
+            circuit = self._circuits.get(host)
+            if circuit is None:
+                return CLOSED
+            if circuit.state == OPEN and self._clock() - circuit.opened_at >= self.open_for:
+                return HALF_OPEN
+            return circuit.state
+
+    def allow(self, host: str):
+        """Raise `CircuitOpenError` if a request to `host` shouldn't be sent."""
+        with self._lock:
+            circuit = self._circuit(host)
+            if circuit.state == CLOSED:
+                return
+            if circuit.state == OPEN:
+                retry_after = circuit.opened_at + self.open_for - self._clock()
+                if retry_after > 0:
+                    raise CircuitOpenError(host, retry_after)
+                circuit.state = HALF_OPEN
+                circuit.probes = circuit.passed = 0
+            if circuit.probes >= self.probes:
+                raise CircuitOpenError(host, 0.0)
+            circuit.probes += 1
+
+    def record(self, host: str, record: RequestRecord):
+        """Count the outcome of a request to `host` allowed by `allow`."""
+        failed = record.status >= 500 if record.status is not None else isinstance(record.error, Exception)
+        slow = self.slow_call is not None and record.duration > self.slow_call
+        with self._lock:
+            circuit = self._circuit(host)
+            if circuit.state == HALF_OPEN:
+                circuit.probes = max(circuit.probes - 1, 0)
+                if failed or slow:
+                    self._open(circuit)
+                else:
+                    circuit.passed += 1
+                    if circuit.passed >= self.probes:
+                        circuit.state = CLOSED
+                        circuit.outcomes.clear()
+                return
+            if circuit.state == OPEN:
+                # sent before the circuit opened
+                return
+            circuit.outcomes.append((failed, slow))
+            calls = len(circuit.outcomes)
+            if calls < self.min_calls:
+                return
+            failures = sum(1 for f, _ in circuit.outcomes if f)
+            slows = sum(1 for _, s in circuit.outcomes if s)
+            if failures >= self.failure_rate * calls or slows >= self.slow_rate * calls:
+                self._open(circuit)
+
+    def release(self, host: str):
+        """Forget a request to `host` allowed by `allow` and cancelled before its outcome was known."""
+        with self._lock:
+            circuit = self._circuit(host)
+            if circuit.state == HALF_OPEN:
+                circuit.probes = max(circuit.probes - 1, 0)
+
+    def _open(self, circuit: _Circuit):
+        circuit.state = OPEN
+        circuit.opened_at = self._clock()
+        circuit.outcomes.clear()
+
+    def reset(self, host: Union[str, None] = None):
+        """Close the circuit of `host`, or of all hosts."""
+        with self._lock:
+            if host is None:
+                self._circuits = {}
+            else:
+                self._circuits.pop(host, None)
@@ -1,31 +1,108 @@
 import os
-from typing import Union, List
-from io import BufferedIOBase, TextIOBase, RawIOBase, StringIO, BytesIO
+import json
+import base64
+import hashlib
+import zlib
+import struct
+import threading
+import urllib.error
+import itertools
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from pathlib import Path
+from typing import Union, List, Iterable, Iterator, AsyncIterable, Callable
+from io import BufferedIOBase, TextIOBase, RawIOBase
 from urllib.parse import quote_plus
 
+from . import tracing
+from .cache import DiskCache
+from .circuit import CircuitOpenError
+from .instrumentation import RequestHook
 from .service import JSON_MIME, _Service
+from .utils import _in_context
 
 # 10 MB upload chunk size
 UPLOAD_CHUNK_SIZE = 1024 * 1024 * 10
 
+# maximum number of parts in an upload
+MAX_UPLOAD_PARTS = 10000
+
+# parts of uploads of unknown size double in size every this many parts
+UPLOAD_PART_GROWTH_INTERVAL = 1000
+
+# attempts to upload a single part
+PART_UPLOAD_RETRIES = 3
+
+# compressed bytes read at a time when decompressing a download
+DECOMPRESS_READ_SIZE = 64 * 1024
+
+# first bytes of data compressed with each supported encoding
+COMPRESSION_MAGIC = {"gzip": b"\x1f\x8b", "zstd": b"\x28\xb5\x2f\xfd"}
+
+# first bytes of the files compressed by `Drive.put`, recognized whatever drive
+# reports: a gzip header with a "DT" extra field, and a zstd skippable frame,
+# which other gzip and zstd decoders ignore
+COMPRESSION_MARKS = {
+    "gzip": b"\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff" + struct.pack("<H", 8) + b"DT" + struct.pack("<H", 4) + b"deta",
+    "zstd": struct.pack("<II", 0x184D2A5D, 4) + b"deta",
+}
+
+# chunk size used to write downloads to files
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
 # timeout for Drive service in seconds
 DRIVE_SERVICE_TIMEOUT = 300
+DEFAULT_DRIVE_HOST = "drive.deta.sh"
+
+# file in a synced directory recording what was uploaded
+SYNC_MANIFEST_NAME = ".deta-sync.json"
+
+
+class ChecksumMismatch(Exception):
+    pass
 
 
 class DriveStreamingBody:
-    def __init__(self, res: BufferedIOBase):
+    def __init__(
+        self,
+        res: BufferedIOBase,
+        *,
+        sha256: Union[str, None] = None,
+        md5: Union[str, None] = None,
+    ):
         self.__stream = res
+        # digests checked once the whole body has been read,
+        # `sha256` is hex encoded and `md5` base64 encoded like in Content-MD5
+        self.__checks = []
+        if sha256:
+            self.__checks.append(("sha256", hashlib.sha256(), bytes.fromhex(sha256)))
+        if md5:
+            self.__checks.append(("md5", hashlib.md5(), base64.b64decode(md5)))
 
     @property
     def closed(self):
         return self.__stream.closed
 
+    def __verify(self, chunk: bytes, eof: bool):
+        for _, digest, _ in self.__checks:
+            digest.update(chunk)
+        if not eof:
+            return
+        checks, self.__checks = self.__checks, []
+        for algorithm, digest, expected in checks:
+            if digest.digest() != expected:
+                raise ChecksumMismatch(
+                    f"Downloaded file does not match its {algorithm} checksum"
+                )
+
     def read(self, size: Union[int, None] = None):
-        return self.__stream.read(size)
+        chunk = self.__stream.read(size)
+        if self.__checks:
+            self.__verify(chunk, not chunk or size is None or size < 0)
+        return chunk
 
     def iter_chunks(self, chunk_size: int = 1024):
         while True:
-            chunk = self.__stream.read(chunk_size)
+            chunk = self.read(chunk_size)
             if not chunk:
                 break
             yield chunk
@@ -33,6 +110,8 @@ class DriveStreamingBody:
     def iter_lines(self, chunk_size: int = 1024):
         while True:
             chunk = self.__stream.readline(chunk_size)
+            if self.__checks:
+                self.__verify(chunk, not chunk)
             if not chunk:
                 break
             yield chunk
@@ -46,15 +125,22 @@ class DriveStreamingBody:
 
 
 class _Drive(_Service):
+    service = "drive"
+
     def __init__(
         self,
         name: Union[str, None] = None,
         project_key: Union[str, None] = None,
         project_id: Union[str, None] = None,
         host: Union[str, None] = None,
+        cache: Union[DiskCache, None] = None,
+        transport=None,
+        hooks: Union[List[RequestHook], None] = None,
+        timeouts=None,
+        circuit_breaker=None,
     ):
         assert name, "No Drive name provided"
-        host = host or os.getenv("DETA_DRIVE_HOST") or "drive.deta.sh"
+        host = host or os.getenv("DETA_DRIVE_HOST") or DEFAULT_DRIVE_HOST
 
         assert project_key, "Project key must be provided"
         assert project_id, "Project id must be provided"
@@ -65,24 +151,142 @@ class _Drive(_Service):
             host=host,
             name=name,
             timeout=DRIVE_SERVICE_TIMEOUT,
-            keep_alive=False,
+            transport=transport,
+            hooks=hooks,
+            timeouts=timeouts,
+            circuit_breaker=circuit_breaker,
         )
+        self.cache = cache
 
     def _quote(self, param: str):
         return quote_plus(param)
 
-    def get(self, name: str):
+    def get(
+        self,
+        name: str,
+        *,
+        sha256: Union[str, None] = None,
+        decompress: Union[bool, None] = None,
+    ):
         """Get/Download a file from drive.
         `name` is the name of the file.
+        `sha256` is the expected hex digest of the file, checked while it is read.
+        The body is also checked against the Content-MD5 header when drive sends one.
+        Reading the end of a body that does not match raises ChecksumMismatch.
+        `decompress` controls decompression of files put with `compress`. By default they
+        are recognized from their first bytes, or the Content-Encoding drive reports, and
+        decompressed. `True` also decompresses any gzip and zstd data, put compressed
+        by other means, and `False` returns the stored bytes.
         Returns a DriveStreamingBody.
         """
         assert name, "No name provided"
+        if self.cache:
+            return self._get_cached(name, sha256, decompress)
         _, res = self._request(
-            f"/files/download?name={self._quote(name)}", "GET", stream=True
+            f"/files/download?name={self._quote(name)}", "GET", stream=True, op="get"
         )
-        if res:
-            return DriveStreamingBody(res)  # pyright: ignore
-        return None
+        if not res:
+            return None
+        md5 = res.getheader("Content-MD5")  # pyright: ignore
+        encoding = _content_encoding(res.getheader("Content-Encoding"), decompress)  # pyright: ignore
+        if encoding is None:
+            return DriveStreamingBody(res, sha256=sha256, md5=md5)  # pyright: ignore
+        # the checksum header is about the stored bytes, the expected sha256 about the original ones
+        stream = DriveStreamingBody(res, md5=md5)  # pyright: ignore
+        return DriveStreamingBody(_DecompressingReader(stream, encoding), sha256=sha256)  # pyright: ignore
+
+    def _get_cached(
+        self,
+        name: str,
+        sha256: Union[str, None] = None,
+        decompress: Union[bool, None] = None,
+    ):
+        assert self.cache
+        key = f"{self.host}{self.base_path}/{name}"
+        try:
+            return self._get_cached_once(key, name, sha256, decompress)
+        except FileNotFoundError:
+            # evicted by another thread between its lookup and opening, as good as missing
+            self.cache.discard(key)
+            return self._get_cached_once(key, name, sha256, decompress)
+
+    def _get_cached_once(
+        self,
+        key: str,
+        name: str,
+        sha256: Union[str, None] = None,
+        decompress: Union[bool, None] = None,
+    ):
+        assert self.cache
+        entry = self.cache.lookup(key)
+        if entry and self.cache.is_fresh(entry):
+            body = self._open_cached(key, entry, sha256, decompress)
+            self.cache.count(hit=True)
+            return body
+
+        # ask drive to only send the file if it changed
+        headers = {}
+        if entry and entry["etag"]:
+            headers["If-None-Match"] = entry["etag"]
+        if entry and entry["last_modified"]:
+            headers["If-Modified-Since"] = entry["last_modified"]
+
+        try:
+            status, res = self._request(
+                f"/files/download?name={self._quote(name)}",
+                "GET",
+                headers=headers,
+                stream=True,
+                op="get",
+            )
+        except CircuitOpenError:
+            # drive is unhealthy, a stale copy is better than none
+            if not entry:
+                raise
+            body = self._open_cached(key, entry, sha256, decompress)
+            self.cache.count(hit=True)
+            return body
+        if not res:
+            self.cache.discard(key)
+            return None
+
+        try:
+            if status == 304 and entry:
+                res.read()  # pyright: ignore
+                self.cache.count(hit=True)
+                entry = self.cache.touch(key, entry)
+            else:
+                self.cache.count(hit=False)
+                entry = self.cache.store(
+                    key,
+                    DriveStreamingBody(res, md5=res.getheader("Content-MD5")),  # pyright: ignore
+                    etag=res.getheader("ETag"),  # pyright: ignore
+                    last_modified=res.getheader("Last-Modified"),  # pyright: ignore
+                    content_encoding=res.getheader("Content-Encoding"),  # pyright: ignore
+                )
+        finally:
+            res.close()  # pyright: ignore
+        return self._open_cached(key, entry, sha256, decompress)
+
+    def _open_cached(
+        self,
+        key: str,
+        entry: dict,
+        sha256: Union[str, None] = None,
+        decompress: Union[bool, None] = None,
+    ):
+        assert self.cache
+        encoding = _content_encoding(entry.get("content_encoding"), decompress)
+        if encoding:
+            return DriveStreamingBody(
+                _DecompressingReader(self.cache.open(entry), encoding),  # pyright: ignore
+                sha256=sha256,
+            )
+        # the cache already knows the digest of its contents
+        if sha256 and entry["sha256"] != sha256.lower():
+            self.cache.discard(key)
+            raise ChecksumMismatch("Downloaded file does not match its sha256 checksum")
+        return DriveStreamingBody(self.cache.open(entry))  # pyright: ignore
 
     def delete_many(self, names: List[str]):
         """Delete many files from drive in single request.
@@ -92,10 +296,50 @@ class _Drive(_Service):
         assert names, "Names is empty"
         assert len(names) <= 1000, "More than 1000 names to delete"
         _, res = self._request(
-            "/files", "DELETE", {"names": names}, content_type=JSON_MIME
+            "/files", "DELETE", {"names": names}, content_type=JSON_MIME, op="delete_many"
         )
         return res
 
+    @tracing.traced("deta.drive.delete_all")
+    def delete_all(self, names: Iterable[str], *, concurrency: int = 4):
+        """Delete any number of files from drive.
+        `names` is an iterable of names, consumed lazily and deleted in chunks of 1000.
+        `concurrency` is the number of chunks deleted at the same time.
+        Returns a dict with 'deleted' and 'failed' files.
+        """
+        assert concurrency > 0, "concurrency should be at least 1"
+        names = iter(names)
+        result = {"deleted": [], "failed": {}}
+
+        def collect(futures):
+            for future in futures:
+                res = future.result() or {}
+                result["deleted"].extend(res.get("deleted", []))
+                result["failed"].update(res.get("failed", {}))
+
+        with ThreadPoolExecutor(concurrency) as executor:
+            pending = set()
+            while True:
+                chunk = list(itertools.islice(names, 1000))
+                if not chunk:
+                    break
+                pending.add(executor.submit(_in_context(self.delete_many), chunk))
+                # only read more names once a chunk is done
+                if len(pending) >= concurrency:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    collect(done)
+            collect(pending)
+        tracing.current_span().set_attribute("deta.files", len(result["deleted"]))
+        return result
+
+    def delete_prefix(self, prefix: str, *, concurrency: int = 4):
+        """Delete all files whose name starts with `prefix`.
+        `concurrency` is the number of chunks of 1000 names deleted at the same time.
+        Returns a dict with 'deleted' and 'failed' files.
+        """
+        assert prefix, "No prefix provided"
+        return self.delete_all(self.iter_names(prefix), concurrency=concurrency)
+
     def delete(self, name: str):
         """Delete a file from drive.
         `name` is the name of the file.
@@ -122,93 +366,718 @@ class _Drive(_Service):
         """
         url = f"/files?limit={limit}"
         if prefix:
-            url += f"&prefix={prefix}"
+            url += f"&prefix={self._quote(prefix)}"
         if last:
-            url += f"&last={last}"
-        _, res = self._request(url, "GET")
+            url += f"&last={self._quote(last)}"
+        _, res = self._request(url, "GET", op="list")
         return res
 
-    def _start_upload(self, name: str):
-        _, res = self._request(f"/uploads?name={self._quote(name)}", "POST")
+    def iter_names(self, prefix: Union[str, None] = None, *, limit: int = 1000):
+        """Iterate over all file names in drive, following pagination.
+        `prefix` is the prefix of file names.
+        `limit` is the number of names fetched per page, defaults to 1000.
+        The next page is fetched in the background while the current one is consumed.
+        """
+        # a generator can't keep its span current across yields,
+        # it is only made current while the next page is requested
+        span = tracing.start_span("deta.drive.iter_names", {"deta.name": self.name})
+        pages = 0
+        try:
+            with ThreadPoolExecutor(1) as executor:
+                with tracing.use_span(span):
+                    future = executor.submit(_in_context(self.list), limit, prefix)
+                while True:
+                    res = future.result() or {}
+                    pages += 1
+                    last = res.get("paging", {}).get("last")
+                    if last:
+                        with tracing.use_span(span):
+                            future = executor.submit(_in_context(self.list), limit, prefix, last)
+                    yield from res.get("names", [])
+                    if not last:
+                        return
+        finally:
+            span.set_attribute("deta.pages", pages)
+            span.end()
+
+    def _start_upload(self, name: str, content_encoding: Union[str, None] = None):
+        headers = {"Content-Encoding": content_encoding} if content_encoding else None
+        _, res = self._request(
+            f"/uploads?name={self._quote(name)}", "POST", headers=headers, op="start_upload"
+        )
         return res["upload_id"]  # pyright: ignore
 
     def _finish_upload(self, name: str, upload_id: str):
-        self._request(f"/uploads/{upload_id}?name={self._quote(name)}", "PATCH")
+        self._request(
+            f"/uploads/{upload_id}?name={self._quote(name)}", "PATCH", op="finish_upload")
 
     def _abort_upload(self, name: str, upload_id: str):
         self._request(
-            f"/uploads/{upload_id}?name={self._quote(name)}", "DELETE")
+            f"/uploads/{upload_id}?name={self._quote(name)}", "DELETE", op="abort_upload")
 
     def _upload_part(
         self,
         name: str,
-        chunk: Union[bytes, str],
+        chunk: Union[bytes, str, memoryview],
         upload_id: str,
         part: int,
         content_type: Union[str, None] = None,
     ):
-        self._request(
-            f"/uploads/{upload_id}/parts?name={self._quote(name)}&part={part}",
-            "POST",
-            data=chunk,
-            content_type=content_type,
-        )
+        checksum = base64.b64encode(hashlib.md5(chunk).digest()).decode()
+        retry = PART_UPLOAD_RETRIES
+        while True:
+            try:
+                self._request(
+                    f"/uploads/{upload_id}/parts?name={self._quote(name)}&part={part}",
+                    "POST",
+                    data=chunk,
+                    headers={"Content-MD5": checksum},
+                    content_type=content_type,
+                    op="upload_part",
+                )
+                return
+            # a part rejected as corrupted (400), failing on the server (5xx) or whose
+            # connection was reset is sent again on its own, timeouts and deadlines aren't
+            except (urllib.error.HTTPError, ConnectionError) as e:
+                retry -= 1
+                if retry <= 0:
+                    raise e
+                if isinstance(e, urllib.error.HTTPError) and e.code != 400 and e.code < 500:
+                    raise e
 
-    def _get_content_stream(
-        self, data: Union[str, bytes, TextIOBase, BufferedIOBase, RawIOBase]
-    ):
+    def _get_content_size(self, data) -> Union[int, None]:
+        if isinstance(data, (bytes, bytearray, memoryview)):
+            return memoryview(data).nbytes
+        if isinstance(data, (RawIOBase, BufferedIOBase)) and data.seekable():
+            position = data.tell()
+            size = data.seek(0, os.SEEK_END) - position
+            data.seek(position)
+            return size
+        return None
+
+    def _iter_parts(self, data, size: Union[int, None] = None, exact: bool = False):
+        """Split `data` into upload parts.
+        Bytes are sliced without copying, everything else is assembled in a
+        reusable buffer. Each yielded part is only valid until the next one is requested.
+        `exact` tells whether `size` is the size of `data` or an estimate.
+        """
         if isinstance(data, str):
-            return StringIO(data)
-        elif isinstance(data, bytes):
-            return BytesIO(data)
-        return data
+            data = data.encode("utf-8")
+        if isinstance(data, (bytes, bytearray, memoryview)):
+            view = memoryview(data).cast("B")
+            offset = part = 0
+            while offset < len(view):
+                part_size = _part_size(len(view), part)
+                yield view[offset:offset + part_size]
+                offset += part_size
+                part += 1
+        elif isinstance(data, (RawIOBase, BufferedIOBase)):
+            yield from _read_parts(data, size, exact)
+        elif isinstance(data, TextIOBase):
+            yield from _assemble_parts(_read_chunks(data), size)
+        elif hasattr(data, "__aiter__"):
+            yield from _assemble_parts(_iter_async(data), size)
+        elif hasattr(data, "readinto"):
+            yield from _read_parts(data, size, exact)
+        elif hasattr(data, "read"):
+            # file-like objects such as a DriveStreamingBody of another file
+            yield from _assemble_parts(_read_chunks(data), size)
+        else:
+            yield from _assemble_parts(data, size)
 
+    @tracing.traced("deta.drive.put")
     def put(
         self,
         name: str,
-        data: Union[str, bytes, TextIOBase,
-                    BufferedIOBase, RawIOBase, None] = None,
+        data: Union[str, bytes, TextIOBase, BufferedIOBase, RawIOBase,
+                    Iterable[bytes], AsyncIterable[bytes], None] = None,
         *,
         path: Union[str, None] = None,
         content_type: Union[str, None] = None,
+        size: Union[int, None] = None,
+        sha256: Union[str, None] = None,
+        compress: Union[str, None] = None,
     ) -> str:
         """Put a file in drive.
         `name` is the name of the file.
-        `data` is the data to be put.
+        `data` is the data to be put, it can also be an iterable or async iterable of bytes.
         `content_type` is the mime type of the file.
+        `size` is the expected size in bytes of `data` when it can not be known in advance,
+        used to choose the part size.
+        `sha256` is the expected hex digest of the file, the upload is aborted if it does not match.
+        Every part is sent with its Content-MD5 and retried on its own if it gets corrupted.
+        `compress` is "gzip" or "zstd" to compress the file while it is uploaded,
+        `get` decompresses it again. zstd needs the `zstandard` package.
         Returns the name of the file.
         """
         assert name, "No name provided"
         assert path or data, "No data or path provided"
         assert not (path and data), "Both path and data provided"
+        compressor = _compressor(compress) if compress else None
 
         # start upload
-        upload_id = self._start_upload(name)
+        upload_id = self._start_upload(name, compress)
 
         if path:
-            content_stream = open(path, "rb")
+            content = open(path, "rb")
+            size = os.path.getsize(path)
+            exact = True
         else:
             assert data
-            content_stream = self._get_content_stream(data)
+            content = data
+            known = self._get_content_size(data)
+            # the given size is only an estimate
+            exact = known is not None
+            size = known if exact else size
 
         part = 1
+        uploaded = 0
+        digest = hashlib.sha256() if sha256 else None
 
         # upload chunks
-        while True:
-            chunk = content_stream.read(UPLOAD_CHUNK_SIZE)
-            # eof stop the loop
-            if not chunk:
-                self._finish_upload(name, upload_id)
-                content_stream.close()
-                return name
+        try:
+            chunks = self._iter_parts(content, size, exact)
+            if digest:
+                chunks = _hashed(chunks, digest)
+            if compressor:
+                chunks = _assemble_parts(_compressed(chunks, compressor), size)
+            for chunk in chunks:
+                self._upload_part(name, chunk, upload_id, part, content_type)
+                uploaded += len(chunk)
+                part += 1
+            tracing.current_span().set_attributes(
+                {"deta.file": name, "deta.parts": part - 1, "deta.bytes": uploaded}
+            )
+            if digest and digest.hexdigest() != sha256.lower():  # pyright: ignore
+                raise ChecksumMismatch(f"Data of '{name}' does not match its sha256 checksum")
+        # clean up on exception
+        # and raise exception again
+        except Exception as e:
+            self._abort_upload(name, upload_id)
+            raise e
+        finally:
+            if hasattr(content, "close"):
+                content.close()
+
+        self._finish_upload(name, upload_id)
+        return name
+
+    def _put_small(
+        self,
+        name: str,
+        data: Union[bytes, memoryview],
+        content_type: Union[str, None] = None,
+    ):
+        """Put a file of at most UPLOAD_CHUNK_SIZE bytes in a single request."""
+        checksum = base64.b64encode(hashlib.md5(data).digest()).decode()
+        self._request(
+            f"/files?name={self._quote(name)}",
+            "POST",
+            data=data,
+            headers={"Content-MD5": checksum},
+            content_type=content_type,
+            op="put",
+        )
+        return name
 
-            # upload part
+    @tracing.traced("deta.drive.put_many")
+    def put_many(
+        self,
+        files: dict,
+        *,
+        content_type: Union[str, None] = None,
+        concurrency: int = 8,
+    ) -> dict:
+        """Put many files in drive.
+        `files` maps names to data, accepting the same data as `put`.
+        Files of known size up to UPLOAD_CHUNK_SIZE bytes are sent in a single request,
+        bigger ones are uploaded in parts.
+        `content_type` is the mime type of the files.
+        `concurrency` is the number of files uploaded at the same time.
+        Returns a dict with 'uploaded' names and 'failed' files with their error.
+        """
+        assert files, "No files provided"
+        assert concurrency > 0, "concurrency should be at least 1"
+
+        def upload(name, data):
+            if isinstance(data, str):
+                data = data.encode("utf-8")
+            size = self._get_content_size(data)
+            if size is None or size > UPLOAD_CHUNK_SIZE:
+                return self.put(name, data, content_type=content_type)
+            if not isinstance(data, (bytes, bytearray, memoryview)):
+                # a small stream, read it whole
+                with data:
+                    data = data.read()
+            return self._put_small(name, data, content_type)
+
+        result = {"uploaded": [], "failed": {}}
+        with ThreadPoolExecutor(concurrency) as executor:
+            futures = {
+                name: executor.submit(_in_context(upload), name, data)
+                for name, data in files.items()
+            }
+            for name, future in futures.items():
+                try:
+                    result["uploaded"].append(future.result())
+                except Exception as e:
+                    result["failed"][name] = str(e)
+        tracing.current_span().set_attributes(
+            {"deta.files": len(files), "deta.failed": len(result["failed"])}
+        )
+        return result
+
+    @tracing.traced("deta.drive.get_many")
+    def get_many(
+        self,
+        names: Iterable[str],
+        dest_dir: Union[str, Path, None] = None,
+        *,
+        callback: Union[Callable[[str, DriveStreamingBody], None], None] = None,
+        concurrency: int = 8,
+    ) -> dict:
+        """Get/Download many files from drive.
+        `names` are the names of the files.
+        `dest_dir` is the directory files are written to, keeping the path in their name.
+        `callback` is called with the name and the DriveStreamingBody of each file instead,
+        from several threads at once.
+        `concurrency` is the number of files downloaded at the same time.
+        Returns a dict with 'downloaded' and 'missing' names and 'failed' files with their error.
+        """
+        assert (dest_dir is None) != (callback is None), "Provide either dest_dir or callback"
+        assert concurrency > 0, "concurrency should be at least 1"
+
+        def download(name):
+            if dest_dir is not None:
+                # fail before downloading anything
+                _destination(dest_dir, name)
+            body = self.get(name)
+            if body is None:
+                return False
             try:
-                self._upload_part(name, chunk, upload_id, part, content_type)
+                if callback:
+                    callback(name, body)
+                else:
+                    _write_body(_destination(dest_dir, name), body.iter_chunks(DOWNLOAD_CHUNK_SIZE))
+            finally:
+                body.close()
+            return True
+
+        result = {"downloaded": [], "missing": [], "failed": {}}
+        with ThreadPoolExecutor(concurrency) as executor:
+            futures = {name: executor.submit(_in_context(download), name) for name in names}
+            for name, future in futures.items():
+                try:
+                    found = future.result()
+                except Exception as e:
+                    result["failed"][name] = str(e)
+                    continue
+                result["downloaded" if found else "missing"].append(name)
+        tracing.current_span().set_attributes(
+            {"deta.files": len(futures), "deta.failed": len(result["failed"])}
+        )
+        return result
+
+    @tracing.traced("deta.drive.sync_dir")
+    def sync_dir(
+        self,
+        local_dir: Union[str, Path],
+        prefix: str = "",
+        *,
+        delete: bool = False,
+        concurrency: int = 4,
+        manifest: Union[str, Path, None] = None,
+    ) -> dict:
+        """Sync a local directory to drive, uploading only new or changed files.
+        `local_dir` is the directory to upload, file names are prefixed with `prefix`.
+        `delete` removes files under `prefix` in drive that are not in `local_dir`.
+        `concurrency` is the number of files uploaded at the same time.
+        `manifest` is where the sizes and hashes of uploaded files are kept, defaults to
+        `.deta-sync.json` in `local_dir`.
+        Returns a dict with the 'uploaded', 'skipped' and 'deleted' names and the
+        'bytes_uploaded' and 'bytes_saved'.
+        """
+        assert concurrency > 0, "concurrency should be at least 1"
+        local_dir = Path(local_dir)
+        manifest = Path(manifest) if manifest else local_dir / SYNC_MANIFEST_NAME
+
+        entries = {}
+        if manifest.exists():
+            with open(manifest) as f:
+                entries = json.load(f)
+
+        remote = set(self.iter_names(prefix))
+
+        local = {}
+        skip = (manifest, manifest.with_name(manifest.name + ".tmp"))
+        for path in sorted(local_dir.rglob("*")):
+            if path.is_file() and path not in skip:
+                local[prefix + path.relative_to(local_dir).as_posix()] = path
+
+        result = {
+            "uploaded": [],
+            "skipped": [],
+            "deleted": [],
+            "bytes_uploaded": 0,
+            "bytes_saved": 0,
+        }
+
+        changed = {}
+        for name, path in local.items():
+            stat = path.stat()
+            entry = entries.get(name)
+            # only hash again when size or modification time changed
+            if entry and entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime:
+                sha256 = entry["sha256"]
+            else:
+                sha256 = _file_sha256(path)
+            if name in remote and entry and entry["sha256"] == sha256:
+                result["skipped"].append(name)
+                result["bytes_saved"] += stat.st_size
+                continue
+            changed[name] = {"size": stat.st_size, "mtime": stat.st_mtime, "sha256": sha256}
+
+        try:
+            with ThreadPoolExecutor(concurrency) as executor:
+                futures = {
+                    name: executor.submit(_in_context(self.put), name, path=str(local[name]))
+                    for name in changed
+                }
+                for name, future in futures.items():
+                    future.result()
+                    entries[name] = changed[name]
+                    result["uploaded"].append(name)
+                    result["bytes_uploaded"] += changed[name]["size"]
+        finally:
+            _write_manifest(manifest, entries)
+
+        if delete:
+            res = self.delete_all(sorted(remote - set(local)), concurrency=concurrency)
+            result["deleted"] = res["deleted"]
+            for name in result["deleted"]:
+                entries.pop(name, None)
+            _write_manifest(manifest, entries)
+
+        return result
+
+
+def _part_size(total: Union[int, None], part: int) -> int:
+    """Size of the part number `part` (from 0) of an upload of `total` bytes."""
+    if total:
+        # big enough to stay under the parts limit
+        return max(UPLOAD_CHUNK_SIZE, -(-total // MAX_UPLOAD_PARTS))
+    return UPLOAD_CHUNK_SIZE * 2 ** (part // UPLOAD_PART_GROWTH_INTERVAL)
+
+
+def _read_parts(stream: Union[RawIOBase, BufferedIOBase], size: Union[int, None], exact: bool = False):
+    """Read parts of a binary stream into a reusable buffer.
+    Its buffer is only smaller than a part when `size` is `exact`, an estimate may be too low.
+    """
+    part = 0
+    buffer = view = None
+    while True:
+        part_size = _part_size(size, part)
+        if size and exact:
+            part_size = min(part_size, size)
+        if buffer is None or len(buffer) != part_size:
+            buffer = bytearray(part_size)
+            view = memoryview(buffer)
+        filled = 0
+        while filled < len(view):
+            n = stream.readinto(view[filled:])
+            if not n:
+                break
+            filled += n
+        if not filled:
+            return
+        yield view[:filled]
+        if filled < len(view):
+            return
+        part += 1
+
+
+def _read_chunks(stream):
+    while True:
+        chunk = stream.read(UPLOAD_CHUNK_SIZE)
+        if not chunk:
+            return
+        yield chunk
+
+
+def _assemble_parts(chunks: Iterable[Union[bytes, str]], size: Union[int, None]):
+    """Assemble chunks of any size into parts in a reusable buffer."""
+    part = 0
+    part_size = _part_size(size, part)
+    buffer = bytearray(part_size)
+    view = memoryview(buffer)
+    filled = 0
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode("utf-8")
+        chunk = memoryview(chunk).cast("B")
+        while len(chunk):
+            n = min(len(chunk), part_size - filled)
+            view[filled:filled + n] = chunk[:n]
+            filled += n
+            chunk = chunk[n:]
+            if filled == part_size:
+                yield view
                 part += 1
-            # clean up on exception
-            # and raise exception again
-            except Exception as e:
-                self._abort_upload(name, upload_id)
-                content_stream.close()
-                raise e
+                filled = 0
+                if _part_size(size, part) != part_size:
+                    part_size = _part_size(size, part)
+                    buffer = bytearray(part_size)
+                    view = memoryview(buffer)
+    if filled:
+        yield view[:filled]
+
+
+def _iter_async(iterable: AsyncIterable[bytes]) -> Iterator[bytes]:
+    """Iterate an async iterable from synchronous code on a private event loop."""
+    # asyncio is slow to import, sync only code shouldn't pay for it
+    import asyncio
+
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        pass
+    else:
+        raise RuntimeError(
+            "Can't consume an async iterable inside a running event loop, "
+            "call put from a thread with loop.run_in_executor instead"
+        )
+    loop = asyncio.new_event_loop()
+    iterator = iterable.__aiter__()
+    try:
+        while True:
+            try:
+                yield loop.run_until_complete(iterator.__anext__())
+            except StopAsyncIteration:
+                return
+    finally:
+        loop.close()
+
+
+def _hashed(chunks: Iterable[memoryview], digest) -> Iterator[memoryview]:
+    for chunk in chunks:
+        digest.update(chunk)
+        yield chunk
+
+
+class _GzipCompressor:
+    """gzip compressor writing the header of `COMPRESSION_MARKS`."""
+
+    def __init__(self):
+        # raw deflate, the header and trailer are written here
+        self._deflate = zlib.compressobj(wbits=-15)
+        self._header = COMPRESSION_MARKS["gzip"]
+        self._crc = 0
+        self._size = 0
+
+    def _with_header(self, data: bytes) -> bytes:
+        header, self._header = self._header, b""
+        return header + data if header else data
+
+    def compress(self, data) -> bytes:
+        self._crc = zlib.crc32(data, self._crc)
+        self._size += memoryview(data).nbytes
+        return self._with_header(self._deflate.compress(data))
+
+    def flush(self) -> bytes:
+        trailer = struct.pack("<II", self._crc, self._size & 0xFFFFFFFF)
+        return self._with_header(self._deflate.flush() + trailer)
+
+
+class _ZstdCompressor:
+    """zstd compressor starting with the skippable frame of `COMPRESSION_MARKS`."""
+
+    def __init__(self):
+        self._compressor = _zstandard().ZstdCompressor().compressobj()
+        self._mark = COMPRESSION_MARKS["zstd"]
+
+    def compress(self, data) -> bytes:
+        mark, self._mark = self._mark, b""
+        return mark + self._compressor.compress(data)
+
+    def flush(self) -> bytes:
+        mark, self._mark = self._mark, b""
+        return mark + self._compressor.flush()
+
+
+def _compressor(encoding: str):
+    if encoding == "gzip":
+        return _GzipCompressor()
+    if encoding == "zstd":
+        return _ZstdCompressor()
+    raise ValueError("compress should be one of 'gzip' or 'zstd'")
+
+
+def _decompressor(encoding: str):
+    if encoding == "gzip":
+        return zlib.decompressobj(wbits=31)
+    return _zstandard().ZstdDecompressor().decompressobj()
+
+
+def _zstandard():
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError("zstd compression needs the zstandard package, install deta[zstd]")
+    return zstandard
+
+
+def _compressed(chunks: Iterable[memoryview], compressor) -> Iterator[bytes]:
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def _content_encoding(header: Union[str, None], decompress: Union[bool, None]):
+    """Encoding a downloaded file should be decompressed with, "marked" to detect
+    the files compressed by `Drive.put` and "auto" any compressed data.
+    """
+    if decompress is False:
+        return None
+    if header in COMPRESSION_MAGIC:
+        return header
+    return "auto" if decompress else "marked"
+
+
+class _Decompressor:
+    """Decompresses a download chunk by chunk, detecting its encoding from its first bytes if needed."""
+
+    def __init__(self, encoding: str):
+        self._encoding = encoding
+        self._decompressor = None
+        # first bytes, kept until there are enough to recognize the encoding
+        self._head = bytearray()
+        self._started = False
+
+    def _start(self, chunk: bytes) -> bytes:
+        self._started = True
+        mark = next((e for e, m in COMPRESSION_MARKS.items() if chunk.startswith(m)), None)
+        if self._encoding == "marked":
+            self._encoding = mark
+        elif self._encoding == "auto":
+            self._encoding = mark or next(
+                (e for e, magic in COMPRESSION_MAGIC.items() if chunk.startswith(magic)), None
+            )
+        if not self._encoding:
+            # not compressed, passed through
+            return chunk
+        self._decompressor = _decompressor(self._encoding)
+        if mark == "zstd":
+            # zstd decompressors stop at the end of a frame, skip the mark
+            chunk = chunk[len(COMPRESSION_MARKS["zstd"]):]
+        return chunk
+
+    @property
+    def passthrough(self) -> bool:
+        """Whether the data turned out not to be compressed."""
+        return self._started and self._decompressor is None
+
+    def decompress(self, chunk: bytes) -> bytes:
+        if not self._started:
+            self._head += chunk
+            if len(self._head) < max(len(m) for m in COMPRESSION_MARKS.values()):
+                return b""
+            chunk = self._start(bytes(self._head))
+        return self._decompressor.decompress(chunk) if self._decompressor else chunk
+
+    def flush(self) -> bytes:
+        """Data held back by a download shorter than the marks."""
+        if self._started:
+            return b""
+        chunk = self._start(bytes(self._head))
+        return self._decompressor.decompress(chunk) if self._decompressor else chunk
+
+
+class _DecompressingReader:
+    """File-like reader decompressing a stream chunk by chunk."""
+
+    def __init__(self, stream, encoding: str):
+        self._stream = stream
+        self._decompressor = _Decompressor(encoding)
+        self._buffer = bytearray()
+        self._eof = False
+
+    @property
+    def closed(self):
+        return self._stream.closed
+
+    def _fill(self):
+        chunk = self._stream.read(DECOMPRESS_READ_SIZE)
+        if not chunk:
+            self._eof = True
+            self._buffer += self._decompressor.flush()
+        else:
+            self._buffer += self._decompressor.decompress(chunk)
+
+    def _take(self, size: int) -> bytes:
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+    def read(self, size: Union[int, None] = None) -> bytes:
+        if not self._buffer and self._decompressor.passthrough:
+            # not compressed, no need to copy it through the buffer
+            return self._stream.read(size)
+        while not self._eof and (size is None or size < 0 or len(self._buffer) < size):
+            self._fill()
+        return self._take(len(self._buffer) if size is None or size < 0 else size)
+
+    def readline(self, size: int = -1) -> bytes:
+        while True:
+            end = self._buffer.find(b"\n") + 1
+            if end or self._eof or 0 <= size <= len(self._buffer):
+                break
+            self._fill()
+        if not end:
+            end = len(self._buffer)
+        if size >= 0:
+            end = min(end, size)
+        return self._take(end)
+
+    def close(self):
+        self._stream.close()
+
+
+def _destination(dest_dir: Union[str, Path], name: str) -> Path:
+    """Local path of the file `name` downloaded to `dest_dir`."""
+    root = Path(dest_dir).resolve()
+    path = (root / name).resolve()
+    if root not in path.parents:
+        raise ValueError(f"'{name}' is outside of the destination directory")
+    return path
+
+
+def _write_body(path: Path, chunks: Iterable[bytes]):
+    # write next to the destination and rename, a failed download leaves no partial file
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f".{path.name}.tmp-{threading.get_ident()}")
+    try:
+        with open(tmp, "wb") as f:
+            for chunk in chunks:
+                f.write(chunk)
+        os.replace(tmp, path)
+    except BaseException:
+        if tmp.exists():
+            os.remove(tmp)
+        raise
+
+
+def _file_sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _write_manifest(path: Path, entries: dict):
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "w") as f:
+        json.dump(entries, f)
+    os.replace(tmp, path)
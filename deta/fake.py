@@ -0,0 +1,371 @@
+"""In-memory Base and Drive backend, for tests and load simulations without network.
+
+    from deta import Deta
+    from deta.fake import FakeTransport
+
+    deta = Deta("project_key", transport=FakeTransport())
+    db = deta.Base("users")
+"""
+import base64
+import copy
+import hashlib
+import json
+import re
+import threading
+import time
+import uuid
+from typing import Callable, Tuple, Union
+from urllib.parse import urlparse, parse_qs, unquote
+
+from .transport import Transport, Response
+
+_PATH = re.compile(r"^/v1/(?P<project>[^/]+)/(?P<name>[^/]+)(?P<rest>/.*)$")
+
+_MISSING = object()
+
+# attribute holding the expiry timestamp of items
+TTL_ATTRIBUTE = "__expires"
+
+
+class _BadRequest(Exception):
+    pass
+
+
+def _get_field(item: dict, field: str):
+    value = item
+    for part in field.split("."):
+        if not isinstance(value, dict) or part not in value:
+            return _MISSING
+        value = value[part]
+    return value
+
+
+def _parent(item: dict, field: str) -> Tuple[dict, str]:
+    """The dict holding `field` in `item`, with the last part of the field name."""
+    *path, last = field.split(".")
+    value = item
+    for part in path:
+        value = value.get(part, _MISSING)
+        if not isinstance(value, dict):
+            raise _BadRequest(f"Can not update '{field}', its parent does not exist")
+    return value, last
+
+
+def _equal(a, b) -> bool:
+    """JSON equality, unlike in Python `true` isn't `1`."""
+    if isinstance(a, bool) != isinstance(b, bool):
+        return False
+    if isinstance(a, list) and isinstance(b, list):
+        return len(a) == len(b) and all(_equal(x, y) for x, y in zip(a, b))
+    if isinstance(a, dict) and isinstance(b, dict):
+        return a.keys() == b.keys() and all(_equal(a[k], b[k]) for k in a)
+    return a == b
+
+
+def _ordered(value, *args) -> bool:
+    # booleans aren't ordered along with numbers
+    return all(isinstance(value, bool) == isinstance(arg, bool) for arg in args)
+
+
+def _compare(op: str, value, arg) -> bool:
+    try:
+        if op == "eq":
+            return _equal(value, arg)
+        if op == "ne":
+            return not _equal(value, arg)
+        if op == "lt":
+            return _ordered(value, arg) and value < arg
+        if op == "gt":
+            return _ordered(value, arg) and value > arg
+        if op == "lte":
+            return _ordered(value, arg) and value <= arg
+        if op == "gte":
+            return _ordered(value, arg) and value >= arg
+        if op == "pfx":
+            return isinstance(value, str) and value.startswith(arg)
+        if op == "r":
+            return _ordered(value, *arg) and arg[0] <= value <= arg[1]
+        if op == "contains":
+            if isinstance(value, list):
+                return any(_equal(v, arg) for v in value)
+            return isinstance(value, str) and arg in value
+        if op == "not_contains":
+            if isinstance(value, list):
+                return not any(_equal(v, arg) for v in value)
+            return isinstance(value, str) and arg not in value
+    except TypeError:
+        return False
+    raise _BadRequest(f"Unknown query operator '{op}'")
+
+
+def _matches(item: dict, query: Union[list, None]) -> bool:
+    """`query` is a list of OR-ed dicts of AND-ed conditions."""
+    if not query:
+        return True
+    for conditions in query:
+        ok = True
+        for cond, arg in conditions.items():
+            field, _, op = cond.partition("?")
+            value = _get_field(item, field)
+            if value is _MISSING:
+                ok = op in ("ne", "not_contains")
+            else:
+                ok = _compare(op or "eq", value, arg)
+            if not ok:
+                break
+        if ok:
+            return True
+    return False
+
+
+def _check_item(item):
+    if not isinstance(item, dict):
+        raise _BadRequest("Items should be objects")
+    key = item.get("key")
+    if key is not None and (not isinstance(key, str) or not key):
+        raise _BadRequest("Key should be a non empty string")
+
+
+class FakeBackend:
+    """In-memory implementation of the Base and Drive HTTP APIs.
+
+    Bases support put, insert, get, delete, updates with set, increment, append,
+    prepend and delete, queries with all operators, pagination and expiry of items
+    through the `__expires` attribute. Drives support single request and multipart
+    uploads, listing, downloads with ETag revalidation and deletes.
+    `clock` returns the current time in seconds, used for item expiry.
+    """
+
+    def __init__(self, clock: Callable[[], float] = time.time):
+        self.clock = clock
+        self.lock = threading.RLock()
+        self.bases = {}
+        self.drives = {}
+        self.uploads = {}
+
+    def handle(
+        self,
+        method: str,
+        url: str,
+        headers: Union[dict, None] = None,
+        body: Union[str, bytes, memoryview, None] = None,
+    ) -> Tuple[int, dict, bytes]:
+        """Serve one request, returns its status, headers and body."""
+        headers = {k.lower(): v for k, v in (headers or {}).items()}
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        body = bytes(body) if body is not None else b""
+        url = urlparse(url)
+        match = _PATH.match(url.path)
+        if not match:
+            return _json(404, {"errors": ["Not found"]})
+        params = {k: v[0] for k, v in parse_qs(url.query).items()}
+        key = (match["project"], match["name"])
+        rest = match["rest"]
+        try:
+            with self.lock:
+                if rest.startswith(("/items", "/query")):
+                    return self._base(method, key, rest, body)
+                return self._drive(method, key, rest, params, headers, body)
+        except _BadRequest as e:
+            return _json(400, {"errors": [str(e)]})
+
+    def _items(self, base_key) -> dict:
+        items = self.bases.setdefault(base_key, {})
+        now = self.clock()
+        expired = [
+            k for k, item in items.items()
+            if isinstance(item.get(TTL_ATTRIBUTE), (int, float)) and item[TTL_ATTRIBUTE] <= now
+        ]
+        for k in expired:
+            del items[k]
+        return items
+
+    def _base(self, method, base_key, rest, body):
+        items = self._items(base_key)
+        payload = json.loads(body) if body else {}
+        if rest == "/items" and method == "PUT":
+            new_items = payload.get("items") or []
+            if len(new_items) > 25:
+                raise _BadRequest("Can't put more than 25 items at a time")
+            for item in new_items:
+                _check_item(item)
+            processed = []
+            for item in new_items:
+                item = dict(item)
+                item.setdefault("key", uuid.uuid4().hex[:12])
+                items[item["key"]] = item
+                processed.append(item)
+            return _json(207, {"processed": {"items": processed}})
+        if rest == "/items" and method == "POST":
+            item = payload.get("item")
+            _check_item(item)
+            item = dict(item)
+            item.setdefault("key", uuid.uuid4().hex[:12])
+            if item["key"] in items:
+                return _json(409, {"errors": ["Key already exists"]})
+            items[item["key"]] = item
+            return _json(201, item)
+        if rest == "/query" and method == "POST":
+            return _json(200, self._query(items, payload))
+
+        key = unquote(rest[len("/items/"):])
+        if method == "GET":
+            item = items.get(key)
+            return _json(200, item) if item else _json(404, {"key": key})
+        if method == "DELETE":
+            items.pop(key, None)
+            return _json(200, {"key": key})
+        if method == "PATCH":
+            if key not in items:
+                return _json(404, {"errors": ["Key not found"]})
+            items[key] = self._update(items[key], payload)
+            return _json(200, dict(payload, key=key))
+        return _json(405, {"errors": ["Method not allowed"]})
+
+    def _query(self, items: dict, payload: dict) -> dict:
+        limit = payload.get("limit") or 1000
+        last = payload.get("last")
+        desc = payload.get("sort") == "desc"
+        page = []
+        more = False
+        for k in sorted(items, reverse=desc):
+            if last and (k >= last if desc else k <= last):
+                continue
+            item = items[k]
+            if not _matches(item, payload.get("query")):
+                continue
+            if len(page) == limit:
+                more = True
+                break
+            page.append(item)
+        paging = {"size": len(page)}
+        if more:
+            paging["last"] = page[-1]["key"]
+        return {"paging": paging, "items": page}
+
+    def _update(self, item: dict, payload: dict) -> dict:
+        actions = ("set", "increment", "append", "prepend", "delete")
+        if not any(payload.get(a) for a in actions):
+            raise _BadRequest("No updates provided")
+        fields = [f for a in actions for f in (payload.get(a) or [])]
+        if "key" in fields:
+            raise _BadRequest("Can't update the key")
+
+        item = copy.deepcopy(item)
+        for field, value in (payload.get("set") or {}).items():
+            parent, name = _parent(item, field)
+            parent[name] = value
+        for field, value in (payload.get("increment") or {}).items():
+            parent, name = _parent(item, field)
+            current = parent.get(name, 0)
+            if not isinstance(current, (int, float)) or isinstance(current, bool):
+                raise _BadRequest(f"Can't increment '{field}', it is not a number")
+            parent[name] = current + value
+        for action in ("append", "prepend"):
+            for field, value in (payload.get(action) or {}).items():
+                parent, name = _parent(item, field)
+                current = parent.get(name, [])
+                if not isinstance(current, list):
+                    raise _BadRequest(f"Can't {action} to '{field}', it is not a list")
+                parent[name] = current + value if action == "append" else value + current
+        for field in payload.get("delete") or []:
+            parent, name = _parent(item, field)
+            parent.pop(name, None)
+        return item
+
+    def _drive(self, method, drive_key, rest, params, headers, body):
+        files = self.drives.setdefault(drive_key, {})
+        name = params.get("name")
+        if rest == "/files" and method == "GET":
+            limit = int(params.get("limit", 1000))
+            prefix = params.get("prefix", "")
+            last = params.get("last")
+            names = sorted(n for n in files if n.startswith(prefix) and (not last or n > last))
+            page = names[:limit]
+            paging = {"size": len(page)}
+            if len(names) > limit:
+                paging["last"] = page[-1]
+            return _json(200, {"paging": paging, "names": page})
+        if rest == "/files" and method == "DELETE":
+            names = json.loads(body).get("names") or []
+            if len(names) > 1000:
+                raise _BadRequest("Can't delete more than 1000 files at a time")
+            for n in names:
+                files.pop(n, None)
+            return _json(200, {"deleted": names})
+        if rest == "/files" and method == "POST":
+            self._check_md5(headers, body)
+            files[name] = _File(body, headers.get("content-type"), None)
+            return _json(201, {"name": name})
+        if rest == "/files/download" and method == "GET":
+            f = files.get(name)
+            if f is None:
+                return _json(404, {"errors": ["Not found"]})
+            if headers.get("if-none-match") == f.etag:
+                return 304, {"ETag": f.etag}, b""
+            response_headers = {
+                "Content-Type": f.content_type or "application/octet-stream",
+                "ETag": f.etag,
+                "Content-MD5": base64.b64encode(hashlib.md5(f.data).digest()).decode(),
+            }
+            if f.content_encoding:
+                response_headers["Content-Encoding"] = f.content_encoding
+            return 200, response_headers, f.data
+
+        if rest == "/uploads" and method == "POST":
+            upload_id = uuid.uuid4().hex
+            self.uploads[upload_id] = {"parts": {}, "encoding": headers.get("content-encoding")}
+            return _json(202, {"name": name, "upload_id": upload_id})
+        parts = rest.split("/")
+        if len(parts) < 3 or parts[1] != "uploads":
+            return _json(404, {"errors": ["Not found"]})
+        upload_id = parts[2]
+        upload = self.uploads.get(upload_id)
+        if upload is None:
+            return _json(404, {"errors": ["Upload not found"]})
+        if rest.endswith("/parts") and method == "POST":
+            self._check_md5(headers, body)
+            upload["parts"][int(params["part"])] = (body, headers.get("content-type"))
+            return _json(200, {"name": name, "part": int(params["part"])})
+        if method == "PATCH":
+            del self.uploads[upload_id]
+            parts = [upload["parts"][p] for p in sorted(upload["parts"])]
+            content_type = parts[0][1] if parts else None
+            files[name] = _File(b"".join(p[0] for p in parts), content_type, upload["encoding"])
+            return _json(200, {"name": name, "upload_id": upload_id})
+        if method == "DELETE":
+            del self.uploads[upload_id]
+            return _json(200, {"name": name, "upload_id": upload_id})
+        return _json(405, {"errors": ["Method not allowed"]})
+
+    def _check_md5(self, headers: dict, body: bytes):
+        expected = headers.get("content-md5")
+        if expected:
+            if base64.b64encode(hashlib.md5(body).digest()).decode() != expected:
+                raise _BadRequest("BadDigest")
+
+
+class _File:
+    __slots__ = ("data", "content_type", "content_encoding", "etag")
+
+    def __init__(self, data: bytes, content_type, content_encoding):
+        self.data = data
+        self.content_type = content_type
+        self.content_encoding = content_encoding
+        self.etag = '"{}"'.format(hashlib.md5(data).hexdigest())
+
+
+def _json(status: int, payload) -> Tuple[int, dict, bytes]:
+    return status, {"Content-Type": "application/json"}, json.dumps(payload).encode()
+
+
+class FakeTransport(Transport):
+    """Transport serving requests from a FakeBackend, in process."""
+
+    def __init__(self, backend: Union[FakeBackend, None] = None):
+        self.backend = backend or FakeBackend()
+
+    def request(self, host, method, url, headers, body=None, timeouts=None):
+        status, headers, body = self.backend.handle(method, url, headers, body)
+        return Response(status, headers, body)
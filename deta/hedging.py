@@ -0,0 +1,233 @@
+"""Opt-in hedging of idempotent reads to cut their tail latency.
+
+    from deta import Deta
+    from deta.hedging import Hedging
+
+    deta = Deta(hedging=Hedging(percentile=95, budget=0.05))
+
+A `Base.get` or `Base.fetch` which hasn't answered after the `percentile` of
+the latencies seen so far for the same Base and operation is sent a second
+time, on another connection, and the first response wins. The slower request
+is cancelled, its connection closed. Hedges are paid from a budget: every read
+earns `budget` of a hedge, so at most that fraction of extra requests is sent
+however slow the service gets.
+"""
+import socket
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Tuple, Union
+
+from .metrics import Histogram
+from .utils import _in_context
+
+# (service, name, op) of the hedged reads
+_Key = Tuple[str, str, str]
+
+# result of a hedge which wasn't sent, the first request answered in time
+_NOT_SENT = object()
+
+
+class _Attempt:
+    """One of the requests of a hedged read, cancelled once the other one answered."""
+
+    def __init__(self, hedge: bool = False):
+        self.hedge = hedge
+        self.cancelled = threading.Event()
+        # set once the request returned, its connection is left open from then on
+        self.done = threading.Event()
+        # connection sending the request, closed to cancel it
+        self.conn = None
+        self._lock = threading.Lock()
+
+    def cancel(self):
+        with self._lock:
+            self.cancelled.set()
+            sock = None if self.done.is_set() else getattr(self.conn, "sock", None)
+            if sock is not None:
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+
+    def finish(self) -> bool:
+        """Mark the request as returned, returns whether it was cancelled, its connection closed."""
+        with self._lock:
+            self.done.set()
+            return self.cancelled.is_set()
+
+
+class Hedging:
+    """Hedging policy and latency statistics of the reads of the Bases of a `Deta`.
+
+    `percentile` of the latencies of a read is waited for before hedging it,
+    bounded by `min_delay` and `max_delay` in seconds. Reads aren't hedged
+    before `min_samples` of them answered. `budget` is the fraction of reads
+    which can be hedged, up to `burst` hedges in a row after a quiet period.
+    Sync reads are sent from the calling thread and their hedges from
+    `max_workers` threads, each with its connections.
+    """
+
+    def __init__(
+        self,
+        *,
+        percentile: float = 95,
+        min_delay: float = 0.005,
+        max_delay: float = 1.0,
+        min_samples: int = 20,
+        budget: float = 0.05,
+        burst: float = 10,
+        max_workers: int = 32,
+    ):
+        assert 0 < percentile < 100, "percentile should be between 0 and 100"
+        assert 0 < budget <= 1, "budget should be between 0 and 1"
+        self.percentile = percentile
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.min_samples = min_samples
+        self.budget = budget
+        self.burst = burst
+        self.max_workers = max_workers
+        # hedges sent and hedges answering first
+        self.hedged = 0
+        self.wins = 0
+        self._lock = threading.Lock()
+        self._latencies = {}
+        self._tokens = 0.0
+        self._executor = None
+
+    def delay(self, key: _Key) -> Union[float, None]:
+        """Seconds to wait before hedging a read of `key`, `None` while too few answered."""
+        with self._lock:
+            latencies = self._latencies.get(key)
+            if latencies is None or latencies.count < self.min_samples:
+                return None
+            delay = latencies.quantile(self.percentile / 100)
+        return min(max(delay, self.min_delay), self.max_delay)
+
+    def _start(self, key: _Key) -> Union[float, None]:
+        # every read earns a part of a hedge, only hedge when one can be paid
+        with self._lock:
+            self._tokens = min(self._tokens + self.budget, self.burst)
+            if self._tokens < 1:
+                return None
+        return self.delay(key)
+
+    def _spend(self) -> bool:
+        with self._lock:
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            self.hedged += 1
+            return True
+
+    def _observe(self, key: _Key, seconds: float):
+        with self._lock:
+            latencies = self._latencies.get(key)
+            if latencies is None:
+                latencies = self._latencies[key] = Histogram()
+            latencies.record(seconds)
+
+    def _won(self, attempt: _Attempt):
+        if attempt.hedge:
+            with self._lock:
+                self.wins += 1
+
+    def _timed(self, key: _Key, call: Callable[[Union[_Attempt, None]], Any], attempt: Union[_Attempt, None]):
+        start = time.perf_counter()
+        try:
+            result = call(attempt)
+        finally:
+            cancelled = attempt is not None and attempt.finish()
+        if not cancelled:
+            self._observe(key, time.perf_counter() - start)
+        return result
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(self.max_workers, thread_name_prefix="deta-hedging")
+            return self._executor
+
+    def run(self, key: _Key, call: Callable[[Union[_Attempt, None]], Any]):
+        """Call `call` and, if it is slow, call it again, returning the first result.
+        `call` is given the `_Attempt` it runs as, or `None` when not hedged.
+        """
+        delay = self._start(key)
+        if delay is None:
+            return self._timed(key, call, None)
+
+        first = _Attempt()
+        hedge = _Attempt(hedge=True)
+
+        def send_hedge():
+            if first.done.wait(delay) or not self._spend():
+                return _NOT_SENT
+            result = self._timed(key, call, hedge)
+            # the first request is still waiting, its thread gets an error
+            first.cancel()
+            return result
+
+        # the first request is sent from this thread, it doesn't queue behind the hedges of others
+        future = self._get_executor().submit(_in_context(send_hedge))
+        try:
+            try:
+                result = self._timed(key, call, first)
+            except Exception:
+                result = _NOT_SENT if future.cancel() else self._hedge_result(future)
+                if result is _NOT_SENT:
+                    raise
+                self._won(hedge)
+            return result
+        finally:
+            future.cancel()
+            hedge.cancel()
+
+    @staticmethod
+    def _hedge_result(future: Future):
+        try:
+            return future.result()
+        except Exception:
+            # the error of the first request is raised
+            return _NOT_SENT
+
+    async def arun(self, key: _Key, call: Callable[[], Awaitable[Any]]):
+        """Async version of `run`, the slower call is cancelled as a task."""
+        import asyncio
+
+        async def timed():
+            start = time.perf_counter()
+            result = await call()
+            self._observe(key, time.perf_counter() - start)
+            return result
+
+        delay = self._start(key)
+        if delay is None:
+            return await timed()
+
+        attempts = {asyncio.ensure_future(timed()): _Attempt()}
+        done, _ = await asyncio.wait(set(attempts), timeout=delay)
+        if not done and self._spend():
+            attempts[asyncio.ensure_future(timed())] = _Attempt(hedge=True)
+        pending = set(attempts)
+
+        error = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        self._won(attempts[task])
+                        return task.result()
+                    error = error or task.exception()
+            raise error  # pyright: ignore
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def shutdown(self):
+        """Stop the threads sending sync reads, once the clients are done."""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False)
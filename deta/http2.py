@@ -0,0 +1,243 @@
+"""Optional HTTP/2 transport multiplexing concurrent requests over one connection.
+
+    from deta import Deta
+    from deta.http2 import HTTP2Transport
+
+    deta = Deta(transport=HTTP2Transport())
+
+With the default HTTP/1.1 connections every concurrent request, like the
+parts of a `Drive.put` or the files of `Drive.get_many`, needs a socket and a
+TLS handshake of its own. Over HTTP/2 they are streams of a single connection
+per host, with flow control handled by the `h2` package. Hosts not offering
+HTTP/2 in the TLS handshake, and plain `http://` hosts, are sent requests over
+pooled HTTP/1.1 connections instead.
+
+It needs the `httpx` and `h2` packages, install deta[http2].
+"""
+import http.client
+import io
+import threading
+from typing import Union
+
+from .transport import Transport
+
+
+def _import_httpx():
+    try:
+        import h2  # noqa: F401
+        import httpx
+    except ImportError:
+        raise ImportError("the HTTP/2 transport needs the httpx and h2 packages, install deta[http2]")
+    return httpx
+
+
+def _with_scheme(host: str) -> str:
+    # hosts default to https, plain http is only meant for local test servers
+    return host if host.startswith(("http://", "https://")) else f"https://{host}"
+
+
+def _message(headers) -> http.client.HTTPMessage:
+    message = http.client.HTTPMessage()
+    for name, value in headers.multi_items():
+        message[name] = value
+    return message
+
+
+class _RawStream(io.RawIOBase):
+    """Undecoded body of a streamed httpx response, buffered by `_StreamResponse`."""
+
+    def __init__(self, res):
+        self._res = res
+        self._chunks = res.iter_raw()
+        self._pending = b""
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        while not self._pending:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                return 0
+            self._pending = chunk
+        n = min(len(buffer), len(self._pending))
+        buffer[:n] = self._pending[:n]
+        self._pending = self._pending[n:]
+        return n
+
+    def close(self):
+        if not self.closed:
+            self._res.close()
+        super().close()
+
+
+class _StreamResponse:
+    """Streamed httpx response with the interface of `http.client.HTTPResponse`."""
+
+    def __init__(self, res):
+        self.status = res.status_code
+        self.reason = res.reason_phrase
+        self.headers = _message(res.headers)
+        self.version = res.http_version
+        self.fp = io.BufferedReader(_RawStream(res))
+
+    @property
+    def closed(self):
+        return self.fp.closed
+
+    def getheader(self, name: str, default=None):
+        return self.headers.get(name, default)
+
+    def read(self, amt: Union[int, None] = None) -> bytes:
+        return self.fp.read(amt)
+
+    def readline(self, limit: int = -1) -> bytes:
+        return self.fp.readline(limit)
+
+    def close(self):
+        self.fp.close()
+
+
+class _AsyncStreamResponse:
+    """Streamed httpx response of `arequest`, its `read` and `close` are coroutines."""
+
+    def __init__(self, res):
+        self.status = res.status_code
+        self.reason = res.reason_phrase
+        self.headers = _message(res.headers)
+        self.version = res.http_version
+        self.closed = False
+        self._res = res
+        self._chunks = res.aiter_raw()
+        self._pending = b""
+
+    def getheader(self, name: str, default=None):
+        return self.headers.get(name, default)
+
+    async def _next_chunk(self) -> bytes:
+        try:
+            return await self._chunks.__anext__()
+        except StopAsyncIteration:
+            return b""
+
+    async def read(self, amt: Union[int, None] = None) -> bytes:
+        if amt is None or amt < 0:
+            chunks = [self._pending]
+            self._pending = b""
+            async for chunk in self._chunks:
+                chunks.append(chunk)
+            return b"".join(chunks)
+        while not self._pending:
+            self._pending = await self._next_chunk()
+            if not self._pending:
+                return b""
+        data, self._pending = self._pending[:amt], self._pending[amt:]
+        return data
+
+    async def close(self):
+        if not self.closed:
+            self.closed = True
+            await self._res.aclose()
+
+
+class HTTP2Transport(Transport):
+    """Sends requests with httpx over HTTP/2 when the host supports it.
+
+    The sync clients share one `httpx.Client` and the async ones an
+    `httpx.AsyncClient`, each keeping one multiplexed connection per host, up to
+    `max_connections` when hosts fall back to HTTP/1.1. Bodies are passed on
+    undecoded since the clients handle the content encodings of Drive files,
+    and streamed, also to the async clients.
+    `timeout` is in seconds, the default of the timeouts the clients leave unset,
+    their connect and read timeouts apply to each request, their total one to
+    waiting for a connection of the pool.
+    """
+
+    def __init__(self, *, timeout: float = 300, max_connections: int = 100, verify: bool = True):
+        self._httpx = _import_httpx()
+        self._timeout = timeout
+        self._options = dict(
+            http2=True,
+            timeout=timeout,
+            limits=self._httpx.Limits(max_connections=max_connections),
+            verify=verify,
+        )
+        self._lock = threading.Lock()
+        self._client = None
+        self._async_client = None
+
+    def _sync_client(self):
+        with self._lock:
+            if self._client is None:
+                self._client = self._httpx.Client(**self._options)
+            return self._client
+
+    def _timeouts(self, timeouts):
+        if timeouts is None:
+            return self._timeout
+
+        def or_default(seconds):
+            return self._timeout if seconds is None else seconds
+
+        return self._httpx.Timeout(
+            self._timeout,
+            connect=or_default(timeouts.connect),
+            read=or_default(timeouts.read),
+            write=or_default(timeouts.read),
+            pool=or_default(timeouts.total),
+        )
+
+    def _build(self, client, host: str, method: str, url: str, headers: dict, body, timeouts):
+        headers = dict(headers)
+        # bodies are returned undecoded, don't ask for encodings the clients don't expect
+        headers.setdefault("Accept-Encoding", "identity")
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        elif isinstance(body, memoryview):
+            body = body.tobytes()
+        return client.build_request(
+            method, _with_scheme(host) + url, headers=headers, content=body, timeout=self._timeouts(timeouts)
+        )
+
+    def request(
+        self,
+        host: str,
+        method: str,
+        url: str,
+        headers: dict,
+        body: Union[str, bytes, memoryview, None] = None,
+        timeouts=None,
+    ):
+        client = self._sync_client()
+        req = self._build(client, host, method, url, headers, body, timeouts)
+        return _StreamResponse(client.send(req, stream=True))
+
+    async def arequest(
+        self,
+        host: str,
+        method: str,
+        url: str,
+        headers: dict,
+        body: Union[str, bytes, memoryview, None] = None,
+        timeouts=None,
+    ):
+        # created on first use, inside the event loop it is bound to
+        if self._async_client is None:
+            self._async_client = self._httpx.AsyncClient(**self._options)
+        client = self._async_client
+        res = await client.send(self._build(client, host, method, url, headers, body, timeouts), stream=True)
+        return _AsyncStreamResponse(res)
+
+    def close(self):
+        """Close the connections of the sync clients."""
+        with self._lock:
+            client, self._client = self._client, None
+        if client is not None:
+            client.close()
+
+    async def aclose(self):
+        """Close the connections of the sync and async clients."""
+        self.close()
+        client, self._async_client = self._async_client, None
+        if client is not None:
+            await client.aclose()
@@ -0,0 +1,77 @@
+import logging
+import time
+from typing import Union, Callable, List
+
+logger = logging.getLogger(__name__)
+
+
+class RequestRecord:
+    """Measurements of one request of a Base or Drive client, passed to its hooks.
+
+    `op` is the client operation the request belongs to, like 'get', 'fetch' or
+    'upload_part', and `service` is 'base' or 'drive' with `name` the name of the
+    Base or Drive. `timings` holds the seconds spent in each phase of the request:
+
+    - 'connect': opening a new connection, DNS and TLS handshake included
+    - 'send': sending the request line, headers and body
+    - 'wait': waiting for the response headers, the server time to first byte
+    - 'read': reading the response body
+    - 'decode': decoding the JSON response
+
+    Phases that did not happen are missing, e.g. 'connect' when the connection was
+    `reused`. The body of streamed responses is read by the caller after the record
+    was emitted, their `bytes_in` is taken from the Content-Length header.
+    `error` is the exception that failed the request, if any, and `duration` the
+    total time of the request in seconds.
+    """
+
+    __slots__ = (
+        "op",
+        "service",
+        "name",
+        "method",
+        "path",
+        "status",
+        "bytes_out",
+        "bytes_in",
+        "retries",
+        "reused",
+        "timings",
+        "error",
+        "started_at",
+        "duration",
+    )
+
+    def __init__(self, op: str, service: str, name: str, method: str, path: str):
+        self.op = op
+        self.service = service
+        self.name = name
+        self.method = method
+        self.path = path
+        self.status: Union[int, None] = None
+        self.bytes_out = 0
+        self.bytes_in = 0
+        self.retries = 0
+        self.reused: Union[bool, None] = None
+        self.timings = {}
+        self.error: Union[BaseException, None] = None
+        self.started_at = time.time()
+        self.duration = 0.0
+
+    def __repr__(self):
+        return "RequestRecord(op={!r}, service={!r}, name={!r}, status={!r}, duration={:.6f})".format(
+            self.op, self.service, self.name, self.status, self.duration
+        )
+
+
+# hooks are called with the record of every request once its response arrived or it failed
+RequestHook = Callable[[RequestRecord], None]
+
+
+def _emit(hooks: List[RequestHook], record: RequestRecord):
+    for hook in hooks:
+        # a failing hook doesn't fail the request, nor keep the other hooks from running
+        try:
+            hook(record)
+        except Exception:
+            logger.exception("Request hook %r failed", hook)
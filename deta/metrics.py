@@ -0,0 +1,226 @@
+import threading
+import weakref
+from typing import Union, List, Tuple
+
+from .cache import DiskCache
+from .instrumentation import RequestRecord
+
+# values under this many microseconds get a bucket each, larger ones share
+# a bucket with values of the same power of two and the same top 4 bits
+_SUB_BUCKETS = 16
+
+# quantiles exported to Prometheus
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+def _bucket(us: int) -> int:
+    if us < _SUB_BUCKETS:
+        return us
+    shift = us.bit_length() - 5
+    return (shift + 1) * _SUB_BUCKETS + (us >> shift) - _SUB_BUCKETS
+
+
+def _bucket_upper(index: int) -> int:
+    if index < _SUB_BUCKETS:
+        return index
+    shift = index // _SUB_BUCKETS - 1
+    return ((index % _SUB_BUCKETS + _SUB_BUCKETS + 1) << shift) - 1
+
+
+class Histogram:
+    """Log-linear histogram of durations in the style of HdrHistogram.
+
+    Durations are counted in microsecond buckets whose width grows with the
+    values, so quantiles are within 1/16 of the actual value whatever the range,
+    in a few hundred bytes.
+    """
+
+    __slots__ = ("counts", "count", "sum", "max")
+
+    def __init__(self):
+        self.counts = {}
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def record(self, seconds: float):
+        index = _bucket(int(seconds * 1_000_000))
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.count += 1
+        self.sum += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def quantile(self, q: float) -> float:
+        """Upper bound in seconds of the `q` quantile, 0 when nothing was recorded."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= rank:
+                return min(_bucket_upper(index) / 1_000_000, self.max)
+        return self.max
+
+
+class _OpStats:
+    __slots__ = ("duration", "statuses", "retries", "bytes_out", "bytes_in", "phases", "reused", "new")
+
+    def __init__(self):
+        self.duration = Histogram()
+        self.statuses = {}
+        self.retries = 0
+        self.bytes_out = 0
+        self.bytes_in = 0
+        self.phases = {}
+        self.reused = 0
+        self.new = 0
+
+
+class Metrics:
+    """In-process registry aggregating the requests of the clients of a `Deta`.
+
+    It is a request hook: per Base or Drive and operation it counts requests by
+    status, retries, bytes sent and received, new and reused connections, and
+    keeps a latency histogram along with the total time of each request phase.
+    It also reports the hits and misses of the `DiskCache`s of the drives.
+
+    `snapshot` returns the aggregates as a dict and `to_prometheus` renders
+    them in the Prometheus text exposition format.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._ops = {}
+        self._caches = weakref.WeakSet()
+
+    def __call__(self, record: RequestRecord):
+        key = (record.service, record.name, record.op)
+        status = str(record.status) if record.status is not None else "error"
+        with self._lock:
+            stats = self._ops.get(key)
+            if stats is None:
+                stats = self._ops[key] = _OpStats()
+            stats.duration.record(record.duration)
+            stats.statuses[status] = stats.statuses.get(status, 0) + 1
+            stats.retries += record.retries
+            stats.bytes_out += record.bytes_out
+            stats.bytes_in += record.bytes_in
+            for phase, seconds in record.timings.items():
+                stats.phases[phase] = stats.phases.get(phase, 0.0) + seconds
+            if record.reused:
+                stats.reused += 1
+            elif record.reused is not None:
+                stats.new += 1
+
+    def track_cache(self, cache: DiskCache):
+        """Report the hits and misses of `cache`, it is not kept alive by the registry."""
+        self._caches.add(cache)
+
+    def reset(self):
+        with self._lock:
+            self._ops = {}
+
+    def _items(self) -> List[Tuple[Tuple[str, str, str], _OpStats]]:
+        with self._lock:
+            return sorted(self._ops.items())
+
+    def snapshot(self) -> dict:
+        """Aggregates per 'service/name/op', with latency quantiles in seconds,
+        throughput in bytes per second of request time and cache hit rates.
+        """
+        ops = {}
+        for (service, name, op), stats in self._items():
+            duration = stats.duration
+            connections = stats.reused + stats.new
+            ops[f"{service}/{name}/{op}"] = {
+                "requests": duration.count,
+                "statuses": dict(stats.statuses),
+                "retries": stats.retries,
+                "bytes_out": stats.bytes_out,
+                "bytes_in": stats.bytes_in,
+                "seconds": duration.sum,
+                "p50": duration.quantile(0.5),
+                "p95": duration.quantile(0.95),
+                "p99": duration.quantile(0.99),
+                "max": duration.max,
+                "phases": dict(stats.phases),
+                "throughput": (stats.bytes_out + stats.bytes_in) / duration.sum if duration.sum else 0.0,
+                "connection_reuse": stats.reused / connections if connections else None,
+            }
+        caches = {}
+        for cache in list(self._caches):
+            lookups = cache.hits + cache.misses
+            caches[str(cache.path)] = {
+                "hits": cache.hits,
+                "misses": cache.misses,
+                "hit_rate": cache.hits / lookups if lookups else None,
+            }
+        return {"operations": ops, "caches": caches}
+
+    def to_prometheus(self) -> str:
+        lines = []
+
+        def family(name: str, kind: str, help: str):
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        items = self._items()
+
+        family("deta_requests_total", "counter", "Requests by operation and status.")
+        for labels, stats in items:
+            for status, count in sorted(stats.statuses.items()):
+                lines.append(f"deta_requests_total{_labels(labels, status=status)} {count}")
+
+        family("deta_request_duration_seconds", "summary", "Request latency.")
+        for labels, stats in items:
+            for q in QUANTILES:
+                value = stats.duration.quantile(q)
+                lines.append(f"deta_request_duration_seconds{_labels(labels, quantile=str(q))} {value:.6f}")
+            lines.append(f"deta_request_duration_seconds_sum{_labels(labels)} {stats.duration.sum:.6f}")
+            lines.append(f"deta_request_duration_seconds_count{_labels(labels)} {stats.duration.count}")
+
+        family("deta_request_phase_seconds_total", "counter", "Time spent in each request phase.")
+        for labels, stats in items:
+            for phase, seconds in sorted(stats.phases.items()):
+                lines.append(f"deta_request_phase_seconds_total{_labels(labels, phase=phase)} {seconds:.6f}")
+
+        family("deta_request_retries_total", "counter", "Requests sent again on a new connection.")
+        for labels, stats in items:
+            lines.append(f"deta_request_retries_total{_labels(labels)} {stats.retries}")
+
+        family("deta_sent_bytes_total", "counter", "Request body bytes.")
+        for labels, stats in items:
+            lines.append(f"deta_sent_bytes_total{_labels(labels)} {stats.bytes_out}")
+
+        family("deta_received_bytes_total", "counter", "Response body bytes.")
+        for labels, stats in items:
+            lines.append(f"deta_received_bytes_total{_labels(labels)} {stats.bytes_in}")
+
+        family("deta_connections_total", "counter", "Requests by connection, new or reused.")
+        for labels, stats in items:
+            lines.append(f"deta_connections_total{_labels(labels, reused='true')} {stats.reused}")
+            lines.append(f"deta_connections_total{_labels(labels, reused='false')} {stats.new}")
+
+        caches = list(self._caches)
+        family("deta_cache_hits_total", "counter", "Drive downloads served from the disk cache.")
+        for cache in caches:
+            lines.append(f"deta_cache_hits_total{_format_labels({'path': str(cache.path)})} {cache.hits}")
+        family("deta_cache_misses_total", "counter", "Drive downloads missing from the disk cache.")
+        for cache in caches:
+            lines.append(f"deta_cache_misses_total{_format_labels({'path': str(cache.path)})} {cache.misses}")
+
+        return "\n".join(lines) + "\n"
+
+
+def _labels(key: Tuple[str, str, str], **extra: Union[str, None]) -> str:
+    service, name, op = key
+    return _format_labels(dict({"service": service, "name": name, "op": op}, **extra))
+
+
+def _format_labels(labels: dict) -> str:
+    def escape(value: str) -> str:
+        return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+    return "{" + ",".join(f'{k}="{escape(v)}"' for k, v in labels.items()) + "}"
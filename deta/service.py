@@ -1,14 +1,27 @@
 import http.client
+import io
 import os
+import ssl
 import json
 import socket
 import struct
-from typing import Union, Any
+import threading
+import time
+from collections import deque
+from typing import Union, Any, List, Iterable
 import urllib.error
 from pathlib import Path
 
+from . import tracing
+from .circuit import CircuitBreaker
+from .instrumentation import RequestRecord, RequestHook, _emit
+from .timeouts import Timeouts, _end, _timeout, _timeout_error
+
 JSON_MIME = "application/json"
 
+# size of the reads of response bodies bounded by a deadline
+_BODY_CHUNK_SIZE = 64 * 1024
+
 
 class CustomJSONEncoder(json.JSONEncoder):
 
@@ -18,7 +31,105 @@ class CustomJSONEncoder(json.JSONEncoder):
         return super().default(o)
 
 
+_ssl_context = None
+_ssl_context_lock = threading.Lock()
+
+# TLS sessions by (host, port), resumed by the next connection to the same host
+_tls_sessions = {}
+
+# connections opened ahead of time by `warmup`, by host
+_warm_connections = {}
+_warm_lock = threading.Lock()
+
+
+def _get_ssl_context() -> ssl.SSLContext:
+    # loading the CA certificates is slow and TLS sessions can only be resumed
+    # with the context that created them, all connections share one
+    global _ssl_context
+    with _ssl_context_lock:
+        if _ssl_context is None:
+            _ssl_context = ssl.create_default_context()
+        return _ssl_context
+
+
+class _ResumingHTTPSConnection(http.client.HTTPSConnection):
+    """HTTPS connection resuming the last TLS session to its host, which saves
+    a round trip and the key exchange of a full handshake on reconnects.
+    """
+
+    def connect(self):
+        http.client.HTTPConnection.connect(self)
+        server_hostname = self._tunnel_host or self.host  # pyright: ignore
+        # servers not accepting the session fall back to a full handshake
+        self.sock = self._context.wrap_socket(  # pyright: ignore
+            self.sock,
+            server_hostname=server_hostname,
+            session=_tls_sessions.get((self.host, self.port)),
+        )
+        self._remember_session()
+
+    def getresponse(self):
+        res = super().getresponse()
+        # TLS 1.3 servers send their session tickets after the handshake
+        self._remember_session()
+        return res
+
+    def _remember_session(self):
+        session = getattr(self.sock, "session", None)
+        if session is not None:
+            _tls_sessions[(self.host, self.port)] = session
+
+
+def _connect(host: str, timeout: float) -> http.client.HTTPConnection:
+    # hosts default to https, plain http is only meant for local test servers
+    if host.startswith("http://"):
+        return http.client.HTTPConnection(host[len("http://"):], timeout=timeout)
+    host = host[len("https://"):] if host.startswith("https://") else host
+    return _ResumingHTTPSConnection(host, timeout=timeout, context=_get_ssl_context())
+
+
+def _take_warm_connection(host: str) -> Union[http.client.HTTPConnection, None]:
+    try:
+        return _warm_connections[host].popleft()
+    except (KeyError, IndexError):
+        return None
+
+
+def warmup(hosts: Iterable[str], connections: int = 1, timeout: float = 10) -> int:
+    """Open `connections` connections to each of `hosts` ahead of time, DNS lookup and
+    TLS handshake included. The first requests needing a new connection to one of the
+    hosts take them instead of connecting. Returns the number of connections opened,
+    hosts that can't be reached are skipped.
+    """
+    opened = []
+
+    def open_connection(host):
+        conn = _connect(host, timeout)
+        try:
+            conn.connect()
+        except OSError:
+            conn.close()
+            return
+        with _warm_lock:
+            _warm_connections.setdefault(host, deque()).append(conn)
+        opened.append(conn)
+
+    threads = [
+        threading.Thread(target=open_connection, args=(host,), daemon=True)
+        for host in hosts
+        for _ in range(connections)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return len(opened)
+
+
 class _Service:
+    # 'base' or 'drive', reported in the request records
+    service = ""
+
     def __init__(
         self,
         project_key: str,
@@ -27,14 +138,54 @@ class _Service:
         name: str,
         timeout: int,
         keep_alive: bool = True,
+        transport=None,
+        hooks: Union[List[RequestHook], None] = None,
+        hedging=None,
+        timeouts: Union[Timeouts, None] = None,
+        circuit_breaker: Union[CircuitBreaker, None] = None,
     ):
         self.project_key = project_key
+        self.name = name
         self.base_path = "/v1/{0}/{1}".format(project_id, name)
         self.host = host
         self.timeout = timeout
         self.keep_alive = keep_alive
-        self.client = (http.client.HTTPSConnection(
-            host, timeout=timeout) if keep_alive else None)
+        # connect, read and total timeouts of each request, `timeout` by default
+        self.timeouts = timeouts or Timeouts()
+        # a `deta.transport.Transport` sending the requests instead of the connections
+        self.transport = transport
+        # called with a `RequestRecord` of every request
+        self.hooks = hooks if hooks is not None else []
+        # a `deta.hedging.Hedging` sending slow reads twice
+        self.hedging = hedging
+        # fails requests fast while the host is unhealthy
+        self.circuit_breaker = circuit_breaker
+        # connections are not thread safe, each thread gets its own
+        self._local = threading.local()
+        self.client = self._new_connection() if keep_alive and not transport else None
+
+    def _new_connection(self) -> http.client.HTTPConnection:
+        conn = _take_warm_connection(self.host)
+        if conn is None:
+            return _connect(self.host, self.timeout)
+        conn.timeout = self.timeout
+        if conn.sock:
+            conn.sock.settimeout(self.timeout)
+        return conn
+
+    def warmup(self, connections: int = 1) -> int:
+        """Open connections to the host of this client ahead of time, see `deta.service.warmup`."""
+        if self.transport:
+            return 0
+        return warmup([self.host], connections, self.timeout)
+
+    @property
+    def client(self) -> Union[http.client.HTTPConnection, None]:
+        return getattr(self._local, "client", None)
+
+    @client.setter
+    def client(self, client: Union[http.client.HTTPConnection, None]):
+        self._local.client = client
 
     def _is_socket_closed(self):
         if not self.client or not self.client.sock:
@@ -58,8 +209,76 @@ class _Service:
         headers: Union[dict, None] = None,
         content_type: Union[str, None] = None,
         stream: bool = False,
+        op: Union[str, None] = None,
     ):
+        record = RequestRecord(op or method.lower(), self.service, self.name, method, path)
+        with tracing.request_span(record):
+            start = time.perf_counter()
+            allowed = False
+            try:
+                if self.circuit_breaker:
+                    self.circuit_breaker.allow(self.host)
+                    allowed = True
+                return self._send(path, method, data, headers, content_type, stream, record)
+            except BaseException as e:
+                record.error = e
+                raise
+            finally:
+                record.duration = time.perf_counter() - start
+                if allowed:
+                    self._count_outcome(record)
+                if self.hooks:
+                    _emit(self.hooks, record)
+
+    def _count_outcome(self, record: RequestRecord):
+        assert self.circuit_breaker
+        # the loser of a hedged read says nothing about the health of the host
+        cancelled = getattr(self._local, "cancelled", None)
+        if cancelled and cancelled.is_set():
+            self.circuit_breaker.release(self.host)
+        else:
+            self.circuit_breaker.record(self.host, record)
+
+    def _read(
+        self,
+        path: str,
+        method: str,
+        data: Union[dict, None] = None,
+        content_type: Union[str, None] = None,
+        op: Union[str, None] = None,
+    ):
+        """`_request` of an idempotent read, hedged when the client has a `hedging` policy."""
+        if not self.hedging:
+            return self._request(path, method, data, content_type=content_type, op=op)
+
+        def attempt(hedge):
+            if hedge is None:
+                return self._request(path, method, data, content_type=content_type, op=op)
+            # runs in this thread or one of the policy, with its own connection closed to cancel it
+            if not self.transport and not self.client:
+                self.client = self._new_connection()
+            hedge.conn = self.client
+            self._local.cancelled = hedge.cancelled
+            try:
+                return self._request(path, method, data, content_type=content_type, op=op)
+            finally:
+                self._local.cancelled = None
+                # the connection may have been closed once cancelled, even if the request succeeded
+                if hedge.finish():
+                    self.client = None
 
+        return self.hedging.run((self.service, self.name, op or method.lower()), attempt)
+
+    def _send(
+        self,
+        path: str,
+        method: str,
+        data: Union[str, bytes, dict, None],
+        headers: Union[dict, None],
+        content_type: Union[str, None],
+        stream: bool,
+        record: RequestRecord,
+    ):
         url = self.base_path + path
 
         headers = headers or {}
@@ -87,43 +306,85 @@ class _Service:
         body = json.dumps(
             data, cls=CustomJSONEncoder
         ) if content_type == JSON_MIME else data
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        if isinstance(body, (bytes, bytearray, memoryview)):
+            record.bytes_out = len(body)
+
+        # the deadline of the operation shortened by the total timeout, across retries
+        end = _end(self.timeouts.total)
 
         # response
-        res = self._send_request_with_retry(method, url, headers, body)
+        res = self._send_request_with_retry(method, url, headers, body, record=record, end=end)
 
         assert res
 
         status = res.status
+        record.status = status
 
-        if status not in [200, 201, 202, 207]:
+        if status not in [200, 201, 202, 207, 304]:
             # need to read the response so subsequent requests can be sent on the client
-            res.read()
+            error_body = self._read_body(res, end)
+            record.bytes_in = len(error_body)
             if not self.keep_alive and self.client:
                 self.client.close()
             # return None if not found
             if status == 404:
                 return status, None
-            # FIXME: workaround to fix traceback printing for HTTPError
-            fp = res.fp if res.fp is not None else ''
+            # keep the body readable from the error
             raise urllib.error.HTTPError(
-                url, status, res.reason, res.headers, fp)
+                url, status, res.reason, res.headers, io.BytesIO(error_body))
 
         # if stream return the response and client without reading and closing the client
         if stream:
+            record.bytes_in = int(res.getheader("content-length") or 0)
+            # the response owns the connection until it is read, the next request opens a new one
+            if self.keep_alive:
+                self.client = None
             return status, res
 
+        start = time.perf_counter()
+        payload = self._read_body(res, end)
+        record.timings["read"] = time.perf_counter() - start
+        record.bytes_in = len(payload)
+
         # return json if application/json
         res_content_type = res.getheader("content-type")
         if res_content_type and JSON_MIME in res_content_type:
-            payload = json.loads(res.read())
-        else:
-            payload = res.read()
+            start = time.perf_counter()
+            payload = json.loads(payload)
+            record.timings["decode"] = time.perf_counter() - start
 
         if not self.keep_alive and self.client:
             self.client.close()
 
         return status, payload
 
+    def _read_body(self, res, end: Union[float, None]) -> bytes:
+        """Read a whole response body, within the deadline `end` if there is one."""
+        sock = None if self.transport else getattr(self.client, "sock", None)
+        try:
+            if end is None:
+                return res.read()
+            # a body sent slowly would hold each read up to the read timeout
+            chunks = []
+            while True:
+                timeout = _timeout(self.timeouts.read or self.timeout, end)
+                if sock is not None:
+                    sock.settimeout(timeout)
+                chunk = res.read(_BODY_CHUNK_SIZE)
+                if not chunk:
+                    return b"".join(chunks)
+                chunks.append(chunk)
+        except socket.timeout as e:
+            # the connection is left in the middle of a response
+            if self.client:
+                self.client.close()
+            error = _timeout_error(e, end)
+            if error is e:
+                raise
+            raise error from e
+
     def _send_request_with_retry(
         self,
         method: str,
@@ -131,29 +392,69 @@ class _Service:
         headers: Union[dict, None] = None,
         body: Union[str, bytes, dict, None] = None,
         retry=2,  # try at least twice to regain a new connection
+        record: Union[RequestRecord, None] = None,
+        end: Union[float, None] = None,
     ):
+        timings = record.timings if record else {}
+        if self.transport:
+            timeouts = Timeouts(
+                connect=_timeout(self.timeouts.connect or self.timeout, end),
+                read=_timeout(self.timeouts.read or self.timeout, end),
+                total=_timeout(None, end),
+            )
+            start = time.perf_counter()
+            res = self.transport.request(self.host, method, url, headers or {}, body, timeouts)
+            timings["wait"] = time.perf_counter() - start
+            return res
+
         reinitializeConnection = False
         while retry > 0:
             try:
-                if not self.keep_alive or reinitializeConnection:
-                    self.client = http.client.HTTPSConnection(
-                        host=self.host, timeout=self.timeout
-                    )
+                if not self.keep_alive or reinitializeConnection or not self.client:
+                    self.client = self._new_connection()
 
                 if headers is None:
                     headers = {}
 
                 assert self.client
 
+                # connect explicitly to time it apart from sending
+                reused = self.client.sock is not None
+                if record:
+                    record.reused = reused
+                if not reused:
+                    self.client.timeout = _timeout(self.timeouts.connect or self.timeout, end)
+                    start = time.perf_counter()
+                    self.client.connect()
+                    timings["connect"] = time.perf_counter() - start
+                self.client.sock.settimeout(_timeout(self.timeouts.read or self.timeout, end))  # pyright: ignore
+
+                start = time.perf_counter()
                 self.client.request(
                     method,
                     url,
                     headers=headers,
                     body=body,
                 )
+                timings["send"] = time.perf_counter() - start
+                start = time.perf_counter()
                 res = self.client.getresponse()
+                timings["wait"] = time.perf_counter() - start
                 return res
 
             except http.client.RemoteDisconnected:
+                # the connection of a cancelled hedged read was closed on purpose
+                cancelled = getattr(self._local, "cancelled", None)
+                if cancelled and cancelled.is_set():
+                    raise
                 reinitializeConnection = True
                 retry -= 1
+                if record:
+                    record.retries += 1
+            except socket.timeout as e:
+                # the connection is left in the middle of a request
+                self.client.close()  # pyright: ignore
+                error = _timeout_error(e, end)
+                if error is e:
+                    raise
+                raise error from e
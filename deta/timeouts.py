@@ -0,0 +1,102 @@
+"""Deadlines of operations and timeouts of single requests.
+
+    from deta import Deta, Timeouts, deadline
+
+    deta = Deta(timeouts=Timeouts(connect=5, read=30, total=60))
+
+    with deadline(120):
+        items = list(db.iter_fetch())
+
+A deadline bounds everything run inside its block: the requests, their
+retries, the pages of `Base.iter_fetch` and the parts of `Drive.put`, also
+in the threads and tasks the clients start. Requests started once it passed,
+or cut short by it, raise `DeadlineExceeded`. Nested deadlines can only
+shorten the enclosing one.
+"""
+import contextlib
+import contextvars
+import time
+from typing import Union
+
+# monotonic time by which the current operation must be done
+_deadline = contextvars.ContextVar("deta_deadline", default=None)
+
+
+class DeadlineExceeded(TimeoutError):
+    pass
+
+
+class Timeouts:
+    """Timeouts in seconds of each request of a client, `None` for the default.
+
+    `connect` bounds opening a connection, TLS handshake included, and `read`
+    each wait for data from the service, both default to the timeout of the
+    service, 300 seconds. `total` bounds a request with its retries and the
+    reading of its body, it has no default. Streamed Drive downloads are only
+    bounded by `read` once returned, deadlines included. Timeouts raise a
+    `TimeoutError`, `DeadlineExceeded` when a total timeout or deadline passed.
+    """
+
+    def __init__(
+        self,
+        *,
+        connect: Union[float, None] = None,
+        read: Union[float, None] = None,
+        total: Union[float, None] = None,
+    ):
+        self.connect = connect
+        self.read = read
+        self.total = total
+
+
+@contextlib.contextmanager
+def deadline(seconds: float):
+    """Context manager bounding the operations run inside it to `seconds`."""
+    end = time.monotonic() + seconds
+    current = _deadline.get()
+    token = _deadline.set(end if current is None else min(current, end))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining() -> Union[float, None]:
+    """Seconds left until the current deadline, `None` without deadline."""
+    end = _deadline.get()
+    return None if end is None else max(end - time.monotonic(), 0.0)
+
+
+def _end(total: Union[float, None]) -> Union[float, None]:
+    # end of a request: the current deadline, shortened by its total timeout
+    end = _deadline.get()
+    if total is not None:
+        end = time.monotonic() + total if end is None else min(end, time.monotonic() + total)
+    return end
+
+
+def _expired(end: Union[float, None]) -> bool:
+    return end is not None and time.monotonic() >= end
+
+
+def _timeout(seconds: Union[float, None], end: Union[float, None]) -> Union[float, None]:
+    """`seconds` shortened to the time left until `end`, raises `DeadlineExceeded` once it passed."""
+    if end is None:
+        return seconds
+    left = end - time.monotonic()
+    if left <= 0:
+        raise DeadlineExceeded("Deadline exceeded")
+    return left if seconds is None else min(seconds, left)
+
+
+def _timeout_error(error: Exception, end: Union[float, None]) -> TimeoutError:
+    """Error to raise for a socket or asyncio timeout, which aren't a `TimeoutError`
+    before Python 3.10 and 3.11.
+    """
+    if isinstance(error, DeadlineExceeded):
+        return error
+    if _expired(end):
+        return DeadlineExceeded("Deadline exceeded")
+    if isinstance(error, TimeoutError):
+        return error
+    return TimeoutError(str(error) or "timed out")
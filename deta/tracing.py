@@ -0,0 +1,158 @@
+"""Optional OpenTelemetry tracing of Base and Drive operations.
+
+    import deta.tracing
+
+    deta.tracing.enable()
+
+Operations like `Drive.put` or `Base.export` get a span, with a child span per
+request they send, e.g. per uploaded part or fetched page. Worker threads of
+concurrent operations keep the span of the operation as parent. The
+`opentelemetry-api` package is only imported once tracing is enabled, when
+disabled spans are a shared no-op object.
+"""
+import contextlib
+import functools
+import inspect
+from typing import Union
+
+from .instrumentation import RequestRecord
+
+_tracer = None
+
+
+class _NoSpan:
+    """Stands in for spans while tracing is disabled."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def is_recording(self) -> bool:
+        return False
+
+    def set_attribute(self, key, value):
+        pass
+
+    def set_attributes(self, attributes):
+        pass
+
+    def end(self):
+        pass
+
+
+_NO_SPAN = _NoSpan()
+
+
+def enable(tracer_provider=None):
+    """Trace operations with a tracer of `tracer_provider`, the global provider by default."""
+    global _tracer
+    from opentelemetry import trace
+
+    from . import __version__
+
+    _tracer = trace.get_tracer("deta", __version__, tracer_provider=tracer_provider)
+
+
+def disable():
+    global _tracer
+    _tracer = None
+
+
+def is_enabled() -> bool:
+    return _tracer is not None
+
+
+def span(name: str, attributes: Union[dict, None] = None):
+    """Context manager of a span made current for its duration."""
+    if _tracer is None:
+        return _NO_SPAN
+    return _tracer.start_as_current_span(name, attributes=attributes)
+
+
+def traced(name: str):
+    """Decorate a method of a Base or Drive client to run it in a span called `name`."""
+
+    def decorate(method):
+        if inspect.iscoroutinefunction(method):
+
+            @functools.wraps(method)
+            async def async_wrapper(self, *args, **kwargs):
+                if _tracer is None:
+                    return await method(self, *args, **kwargs)
+                with _tracer.start_as_current_span(name, attributes={"deta.name": self.name}):
+                    return await method(self, *args, **kwargs)
+
+            return async_wrapper
+
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            if _tracer is None:
+                return method(self, *args, **kwargs)
+            with _tracer.start_as_current_span(name, attributes={"deta.name": self.name}):
+                return method(self, *args, **kwargs)
+
+        return wrapper
+
+    return decorate
+
+
+def current_span():
+    """The current span, to add attributes to it."""
+    if _tracer is None:
+        return _NO_SPAN
+    from opentelemetry import trace
+
+    return trace.get_current_span()
+
+
+def start_span(name: str, attributes: Union[dict, None] = None):
+    """Start a span without making it current, for generators which can't keep
+    a span current across their yields. End it with `end()`.
+    """
+    if _tracer is None:
+        return _NO_SPAN
+    return _tracer.start_span(name, attributes=attributes)
+
+
+def use_span(span):
+    """Context manager making `span` current, without ending it on exit."""
+    if span is _NO_SPAN:
+        return _NO_SPAN
+    from opentelemetry import trace
+
+    return trace.use_span(span, end_on_exit=False)
+
+
+def _request_attributes(record: RequestRecord) -> dict:
+    attributes = {
+        "deta.service": record.service,
+        "deta.name": record.name,
+        "deta.op": record.op,
+        "http.request.method": record.method,
+        "deta.request.bytes": record.bytes_out,
+        "deta.response.bytes": record.bytes_in,
+        "deta.retries": record.retries,
+    }
+    if record.status is not None:
+        attributes["http.response.status_code"] = record.status
+    if record.reused is not None:
+        attributes["deta.connection.reused"] = record.reused
+    return attributes
+
+
+def request_span(record: RequestRecord):
+    """Span of one request, its attributes are set from `record` once it is done."""
+    if _tracer is None:
+        return _NO_SPAN
+    return _request_span(record)
+
+
+@contextlib.contextmanager
+def _request_span(record: RequestRecord):
+    with _tracer.start_as_current_span(f"deta.{record.service}.{record.op}") as s:  # pyright: ignore
+        try:
+            yield
+        finally:
+            s.set_attributes(_request_attributes(record))
@@ -0,0 +1,69 @@
+import io
+import http.client
+from typing import Union
+
+
+class Transport:
+    """Sends the requests of the Base and Drive clients instead of their HTTP connections.
+
+    `request` is called by the sync clients and `arequest` by the async ones,
+    both with the host of the service, the method, the url path with its query,
+    the headers, the body and the `deta.Timeouts` of the request, its `total`
+    being the time left until its deadline if it has one. They return a
+    response with the interface of `http.client.HTTPResponse` used by the
+    clients: `status`, `reason`, `headers`, `getheader`, `read`, `readline`
+    and `close`. The `read` and `close` of the responses of `arequest` can
+    be coroutines, to stream the body.
+    """
+
+    def request(
+        self,
+        host: str,
+        method: str,
+        url: str,
+        headers: dict,
+        body: Union[str, bytes, memoryview, None] = None,
+        timeouts=None,
+    ):
+        raise NotImplementedError
+
+    async def arequest(
+        self,
+        host: str,
+        method: str,
+        url: str,
+        headers: dict,
+        body: Union[str, bytes, memoryview, None] = None,
+        timeouts=None,
+    ):
+        return self.request(host, method, url, headers, body, timeouts)
+
+
+class Response:
+    """In-memory response with the interface of `http.client.HTTPResponse`."""
+
+    def __init__(self, status: int, headers: Union[dict, None] = None, body: bytes = b""):
+        self.status = status
+        self.reason = http.client.responses.get(status, "")
+        self.headers = http.client.HTTPMessage()
+        for name, value in (headers or {}).items():
+            self.headers[name] = value
+        if "Content-Length" not in self.headers:
+            self.headers["Content-Length"] = str(len(body))
+        self.fp = io.BytesIO(body)
+
+    @property
+    def closed(self):
+        return self.fp.closed
+
+    def getheader(self, name: str, default=None):
+        return self.headers.get(name, default)
+
+    def read(self, amt: Union[int, None] = None) -> bytes:
+        return self.fp.read(amt)
+
+    def readline(self, limit: int = -1) -> bytes:
+        return self.fp.readline(limit)
+
+    def close(self):
+        self.fp.close()
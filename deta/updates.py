@@ -0,0 +1,208 @@
+import atexit
+import threading
+import urllib.error
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Set, Tuple
+
+from .base import Util
+from .utils import _in_context
+
+# (attribute, 'increment', 'append' or 'prepend', value) of buffered updates
+_Op = Tuple[str, str, object]
+
+
+def _ops(updates: dict) -> List[_Op]:
+    ops = []
+    for attr, value in updates.items():
+        if isinstance(value, Util.Increment):
+            ops.append((attr, "increment", value.val))
+        elif isinstance(value, Util.Append):
+            ops.append((attr, "append", list(value.val)))
+        elif isinstance(value, Util.Prepend):
+            ops.append((attr, "prepend", list(value.val)))
+        else:
+            raise ValueError(f"Only increment, append and prepend updates can be buffered, not '{attr}'")
+    return ops
+
+
+def _conflicts(attrs: dict, ops: List[_Op]) -> bool:
+    # an attribute can only take one kind of update per request
+    return any(attr in attrs and attrs[attr][0] != kind for attr, kind, _ in ops)
+
+
+def _merge(attrs: dict, ops: List[_Op], older: bool = False):
+    """Merge `ops` into the pending updates `attrs` of a key, `older` ones when put back after a failure."""
+    for attr, kind, value in ops:
+        current = attrs.get(attr)
+        if current is None:
+            attrs[attr] = (kind, value)
+        elif kind == "increment":
+            attrs[attr] = (kind, current[1] + value)
+        elif (kind == "append") != older:
+            # appends keep their order, the last prepend goes first
+            attrs[attr] = (kind, current[1] + value)
+        else:
+            attrs[attr] = (kind, value + current[1])
+
+
+def _payload(attrs: dict) -> dict:
+    payload = {"set": {}, "increment": {}, "append": {}, "prepend": {}, "delete": []}
+    for attr, (kind, value) in attrs.items():
+        payload[kind][attr] = value
+    return payload
+
+
+class UpdateBuffer:
+    """Coalesces increments, appends and prepends to the items of a Base.
+
+    `update` takes the same updates as `Base.update`, limited to `Util.Increment`,
+    `Util.Append` and `Util.Prepend`, and merges them in memory per key and
+    attribute: increments are summed and lists joined in order. They are sent
+    as one update per key, `concurrency` at a time, in a background thread every
+    `interval` seconds or once `max_keys` keys have pending updates, and by
+    `flush`, `close` and at interpreter exit.
+
+    Updates of missing keys or rejected with a 4xx status are dropped, others
+    failing are sent again with the next flush. `failed` holds the errors of
+    the last flush by key and `dropped` the updates given up by key, in the
+    form of the payload of a `Base.update`, until they are cleared.
+    """
+
+    def __init__(self, base, *, interval: float = 1.0, max_keys: int = 100, concurrency: int = 4):
+        assert interval > 0, "interval should be positive"
+        assert max_keys > 0, "max_keys should be at least 1"
+        assert concurrency > 0, "concurrency should be at least 1"
+        self.base = base
+        self.interval = interval
+        self.max_keys = max_keys
+        self.concurrency = concurrency
+        self.failed: Dict[str, Exception] = {}
+        self.dropped: Dict[str, List[dict]] = {}
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Condition(self._lock)
+        # flushes are sent one after the other to keep appends in order
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._closed = False
+        # set once `max_keys` keys have pending updates
+        self._full = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    def __len__(self):
+        """Number of keys with pending updates."""
+        with self._lock:
+            return len(self._pending)
+
+    def update(self, updates: dict, key: str):
+        """Buffer `updates` of the item `key`, as given to `Base.update`."""
+        if key == "":
+            raise ValueError("Key is empty")
+        ops = _ops(updates)
+        with self._lock:
+            assert not self._closed, "The buffer is closed"
+            attrs = self._pending.get(key, {})
+            conflict = _conflicts(attrs, ops)
+            if not conflict:
+                _merge(attrs, ops)
+                self._pending[key] = attrs
+                if len(self._pending) >= self.max_keys:
+                    self._full = True
+                    self._wake.notify()
+            if self._thread is None:
+                self._start()
+        if conflict:
+            # send the other kind of update first, they can't share a request
+            self.flush()
+            self.update(updates, key)
+
+    def _start(self):
+        # not in the context of the caller, its deadline would apply to all the flushes
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        atexit.register(self._close_at_exit)
+
+    def _run(self):
+        while True:
+            with self._wake:
+                self._wake.wait_for(lambda: self._closed or self._full, timeout=self.interval)
+                if self._closed:
+                    return
+                self._full = False
+            self.flush()
+
+    def _send(self, pending: dict, serial: bool) -> Tuple[Dict[str, Exception], Set[str]]:
+        # errors by key and the keys which don't exist, they are errors too
+        futures = {}
+        if not serial and len(pending) > 1:
+            try:
+                with ThreadPoolExecutor(min(self.concurrency, len(pending))) as executor:
+                    for key, attrs in pending.items():
+                        futures[key] = executor.submit(_in_context(self.base._patch), key, _payload(attrs))
+            except RuntimeError:
+                # the interpreter is shutting down, the rest is sent from this thread
+                pass
+        errors = {}
+        missing = set()
+        for key, attrs in pending.items():
+            try:
+                future = futures.get(key)
+                code = future.result() if future else self.base._patch(key, _payload(attrs))
+            except Exception as e:
+                errors[key] = e
+                continue
+            if code == 404:
+                errors[key] = Exception("Key '{}' not found".format(key))
+                missing.add(key)
+        return errors, missing
+
+    def flush(self) -> Dict[str, Exception]:
+        """Send the pending updates, returns the errors by key."""
+        return self._flush(serial=False)
+
+    def _flush(self, serial: bool) -> Dict[str, Exception]:
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            failed, missing = self._send(pending, serial) if pending else ({}, set())
+            for key, error in failed.items():
+                ops = [(attr, kind, value) for attr, (kind, value) in pending[key].items()]
+                with self._lock:
+                    attrs = self._pending.get(key, {})
+                    # a rejected request won't pass when sent again, and newer
+                    # updates of another kind can't go after these
+                    rejected = isinstance(error, urllib.error.HTTPError) and error.code < 500
+                    if rejected or key in missing or _conflicts(attrs, ops):
+                        self.dropped.setdefault(key, []).append(_payload(pending[key]))
+                        continue
+                    _merge(attrs, ops, older=True)
+                    self._pending[key] = attrs
+            self.failed = failed
+            return failed
+
+    def close(self):
+        """Flush the pending updates and stop the background thread."""
+        self._close(serial=False)
+
+    def _close_at_exit(self):
+        # threads can't be started anymore, the updates are sent from this one
+        self._close(serial=True)
+
+    def _close(self, serial: bool):
+        with self._lock:
+            closed, self._closed = self._closed, True
+            self._wake.notify()
+        if closed:
+            return
+        if self._thread is not None:
+            atexit.unregister(self._close_at_exit)
+            if self._thread is not threading.current_thread():
+                self._thread.join()
+        self._flush(serial)
+
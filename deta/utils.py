@@ -1,5 +1,9 @@
 import os
-from typing import Union
+import queue
+import functools
+import threading
+import contextvars
+from typing import Union, Iterable, Iterator, List, Any
 
 
 def _get_project_key_id(project_key: Union[str, None] = None,
@@ -16,3 +20,65 @@ def _get_project_key_id(project_key: Union[str, None] = None,
         raise AssertionError("Bad project key provided")
 
     return project_key, project_id
+
+
+_DONE = object()
+
+
+def _in_context(fn):
+    """Bind `fn` to a copy of the current context, so the worker thread running it
+    keeps the context of the caller, like its tracing span.
+    """
+    return functools.partial(contextvars.copy_context().run, fn)
+
+
+def _parallel_chain(iterables: List[Iterable[Any]], buffer: int = 4) -> Iterator[Any]:
+    """Consume every iterable in its own thread and yield their values as they arrive.
+    At most `buffer` values per iterable are held in memory, producers block until
+    the consumer catches up. Exceptions raised by a producer are re-raised here.
+    """
+    if len(iterables) == 1:
+        yield from iterables[0]
+        return
+
+    results = queue.Queue(maxsize=buffer * len(iterables))
+    stop = threading.Event()
+
+    def put(value, error=None):
+        while not stop.is_set():
+            try:
+                results.put((value, error), timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce(iterable):
+        try:
+            for value in iterable:
+                if not put(value):
+                    return
+        except BaseException as e:
+            put(_DONE, e)
+            return
+        put(_DONE)
+
+    threads = [
+        threading.Thread(target=_in_context(produce), args=(i,), daemon=True)
+        for i in iterables
+    ]
+    for t in threads:
+        t.start()
+
+    running = len(threads)
+    try:
+        while running:
+            value, error = results.get()
+            if value is _DONE:
+                if error is not None:
+                    raise error
+                running -= 1
+                continue
+            yield value
+    finally:
+        stop.set()
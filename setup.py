@@ -16,5 +16,8 @@ setup(
     packages=["deta", "deta._async"],
     extras_require={
         "async": ["aiohttp>=3,<4"],
+        "zstd": ["zstandard"],
+        "tracing": ["opentelemetry-api"],
+        "http2": ["httpx[http2]"],
     },
 )
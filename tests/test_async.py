@@ -18,6 +18,8 @@ pytestmark = pytest.mark.asyncio
 
 PROJECT_KEY = os.getenv("DETA_SDK_TEST_PROJECT_KEY")
 BASE_NAME = os.getenv("DETA_SDK_TEST_BASE_NAME") 
+DRIVE_NAME = os.getenv("DETA_SDK_TEST_DRIVE_NAME")
+DRIVE_HOST = os.getenv("DETA_SDK_TEST_DRIVE_HOST")
 BASE_TEST_TTL_ATTRIBUTE = os.getenv("DETA_SDK_TEST_TTL_ATTRIBUTE") or "__expires"
 
 
@@ -38,6 +40,21 @@ async def db():
     await db.close()
 
 
+@pytest.fixture()
+async def drive():
+    assert PROJECT_KEY
+    assert DRIVE_NAME
+
+    deta = Deta(PROJECT_KEY)
+    sync_drive = deta.Drive(DRIVE_NAME, host=DRIVE_HOST)
+    drive = deta.AsyncDrive(DRIVE_NAME, host=DRIVE_HOST)
+
+    yield sync_drive, drive
+
+    sync_drive.delete_all(sync_drive.iter_names())
+    await drive.close()
+
+
 @pytest.fixture()
 async def items(db):
     items = [
@@ -354,3 +371,19 @@ async def test_ttl(db, items):
                 await db.update(
                     None, item.get("key"), expire_in=cexp_in, expire_at=cexp_at
                 )
+
+
+async def test_drive_get_many(drive, tmp_path):
+    sync_drive, drive = drive
+    sync_drive.put_many({"a.txt": "a", "dir/b.txt": "b"})
+
+    assert await drive.get("a.txt") == b"a"
+    assert await drive.get("does_not_exist.txt") is None
+
+    res = await drive.get_many(["a.txt", "dir/b.txt", "does_not_exist.txt"], tmp_path)
+    assert res == {
+        "downloaded": ["a.txt", "dir/b.txt"],
+        "missing": ["does_not_exist.txt"],
+        "failed": {},
+    }
+    assert (tmp_path / "dir" / "b.txt").read_bytes() == b"b"
@@ -0,0 +1,382 @@
+import asyncio
+import http.client
+import importlib.util
+import json
+import os
+import socket
+import ssl
+import subprocess
+import sys
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.mock_server import MockDetaServer
+from deta import Deta, DeadlineExceeded, Timeouts, deadline
+from deta.fake import FakeBackend, FakeTransport
+from deta.hedging import Hedging, _Attempt
+
+
+class TestWarmup(unittest.TestCase):
+    def setUp(self):
+        self.server = MockDetaServer().start()
+        self.records = []
+        self.deta = Deta("test_key", hooks=[self.records.append])
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_warmup(self):
+        self.assertEqual(self.deta.warmup([self.server.host], connections=2), 2)
+        db = self.deta.Base("base", host=self.server.host)
+        db.put("value", "one")
+        self.assertTrue(self.records[-1].reused)
+        self.assertNotIn("connect", self.records[-1].timings)
+
+    def test_background(self):
+        self.deta.warmup([self.server.host], background=True).join()
+        self.deta.Drive("drive", host=self.server.host).list()
+        self.assertTrue(self.records[-1].reused)
+
+    def test_unreachable(self):
+        self.assertEqual(self.deta.warmup(["http://127.0.0.1:1"]), 0)
+
+
+class TestHedging(unittest.TestCase):
+    def setUp(self):
+        self.server = MockDetaServer().start()
+        self.hedging = Hedging(min_samples=5, max_delay=0.1, budget=1)
+        self.deta = Deta("test_key", hedging=self.hedging)
+        self.db = self.deta.Base("base", host=self.server.host)
+        self.db.put({"n": 1}, "one")
+        for _ in range(5):
+            self.db.get("one")
+
+    def tearDown(self):
+        self.hedging.shutdown()
+        self.server.stop()
+
+    def slow_once(self, seconds: float):
+        handle = self.server.backend.handle
+        slow = [seconds]
+
+        def handle_slowly(*args):
+            if slow:
+                time.sleep(slow.pop())
+            return handle(*args)
+
+        self.server.backend.handle = handle_slowly
+
+    def test_hedge_wins(self):
+        self.slow_once(2)
+        start = time.perf_counter()
+        self.assertEqual(self.db.get("one"), {"key": "one", "n": 1})
+        self.assertEqual(self.db.fetch({"n": 1}).count, 1)
+        self.assertLess(time.perf_counter() - start, 1)
+        self.assertEqual((self.hedging.hedged, self.hedging.wins), (1, 1))
+
+    def test_first_on_calling_thread(self):
+        threads = []
+        deta = Deta("test_key", hedging=self.hedging, hooks=[lambda record: threads.append(threading.current_thread())])
+        db = deta.Base("base", host=self.server.host)
+        self.slow_once(2)
+        self.assertEqual(db.get("one"), {"key": "one", "n": 1})
+        # the hedge answers first, from a thread of the policy
+        self.assertEqual(len(threads), 2)
+        self.assertNotEqual(threads[0], threading.current_thread())
+        self.assertEqual(threads[1], threading.current_thread())
+        # the connection of the cancelled first request was dropped
+        self.assertEqual(db.get("one"), {"key": "one", "n": 1})
+
+    def test_cancel_after_finish(self):
+        attempt = _Attempt()
+        attempt.conn = conn = http.client.HTTPConnection(*self.server.server_address[:2])
+        conn.connect()
+        self.assertFalse(attempt.finish())
+        attempt.cancel()
+        # the request returned first, its connection is left usable
+        conn.request("GET", "/")
+        conn.getresponse().read()
+        conn.close()
+
+    def test_budget(self):
+        self.hedging.budget = 0.01
+        self.hedging._tokens = 0
+        self.slow_once(0.3)
+        start = time.perf_counter()
+        self.db.get("one")
+        self.assertGreaterEqual(time.perf_counter() - start, 0.3)
+        self.assertEqual(self.hedging.hedged, 0)
+
+    def test_async(self):
+        self.slow_once(2)
+
+        async def run():
+            db = self.deta.AsyncBase("base", host=self.server.host)
+            self.assertEqual(await db.get("one"), {"key": "one", "n": 1})
+            self.assertIsNone(await db.get("missing"))
+            await db.close()
+
+        start = time.perf_counter()
+        asyncio.run(run())
+        self.assertLess(time.perf_counter() - start, 1)
+        self.assertEqual(self.hedging.wins, 1)
+
+
+class TestTimeouts(unittest.TestCase):
+    def setUp(self):
+        self.server = MockDetaServer().start()
+        self.deta = Deta("test_key")
+        self.db = self.deta.Base("base", host=self.server.host)
+        self.db.put_many([{"key": str(i)} for i in range(10)])
+        self.server.latency = 0.1
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_deadline(self):
+        start = time.perf_counter()
+        with self.assertRaises(DeadlineExceeded):
+            with deadline(0.05):
+                self.db.get("1")
+        self.assertLess(time.perf_counter() - start, 0.1)
+        # the connection cut short is replaced
+        self.assertEqual(self.db.get("1"), {"key": "1"})
+
+    def test_deadline_across_pages(self):
+        with self.assertRaises(DeadlineExceeded):
+            with deadline(0.25):
+                list(self.db.iter_fetch(limit=2))
+
+    def test_read_timeout(self):
+        db = Deta("test_key", timeouts=Timeouts(read=0.05)).Base("base", host=self.server.host)
+        with self.assertRaises(TimeoutError) as cm:
+            db.get("1")
+        self.assertNotIsInstance(cm.exception, DeadlineExceeded)
+
+    def test_expired(self):
+        db = Deta("test_key", transport=FakeTransport()).Base("base")
+        with deadline(0):
+            with self.assertRaises(DeadlineExceeded):
+                db.get("1")
+
+    def test_async(self):
+        async def run():
+            db = self.deta.AsyncBase("base", host=self.server.host)
+            with self.assertRaises(DeadlineExceeded):
+                with deadline(0.05):
+                    await db.get("1")
+            self.assertEqual(await db.get("1"), {"key": "1"})
+            await db.close()
+
+            db = Deta("test_key", timeouts=Timeouts(read=0.05)).AsyncBase("base", host=self.server.host)
+            with self.assertRaises(TimeoutError) as cm:
+                await db.get("1")
+            self.assertNotIsInstance(cm.exception, DeadlineExceeded)
+            await db.close()
+
+        asyncio.run(run())
+
+
+_EXIT_WITH_UPDATES = """
+import sys
+from deta import Deta
+
+db = Deta("test_key").Base("base", host=sys.argv[1])
+buffer = db.buffer(interval=60)
+for _ in range(3):
+    buffer.update({"n": db.util.increment()}, "a")
+    buffer.update({"n": db.util.increment()}, "b")
+"""
+
+
+class TestUpdateBufferAtExit(unittest.TestCase):
+    def setUp(self):
+        self.server = MockDetaServer().start()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_flush_at_exit(self):
+        db = Deta("test_key").Base("base", host=self.server.host)
+        db.put_many([{"key": "a", "n": 0}, {"key": "b", "n": 0}])
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        proc = subprocess.run(
+            [sys.executable, "-c", _EXIT_WITH_UPDATES, self.server.host],
+            capture_output=True,
+            text=True,
+            cwd=root,
+            env=dict(os.environ, PYTHONPATH=root),
+        )
+        self.assertEqual(proc.stderr, "")
+        self.assertEqual(db.get("a")["n"], 3)
+        self.assertEqual(db.get("b")["n"], 3)
+
+
+_HAS_HTTP2 = all(importlib.util.find_spec(name) for name in ("httpx", "h2"))
+if _HAS_HTTP2:
+    import h2.config
+    import h2.connection
+    import h2.events
+
+    from deta.http2 import HTTP2Transport
+
+
+class _H2Server:
+    """HTTP/2 only server answering with a `FakeBackend` after `latency` seconds,
+    counting its connections and the most requests in flight on one of them.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.backend = FakeBackend()
+        self.latency = latency
+        self.connections = 0
+        self.max_streams = 0
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(os.path.join(os.path.dirname(__file__), "localhost.pem"))
+        context.set_alpn_protocols(["h2"])
+        self._sock = context.wrap_socket(socket.create_server(("127.0.0.1", 0)), server_side=True)
+        self.host = "https://127.0.0.1:{}".format(self._sock.getsockname()[1])
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def stop(self):
+        self._sock.close()
+
+    def _accept(self):
+        while True:
+            try:
+                sock, _ = self._sock.accept()
+            except OSError:
+                return
+            self.connections += 1
+            threading.Thread(target=self._serve, args=(sock,), daemon=True).start()
+
+    def _serve(self, sock):
+        conn = h2.connection.H2Connection(h2.config.H2Configuration(client_side=False, header_encoding="utf-8"))
+        lock = threading.Lock()
+        requests = {}
+        with lock:
+            conn.initiate_connection()
+            sock.sendall(conn.data_to_send())
+        while True:
+            try:
+                data = sock.recv(65536)
+            except OSError:
+                return
+            if not data:
+                return
+            with lock:
+                events = conn.receive_data(data)
+                for event in events:
+                    if isinstance(event, h2.events.RequestReceived):
+                        requests[event.stream_id] = (dict(event.headers), bytearray())
+                    elif isinstance(event, h2.events.DataReceived):
+                        requests[event.stream_id][1].extend(event.data)
+                        conn.acknowledge_received_data(event.flow_controlled_length, event.stream_id)
+                    elif isinstance(event, h2.events.StreamEnded):
+                        self.max_streams = max(self.max_streams, len(requests))
+                        args = (sock, conn, lock, requests, event.stream_id)
+                        threading.Thread(target=self._respond, args=args, daemon=True).start()
+                sock.sendall(conn.data_to_send())
+
+    def _respond(self, sock, conn, lock, requests, stream_id):
+        time.sleep(self.latency)
+        headers, body = requests[stream_id]
+        status, res_headers, res_body = self.backend.handle(
+            headers[":method"], headers[":path"], headers, bytes(body)
+        )
+        with lock:
+            del requests[stream_id]
+            conn.send_headers(
+                stream_id,
+                [(":status", str(status)), ("content-length", str(len(res_body))), ("x-served-by", "a"),
+                 ("x-served-by", "b")] + [(k.lower(), v) for k, v in res_headers.items()],
+            )
+            # small bodies only, they fit in the flow control window
+            for i in range(0, len(res_body), conn.max_outbound_frame_size):
+                conn.send_data(stream_id, res_body[i:i + conn.max_outbound_frame_size])
+            conn.end_stream(stream_id)
+            sock.sendall(conn.data_to_send())
+
+
+@unittest.skipUnless(_HAS_HTTP2, "httpx and h2 are not installed")
+class TestHTTP2Multiplexing(unittest.TestCase):
+    def setUp(self):
+        self.server = _H2Server(latency=0.2)
+        self.transport = HTTP2Transport(verify=False)
+        self.deta = Deta("test_key", transport=self.transport)
+
+    def tearDown(self):
+        self.transport.close()
+        self.server.stop()
+
+    def test_concurrent_requests(self):
+        db = self.deta.Base("base", host=self.server.host)
+        db.put({"n": 1}, "one")
+        start = time.perf_counter()
+        with ThreadPoolExecutor(8) as executor:
+            items = list(executor.map(lambda _: db.get("one"), range(8)))
+        self.assertLess(time.perf_counter() - start, 8 * 0.2)
+        self.assertEqual(items, [{"key": "one", "n": 1}] * 8)
+        self.assertEqual(self.server.connections, 1)
+        self.assertGreater(self.server.max_streams, 1)
+
+    def test_async(self):
+        async def run():
+            db = self.deta.AsyncBase("base", host=self.server.host)
+            await db.put({"n": 1}, "one")
+            items = await asyncio.gather(*(db.get("one") for _ in range(8)))
+            self.assertEqual(items, [{"key": "one", "n": 1}] * 8)
+            res = await self.transport.arequest(self.server.host, "GET", "/v1/test/base/items/one", {})
+            self.assertEqual(res.headers.get_all("x-served-by"), ["a", "b"])
+            # the body is streamed
+            body = await res.read(5)
+            self.assertEqual(len(body), 5)
+            self.assertEqual(json.loads(body + await res.read()), {"key": "one", "n": 1})
+            await res.close()
+            await self.transport.aclose()
+
+        asyncio.run(run())
+        self.assertEqual(self.server.connections, 1)
+        self.assertGreater(self.server.max_streams, 1)
+
+
+@unittest.skipUnless(_HAS_HTTP2, "httpx and h2 are not installed")
+class TestHTTP2Transport(unittest.TestCase):
+    # the mock server only speaks HTTP/1.1, requests fall back to it
+    def setUp(self):
+        self.server = MockDetaServer().start()
+        self.transport = HTTP2Transport()
+        self.deta = Deta("test_key", transport=self.transport)
+
+    def tearDown(self):
+        self.transport.close()
+        self.server.stop()
+
+    def test_base(self):
+        db = self.deta.Base("base", host=self.server.host)
+        db.put({"n": 1}, "one")
+        self.assertEqual(db.get("one"), {"key": "one", "n": 1})
+        self.assertIsNone(db.get("missing"))
+
+    def test_drive(self):
+        drive = self.deta.Drive("drive", host=self.server.host)
+        files = {f"{i}.bin": bytes([i]) * 1000 for i in range(8)}
+        drive.put_many(files)
+        got = {}
+        result = drive.get_many(list(files), callback=lambda name, body: got.update({name: body.read()}))
+        self.assertEqual(sorted(result["downloaded"]), sorted(files))
+        self.assertEqual(got, files)
+        self.assertEqual(list(drive.get("0.bin").iter_chunks(300))[-1], bytes([0]) * 100)
+
+    def test_async(self):
+        async def run():
+            drive = self.deta.AsyncDrive("drive", host=self.server.host)
+            self.deta.Drive("drive", host=self.server.host).put("a.txt", b"hello")
+            self.assertEqual(await drive.get("a.txt"), b"hello")
+            self.assertIsNone(await drive.get("b.txt"))
+            await drive.close()
+            await self.transport.aclose()
+
+        asyncio.run(run())
@@ -0,0 +1,594 @@
+import asyncio
+import gzip
+import importlib.util
+import io
+import os
+import tempfile
+import time
+import unittest
+import urllib.error
+
+import pytest
+
+from deta import Deta, DeadlineExceeded, tracing
+from deta.cache import DiskCache
+from deta.circuit import CircuitBreaker, CircuitOpenError
+from deta.fake import FakeBackend, FakeTransport
+from deta.transport import Response
+
+
+class TestFakeBase(unittest.TestCase):
+    def setUp(self):
+        self.now = 1000
+        self.deta = Deta("test_key", transport=FakeTransport(FakeBackend(clock=lambda: self.now)))
+        self.db = self.deta.Base("base")
+
+    def test_put_get_delete(self):
+        self.assertEqual(self.db.put({"a": 1}, "one"), {"key": "one", "a": 1})
+        self.assertEqual(self.db.get("one"), {"key": "one", "a": 1})
+        self.assertIsNone(self.db.get("two"))
+        self.db.delete("one")
+        self.assertIsNone(self.db.get("one"))
+
+    def test_insert_conflict(self):
+        self.db.insert("value", "one")
+        with self.assertRaises(urllib.error.HTTPError) as e:
+            self.db.insert("value", "one")
+        self.assertEqual(e.exception.code, 409)
+
+    def test_update(self):
+        self.db.put({"n": 1, "l": ["b"], "nested": {"a": 1}, "gone": True}, "one")
+        self.db.update(
+            {
+                "n": self.db.util.increment(2),
+                "l": self.db.util.append("c"),
+                "nested.b": 2,
+                "gone": self.db.util.trim(),
+            },
+            "one",
+        )
+        self.assertEqual(
+            self.db.get("one"), {"key": "one", "n": 3, "l": ["b", "c"], "nested": {"a": 1, "b": 2}}
+        )
+        with self.assertRaises(urllib.error.HTTPError) as e:
+            self.db.update({"l": self.db.util.increment(1)}, "one")
+        self.assertEqual(e.exception.code, 400)
+        with self.assertRaisesRegex(Exception, "not found"):
+            self.db.update({"a": 1}, "missing")
+
+    def test_fetch(self):
+        self.db.put_many([{"key": str(i), "n": i, "tag": "even" if i % 2 == 0 else "odd"} for i in range(10)])
+        self.assertEqual(self.db.fetch({"n?gte": 8}).items, [
+            {"key": "8", "n": 8, "tag": "even"},
+            {"key": "9", "n": 9, "tag": "odd"},
+        ])
+        self.assertEqual(self.db.fetch([{"n": 1}, {"n?r": [3, 4]}]).count, 3)
+        res = self.db.fetch({"tag": "even"}, limit=3)
+        self.assertEqual([i["key"] for i in res.items], ["0", "2", "4"])
+        self.assertEqual(res.last, "4")
+        res = self.db.fetch({"tag": "even"}, limit=3, last=res.last)
+        self.assertEqual([i["key"] for i in res.items], ["6", "8"])
+        self.assertIsNone(res.last)
+        self.assertEqual(self.db.fetch(limit=2, desc=True).items[0]["key"], "9")
+
+    def test_fetch_bools_and_numbers(self):
+        self.db.put_many([{"key": "a", "v": 1}, {"key": "b", "v": True}, {"key": "c", "v": [1]}])
+        self.assertEqual([i["key"] for i in self.db.fetch({"v": 1}).items], ["a"])
+        self.assertEqual([i["key"] for i in self.db.fetch({"v?gt": 0}).items], ["a"])
+        self.assertEqual([i["key"] for i in self.db.fetch({"v": True}).items], ["b"])
+        self.assertEqual([i["key"] for i in self.db.fetch({"v?ne": 1}).items], ["b", "c"])
+        self.assertEqual([i["key"] for i in self.db.fetch({"v?contains": True}).items], [])
+
+    def test_aggregates_mixed_types(self):
+        self.db.put_many([{"key": k, "v": v} for k, v in zip("abcdef", [1, "str", None, True, 1.5, [2]])])
+        self.assertEqual(self.db.min("v"), 1)
+        self.assertEqual(self.db.max("v"), "str")
+        self.assertEqual(self.db.sum("v"), 2.5)
+        self.db.put({"v": 1.0}, "g")
+        self.assertEqual(
+            self.db.group_count("v"),
+            {"1": 1, '"str"': 1, "null": 1, "true": 1, "1.5": 1, "[2]": 1, "1.0": 1},
+        )
+
+    def test_fetch_columns(self):
+        self.db.put_many([{"key": "a", "n": 1}, {"key": "b", "tag": "x"}])
+        res = self.db.fetch(columns=True)
+        self.assertEqual(res.columns, {"key": ["a", "b"], "n": [1, None], "tag": [None, "x"]})
+        # items only get the fields they were stored with
+        self.assertEqual(list(res), [{"key": "a", "n": 1}, {"key": "b", "tag": "x"}])
+        self.assertIs(res.items, res.items)
+        self.assertEqual(self.db.fetch(columns=["key", "n"]).items, [{"key": "a", "n": 1}, {"key": "b"}])
+
+    def test_expiry(self):
+        self.db.put("value", "one", expire_at=1010)
+        self.assertIsNotNone(self.db.get("one"))
+        self.now = 1010
+        self.assertIsNone(self.db.get("one"))
+        self.assertEqual(self.db.fetch().count, 0)
+
+    def test_import_csv_blank_key(self):
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, "import.csv")
+            with open(path, "w") as f:
+                f.write("key,value\ncsv1,a\n,b\n")
+            stats = self.db.import_file(path, checkpoint=False)
+            self.assertEqual((stats["items"], stats["failed"]), (2, 0))
+        items = self.db.fetch().items
+        self.assertEqual(sorted(i["value"] for i in items), ["a", "b"])
+        self.assertTrue(all(i["key"] for i in items))
+
+    def test_export_csv(self):
+        self.db.put_many([{"key": "a1", "n": 1}, {"key": "b1", "tag": "é", "l": [1]}])
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, "export.csv")
+            # the fields of the later partition aren't in the first page
+            stats = self.db.export(path, "csv", partitions=["a", "b"])
+            with open(path, "rb") as f:
+                data = f.read()
+            self.assertEqual(data.decode("utf-8"), 'key,l,n,tag\r\na1,,1,\r\nb1,[1],,é\r\n')
+            self.assertEqual(stats["bytes"], len(data))
+
+            self.db.export(path, "csv", columns=["key", "n"])
+            with open(path) as f:
+                self.assertEqual(f.read(), "key,n\na1,1\nb1,\n")
+
+
+class TestHooks(unittest.TestCase):
+    def setUp(self):
+        self.records = []
+        self.deta = Deta("test_key", transport=FakeTransport(), hooks=[self.records.append])
+
+    def test_records(self):
+        db = self.deta.Base("base")
+        db.put({"a": 1}, "one")
+        db.get("one")
+        db.get("two")
+        self.deta.Drive("drive").put("a.txt", b"hello")
+        self.assertEqual(
+            [(r.op, r.service, r.name, r.status) for r in self.records],
+            [
+                ("put", "base", "base", 207),
+                ("get", "base", "base", 200),
+                ("get", "base", "base", 404),
+                ("start_upload", "drive", "drive", 202),
+                ("upload_part", "drive", "drive", 200),
+                ("finish_upload", "drive", "drive", 200),
+            ],
+        )
+        put = self.records[0]
+        self.assertGreater(put.bytes_out, 0)
+        self.assertGreater(put.bytes_in, 0)
+        self.assertEqual(set(put.timings), {"wait", "read", "decode"})
+        self.assertGreaterEqual(put.duration, sum(put.timings.values()))
+
+    def test_error(self):
+        db = self.deta.Base("base")
+        db.insert("value", "one")
+        with self.assertRaises(urllib.error.HTTPError):
+            db.insert("value", "one")
+        self.assertEqual(self.records[-1].status, 409)
+        self.assertIsInstance(self.records[-1].error, urllib.error.HTTPError)
+
+    def test_failing_hook(self):
+        def fail(record):
+            raise ValueError("hook failed")
+
+        self.deta.hooks.insert(0, fail)
+        db = self.deta.Base("base")
+        with self.assertLogs("deta.instrumentation", "ERROR"):
+            self.assertEqual(db.put({"a": 1}, "one"), {"key": "one", "a": 1})
+        with self.assertLogs("deta.instrumentation", "ERROR"):
+            with self.assertRaises(urllib.error.HTTPError):
+                db.insert("value", "one")
+        # the other hooks still ran
+        self.assertEqual([r.op for r in self.records], ["put", "insert"])
+
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self):
+        self.deta = Deta("test_key", transport=FakeTransport(), metrics=True)
+
+    def test_snapshot(self):
+        db = self.deta.Base("base")
+        for i in range(10):
+            db.put({"n": i}, str(i))
+        db.get("missing")
+        ops = self.deta.metrics.snapshot()["operations"]
+        self.assertEqual(ops["base/base/put"]["requests"], 10)
+        self.assertEqual(ops["base/base/put"]["statuses"], {"207": 10})
+        self.assertEqual(ops["base/base/get"]["statuses"], {"404": 1})
+        self.assertGreater(ops["base/base/put"]["bytes_out"], 0)
+        self.assertLessEqual(ops["base/base/put"]["p50"], ops["base/base/put"]["p99"])
+
+    def test_cache(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            drive = self.deta.Drive("drive", cache=DiskCache(tmp))
+            drive.put("a.txt", b"hello")
+            drive.get("a.txt").read()
+            drive.get("a.txt").read()
+            cache = self.deta.metrics.snapshot()["caches"][tmp]
+            self.assertEqual((cache["hits"], cache["misses"]), (1, 1))
+
+    def test_prometheus(self):
+        self.deta.Base("base").put({"n": 1}, "one")
+        text = self.deta.metrics.to_prometheus()
+        self.assertIn("# TYPE deta_request_duration_seconds summary", text)
+        self.assertIn('deta_requests_total{service="base",name="base",op="put",status="207"} 1', text)
+        self.assertIn('deta_request_duration_seconds_count{service="base",name="base",op="put"} 1', text)
+
+    def test_disabled(self):
+        self.assertIsNone(Deta("test_key").metrics)
+
+
+try:
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import SimpleSpanProcessor
+    from opentelemetry.sdk.trace.export.in_memory_span_exporter import InMemorySpanExporter
+except ImportError:
+    TracerProvider = None
+
+
+@unittest.skipUnless(TracerProvider, "opentelemetry-sdk is not installed")
+class TestTracing(unittest.TestCase):
+    def setUp(self):
+        self.exporter = InMemorySpanExporter()
+        provider = TracerProvider()
+        provider.add_span_processor(SimpleSpanProcessor(self.exporter))
+        tracing.enable(provider)
+        self.deta = Deta("test_key", transport=FakeTransport())
+
+    def tearDown(self):
+        tracing.disable()
+
+    def parents(self):
+        spans = self.exporter.get_finished_spans()
+        by_id = {s.context.span_id: s.name for s in spans}
+        return [(s.name, by_id.get(s.parent.span_id) if s.parent else None) for s in spans]
+
+    def test_put(self):
+        self.deta.Drive("drive").put("a.txt", b"hello")
+        self.assertEqual(self.parents(), [
+            ("deta.drive.start_upload", "deta.drive.put"),
+            ("deta.drive.upload_part", "deta.drive.put"),
+            ("deta.drive.finish_upload", "deta.drive.put"),
+            ("deta.drive.put", None),
+        ])
+        put = self.exporter.get_finished_spans()[-1]
+        self.assertEqual(put.attributes["deta.parts"], 1)
+        self.assertEqual(put.attributes["deta.bytes"], 5)
+
+    def test_scan_in_threads(self):
+        db = self.deta.Base("base")
+        db.put_many([{"key": str(i), "n": i} for i in range(5)])
+        self.exporter.clear()
+        self.assertEqual(db.count([{"n": 1}, {"n?gt": 2}]), 3)
+        self.assertCountEqual(self.parents(), [
+            ("deta.base.fetch", "deta.base.scan"),
+            ("deta.base.fetch", "deta.base.scan"),
+            ("deta.base.scan", "deta.base.count"),
+            ("deta.base.scan", "deta.base.count"),
+            ("deta.base.count", None),
+        ])
+
+    def test_disabled(self):
+        tracing.disable()
+        self.deta.Base("base").put("value", "one")
+        self.assertEqual(self.exporter.get_finished_spans(), ())
+
+
+class _FailingTransport(FakeTransport):
+    """Fake transport answering 503 while `failing`."""
+
+    failing = False
+    sent = 0
+
+    def request(self, host, method, url, headers, body=None, timeouts=None):
+        self.sent += 1
+        if self.failing:
+            return Response(503, {"Content-Type": "application/json"}, b'{"errors": ["Unavailable"]}')
+        return super().request(host, method, url, headers, body, timeouts)
+
+
+class TestCircuitBreaker(unittest.TestCase):
+    def setUp(self):
+        self.now = 0.0
+        self.breaker = CircuitBreaker(window=4, min_calls=4, open_for=10, clock=lambda: self.now)
+        self.transport = _FailingTransport()
+        deta = Deta("test_key", transport=self.transport, circuit_breaker=self.breaker)
+        self.db = deta.Base("base")
+        self.drive = deta.Drive("drive", cache=DiskCache(tempfile.mkdtemp()))
+
+    def fail(self, calls: int):
+        self.transport.failing = True
+        for _ in range(calls):
+            with self.assertRaises(urllib.error.HTTPError):
+                self.db.get("one")
+
+    def test_opens_and_closes(self):
+        self.db.get("missing")  # not found is a healthy answer
+        self.fail(3)
+        sent = self.transport.sent
+        with self.assertRaises(CircuitOpenError):
+            self.db.get("one")
+        self.assertEqual(self.transport.sent, sent)
+        self.assertEqual(self.breaker.state(self.db.host), "open")
+
+        self.now = 10
+        self.assertEqual(self.breaker.state(self.db.host), "half_open")
+        self.fail(1)
+        self.assertEqual(self.breaker.state(self.db.host), "open")
+
+        self.now = 20
+        self.transport.failing = False
+        self.assertIsNone(self.db.get("one"))
+        self.assertEqual(self.breaker.state(self.db.host), "closed")
+
+    def test_drive_cache_fallback(self):
+        self.drive.put("a.txt", b"hello")
+        self.assertEqual(self.drive.get("a.txt").read(), b"hello")
+        self.transport.failing = True
+        # half of the last 4 requests failed
+        for _ in range(2):
+            with self.assertRaises(urllib.error.HTTPError):
+                self.drive.list()
+        self.assertEqual(self.drive.get("a.txt").read(), b"hello")
+        with self.assertRaises(CircuitOpenError):
+            self.drive.get("b.txt")
+
+
+class TestUpdateBuffer(unittest.TestCase):
+    def setUp(self):
+        self.records = []
+        self.transport = _FailingTransport()
+        self.db = Deta("test_key", transport=self.transport, hooks=[self.records.append]).Base("base")
+        self.db.put_many([{"key": "a", "n": 0, "l": [0]}, {"key": "b", "n": 0, "l": [0]}])
+        self.buffer = self.db.buffer(interval=60)
+        self.records.clear()
+
+    def tearDown(self):
+        self.buffer.close()
+
+    def test_coalesce(self):
+        util = self.db.util
+        for i in range(1, 4):
+            self.buffer.update({"n": util.increment(i), "l": util.append(i)}, "a")
+            self.buffer.update({"n": util.increment(), "l": util.prepend(i)}, "b")
+        self.assertEqual(len(self.buffer), 2)
+        self.assertEqual(self.buffer.flush(), {})
+        self.assertEqual([r.op for r in self.records], ["update", "update"])
+        self.assertEqual(self.db.get("a"), {"key": "a", "n": 6, "l": [0, 1, 2, 3]})
+        self.assertEqual(self.db.get("b"), {"key": "b", "n": 3, "l": [3, 2, 1, 0]})
+
+    def test_conflict(self):
+        self.buffer.update({"l": self.db.util.append(1)}, "a")
+        self.buffer.update({"l": self.db.util.prepend(2)}, "a")
+        self.buffer.flush()
+        self.assertEqual(self.db.get("a")["l"], [2, 0, 1])
+
+    def test_only_counters(self):
+        with self.assertRaises(ValueError):
+            self.buffer.update({"n": 1}, "a")
+
+    def test_failures(self):
+        self.buffer.update({"n": self.db.util.increment()}, "missing")
+        self.assertIn("missing", self.buffer.flush())
+        self.assertEqual(len(self.buffer), 0)
+        self.assertEqual(self.buffer.dropped["missing"][0]["increment"], {"n": 1})
+
+        self.transport.failing = True
+        self.buffer.update({"n": self.db.util.increment()}, "a")
+        self.assertIn("a", self.buffer.flush())
+        self.buffer.update({"n": self.db.util.increment()}, "a")
+        self.transport.failing = False
+        self.assertEqual(self.buffer.flush(), {})
+        self.assertEqual(self.db.get("a")["n"], 2)
+
+    def test_conflicting_retry(self):
+        util = self.db.util
+        request = self.transport.request
+
+        def prepend_while_failing(*args):
+            # a newer update of another kind comes in during the flush
+            self.transport.request = request
+            self.buffer.update({"l": util.prepend(2)}, "a")
+            return request(*args)
+
+        self.transport.failing = True
+        self.transport.request = prepend_while_failing
+        self.buffer.update({"l": util.append(1)}, "a")
+        self.buffer.flush()
+        # the failed append can't go after the prepend, it is given up
+        self.assertEqual(self.buffer.dropped["a"][0]["append"], {"l": [1]})
+        self.transport.failing = False
+        self.buffer.flush()
+        self.assertEqual(self.db.get("a")["l"], [2, 0])
+
+    def test_background(self):
+        buffer = self.db.buffer(interval=60, max_keys=2)
+        with buffer:
+            buffer.update({"n": self.db.util.increment()}, "a")
+            buffer.update({"n": self.db.util.increment()}, "b")
+            for _ in range(100):
+                if not len(buffer):
+                    break
+                time.sleep(0.01)
+            self.assertEqual(len(buffer), 0)
+            buffer.update({"n": self.db.util.increment()}, "a")
+        self.assertEqual(self.db.get("a")["n"], 2)
+
+
+class _DroppingTransport(FakeTransport):
+    """Fake transport whose responses lack the Content-Encoding header."""
+
+    def request(self, host, method, url, headers, body=None, timeouts=None):
+        res = super().request(host, method, url, headers, body, timeouts)
+        del res.headers["Content-Encoding"]
+        return res
+
+
+async def _async_get(deta, name):
+    drive = deta.AsyncDrive("drive")
+    try:
+        return await drive.get(name)
+    finally:
+        await drive.close()
+
+
+class TestFakeDrive(unittest.TestCase):
+    def setUp(self):
+        self.deta = Deta("test_key", transport=FakeTransport())
+        self.drive = self.deta.Drive("drive")
+
+    def test_put_get(self):
+        self.drive.put("a.txt", b"hello")
+        self.assertEqual(self.drive.get("a.txt").read(), b"hello")
+        self.assertIsNone(self.drive.get("b.txt"))
+
+    def test_multipart_upload(self):
+        data = b"x" * (11 * 1024 * 1024)
+        self.drive.put("big.bin", data)
+        self.assertEqual(self.drive.get("big.bin").read(), data)
+
+    def test_cache_evicted_after_lookup(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = DiskCache(tmp, max_age=60)
+            drive = self.deta.Drive("drive", cache=cache)
+            drive.put("a.txt", b"hello")
+            self.assertEqual(drive.get("a.txt").read(), b"hello")
+            lookup = cache.lookup
+
+            def lookup_then_evict(key):
+                # another thread evicts the content before it is opened
+                entry = lookup(key)
+                if entry:
+                    os.remove(cache.get_path(entry))
+                return entry
+
+            cache.lookup = lookup_then_evict
+            self.assertEqual(drive.get("a.txt").read(), b"hello")
+            self.assertEqual((cache.hits, cache.misses), (0, 2))
+
+    def test_low_size_hint(self):
+        class Stream(io.RawIOBase):
+            def __init__(self, data):
+                self._data = io.BytesIO(data)
+
+            def readable(self):
+                return True
+
+            def readinto(self, buffer):
+                return self._data.readinto(buffer)
+
+        records = []
+        drive = Deta("test_key", transport=FakeTransport(), hooks=[records.append]).Drive("drive")
+        # an estimate too low doesn't shrink the parts
+        drive.put("p", Stream(b"x" * 1000), size=10)
+        self.assertEqual([r.op for r in records].count("upload_part"), 1)
+        self.assertEqual(drive.get("p").read(), b"x" * 1000)
+
+    def test_unknown_path(self):
+        backend = FakeBackend()
+        self.assertEqual(backend.handle("GET", "/v1/p/n/foo", {}, None)[0], 404)
+        self.assertEqual(backend.handle("GET", "/v1/p/n/uploads", {}, None)[0], 404)
+
+    def test_copy_between_drives(self):
+        data = b"x" * (6 * 1024 * 1024)
+        self.drive.put("a.bin", data)
+        other = self.deta.Drive("other")
+        other.put("b.bin", self.drive.get("a.bin"))
+        self.assertEqual(other.get("b.bin").read(), data)
+
+    def test_part_retries(self):
+        transport = FakeTransport()
+        drive = Deta("test_key", transport=transport).Drive("drive")
+        sent = []
+
+        def failing_parts(error):
+            def request(host, method, url, headers, body=None, timeouts=None):
+                if "&part=1" in url:
+                    sent.append(url)
+                    raise error
+                return FakeTransport.request(transport, host, method, url, headers, body, timeouts)
+
+            return request
+
+        # connection resets are retried, timeouts aren't
+        for error, attempts in [(ConnectionResetError(), 3), (TimeoutError(), 1), (DeadlineExceeded(), 1)]:
+            sent.clear()
+            transport.request = failing_parts(error)
+            with self.assertRaises(type(error)):
+                drive.put("big.bin", b"x" * (6 * 1024 * 1024))
+            self.assertEqual(len(sent), attempts)
+
+    def test_compression(self):
+        # a backend which doesn't keep the Content-Encoding of uploads
+        transport = _DroppingTransport()
+        deta = Deta("test_key", transport=transport)
+        drive = deta.Drive("drive")
+        content = b"compressible " * 10000
+        encodings = ["gzip", "zstd"] if importlib.util.find_spec("zstandard") else ["gzip"]
+        for encoding in encodings:
+            drive.put(f"{encoding}.bin", content, compress=encoding)
+            self.assertLess(len(drive.get(f"{encoding}.bin", decompress=False).read()), len(content))
+            self.assertEqual(drive.get(f"{encoding}.bin").read(), content)
+            self.assertEqual(asyncio.run(_async_get(deta, f"{encoding}.bin")), content)
+        self.assertEqual(gzip.decompress(drive.get("gzip.bin", decompress=False).read()), content)
+
+        # gzip files put as they are stay compressed unless asked
+        drive.put("plain.gz", gzip.compress(content))
+        self.assertEqual(drive.get("plain.gz").read(), gzip.compress(content))
+        self.assertEqual(drive.get("plain.gz", decompress=True).read(), content)
+
+    def test_list_delete(self):
+        for name in ["a/1", "a/2", "b/1"]:
+            self.drive.put(name, b"data")
+        self.assertEqual(self.drive.list(prefix="a/")["names"], ["a/1", "a/2"])
+        self.assertEqual(list(self.drive.iter_names(limit=1)), ["a/1", "a/2", "b/1"])
+        self.drive.delete_prefix("a/")
+        self.assertEqual(self.drive.list()["names"], ["b/1"])
+
+
+@pytest.mark.asyncio
+async def test_async_clients():
+    transport = FakeTransport()
+    deta = Deta("test_key", transport=transport)
+    db = deta.AsyncBase("base")
+    await db.put({"n": 1}, "one")
+    await db.update({"n": db.util.increment(1)}, "one")
+    assert await db.get("one") == {"key": "one", "n": 2}
+    assert await db.get("missing") is None
+    assert (await db.fetch({"n": 2})).count == 1
+    await db.close()
+
+    deta.Drive("drive").put("a.txt", b"hello")
+    drive = deta.AsyncDrive("drive")
+    assert await drive.get("a.txt") == b"hello"
+    assert await drive.get("b.txt") is None
+    await drive.close()
+
+
+@pytest.mark.asyncio
+async def test_async_circuit_breaker():
+    transport = _FailingTransport()
+    transport.failing = True
+    breaker = CircuitBreaker(window=2, min_calls=2)
+    db = Deta("test_key", transport=transport, circuit_breaker=breaker).AsyncBase("base")
+    for _ in range(2):
+        with pytest.raises(Exception):
+            await db.get("one")
+    with pytest.raises(CircuitOpenError):
+        await db.get("one")
+    assert transport.sent == 2
+    await db.close()
+
+
+@pytest.mark.asyncio
+async def test_async_hooks():
+    records = []
+    db = Deta("test_key", transport=FakeTransport(), hooks=[records.append]).AsyncBase("base")
+    await db.put({"n": 1}, "one")
+    assert await db.get("missing") is None
+    await db.close()
+    assert [(r.op, r.service, r.status) for r in records] == [("put", "base", 207), ("get", "base", 404)]
+    assert records[0].bytes_out > 0 and "decode" in records[0].timings
+    assert records[1].error is not None
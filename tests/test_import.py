@@ -0,0 +1,26 @@
+import subprocess
+import sys
+import unittest
+
+
+class TestImport(unittest.TestCase):
+    def test_async_client_is_lazy(self):
+        code = "import sys, deta; print('aiohttp' in sys.modules, 'asyncio' in sys.modules)"
+        out = subprocess.run([sys.executable, "-c", code], check=True, capture_output=True, text=True)
+        self.assertEqual(out.stdout.split(), ["False", "False"])
+
+    def test_async_client_attributes(self):
+        import deta
+
+        try:
+            import aiohttp  # noqa: F401
+        except ImportError:
+            with self.assertRaises(ImportError):
+                deta.AsyncBase
+        else:
+            from deta._async.client import AsyncBase, AsyncDrive
+
+            self.assertIs(deta.AsyncBase, AsyncBase)
+            self.assertIs(deta.AsyncDrive, AsyncDrive)
+        with self.assertRaises(AttributeError):
+            deta.NotAnAttribute
@@ -1,13 +1,16 @@
 import datetime
+import hashlib
 import io
 import os
 import random
 import string
+import tempfile
 import unittest
 from pathlib import Path
 
 from deta import Deta
-from deta.drive import UPLOAD_CHUNK_SIZE
+from deta.cache import DiskCache
+from deta.drive import UPLOAD_CHUNK_SIZE, ChecksumMismatch
 from deta.base import FetchResponse
 
 try:
@@ -48,9 +51,7 @@ class TestDriveMethods(unittest.TestCase):
         return super().setUp()
 
     def tearDown(self) -> None:
-        all_items = self.drive.list()
-        for item in all_items["names"]:
-            self.drive.delete(item)
+        self.drive.delete_all(self.drive.iter_names())
 
     def test_put_string(self):
         test_cases = [
@@ -96,6 +97,67 @@ class TestDriveMethods(unittest.TestCase):
             self.assertEqual(self.drive.get(tc["name"]).read(), tc["raw"])
             self.assertEqual(tc["content"].closed, True)
 
+    def test_put_iterable(self):
+        def produce():
+            for i in range(3):
+                yield b"chunk %d\n" % i
+
+        async def produce_async():
+            for i in range(3):
+                yield b"chunk %d\n" % i
+
+        expected = b"chunk 0\nchunk 1\nchunk 2\n"
+        for content in [produce(), produce_async(), [b"chunk 0\n", b"chunk 1\n", b"chunk 2\n"]]:
+            self.assertEqual(self.drive.put("iterable.txt", content), "iterable.txt")
+            self.assertEqual(self.drive.get("iterable.txt").read(), expected)
+
+        self.drive.put("unicode.txt", "naïve ☃")
+        self.assertEqual(self.drive.get("unicode.txt").read().decode(), "naïve ☃")
+
+    def test_checksum(self):
+        content = b"checked content"
+        digest = hashlib.sha256(content).hexdigest()
+        self.assertEqual(self.drive.put("checked.txt", content, sha256=digest), "checked.txt")
+        self.assertEqual(self.drive.get("checked.txt", sha256=digest).read(), content)
+
+        body = self.drive.get("checked.txt", sha256=hashlib.sha256(b"other").hexdigest())
+        self.assertRaises(ChecksumMismatch, body.read)
+        self.assertRaises(
+            ChecksumMismatch, self.drive.put, "checked.txt", b"other", sha256=digest
+        )
+
+    def test_compression(self):
+        content = "\n".join('{"id": %d, "text": "compressible"}' % i for i in range(1000))
+        self.drive.put("compressed.jsonl", content, compress="gzip")
+        self.assertEqual(
+            self.drive.get("compressed.jsonl", decompress=True).read().decode(), content
+        )
+        stored = self.drive.get("compressed.jsonl", decompress=False).read()
+        self.assertLess(len(stored), len(content))
+        self.assertRaises(ValueError, self.drive.put, "compressed.jsonl", content, compress="lz4")
+
+    def test_put_many(self):
+        files = {"many/%d.txt" % i: "content %d" % i for i in range(20)}
+        files["many/stream.txt"] = io.BytesIO(b"stream content")
+        res = self.drive.put_many(files, concurrency=4)
+        self.assertEqual(sorted(res["uploaded"]), sorted(files))
+        self.assertEqual(res["failed"], {})
+        self.assertEqual(self.drive.get("many/7.txt").read(), b"content 7")
+        self.assertEqual(self.drive.get("many/stream.txt").read(), b"stream content")
+
+    def test_get_many(self):
+        self.drive.put_many({"a.txt": "a", "dir/b.txt": "b"})
+        with tempfile.TemporaryDirectory() as d:
+            res = self.drive.get_many(["a.txt", "dir/b.txt", "does_not_exist.txt"], d)
+            self.assertEqual(res["downloaded"], ["a.txt", "dir/b.txt"])
+            self.assertEqual(res["missing"], ["does_not_exist.txt"])
+            with open(os.path.join(d, "dir", "b.txt")) as f:
+                self.assertEqual(f.read(), "b")
+
+        contents = {}
+        self.drive.get_many(["a.txt"], callback=lambda name, body: contents.update({name: body.read()}))
+        self.assertEqual(contents, {"a.txt": b"a"})
+
     def test_large_file(self):
         name = "large_binary_file"
         large_binary_file = os.urandom(UPLOAD_CHUNK_SIZE * 2 + 1000)
@@ -133,6 +195,19 @@ class TestDriveMethods(unittest.TestCase):
         for n in names:
             self.assertIsNone(self.drive.get(n))
 
+    def test_delete_prefix(self):
+        names = ["purge/%d.txt" % i for i in range(5)] + ["keep.txt"]
+        for name in names:
+            self.drive.put(name, "content")
+
+        res = self.drive.delete_prefix("purge/", concurrency=2)
+        self.assertEqual(sorted(res["deleted"]), names[:5])
+        self.assertEqual(res["failed"], {})
+        self.assertEqual(self.drive.list()["names"], ["keep.txt"])
+
+        res = self.drive.delete_all(iter(["keep.txt"]))
+        self.assertEqual(res["deleted"], ["keep.txt"])
+
     def test_list(self):
         test_cases = [
             {"name": "a", "content": "a"},
@@ -147,6 +222,33 @@ class TestDriveMethods(unittest.TestCase):
         self.assertEqual(self.drive.list(limit=2)["paging"]["last"], "b")
         self.assertEqual(self.drive.list(prefix="c/")["names"], ["c/d"])
 
+    def test_iter_names(self):
+        test_cases = [
+            {"name": "a", "content": "a"},
+            {"name": "b", "content": "b"},
+            {"name": "c d/e&f", "content": "c and d"},
+        ]
+        for tc in test_cases:
+            self.drive.put(tc["name"], tc["content"])
+
+        self.assertEqual(list(self.drive.iter_names(limit=1)), ["a", "b", "c d/e&f"])
+        self.assertEqual(list(self.drive.iter_names(prefix="c d/")), ["c d/e&f"])
+        self.assertEqual(self.drive.list(limit=2, last="a")["names"], ["b", "c d/e&f"])
+
+    def test_get_cached(self):
+        with tempfile.TemporaryDirectory() as d:
+            cache = DiskCache(d, max_size=100, max_age=60)
+            drive = Deta(os.getenv("DETA_SDK_TEST_PROJECT_KEY")).Drive(
+                os.getenv("DETA_SDK_TEST_DRIVE_NAME"),
+                host=os.getenv("DETA_SDK_TEST_DRIVE_HOST"),
+                cache=cache,
+            )
+            drive.put("cached.txt", "cached content")
+            self.assertEqual(drive.get("cached.txt").read(), b"cached content")
+            self.assertEqual(drive.get("cached.txt").read(), b"cached content")
+            self.assertEqual((cache.hits, cache.misses), (1, 1))
+            self.assertIsNone(drive.get("does_not_exist.txt"))
+
     def test_read_close(self):
         test_cases = [
             {
@@ -184,6 +286,28 @@ class TestDriveMethods(unittest.TestCase):
                 self.assertEqual(test_stream.readline(), line.decode())
 
 
+    def test_sync_dir(self):
+        with tempfile.TemporaryDirectory() as d:
+            os.makedirs(os.path.join(d, "sub"))
+            for name, content in [("a.txt", "a"), ("sub/b.txt", "bb")]:
+                with open(os.path.join(d, name), "w") as f:
+                    f.write(content)
+            self.drive.put("synced/orphan.txt", "orphan")
+
+            res = self.drive.sync_dir(d, "synced/", delete=True)
+            self.assertEqual(res["uploaded"], ["synced/a.txt", "synced/sub/b.txt"])
+            self.assertEqual(res["deleted"], ["synced/orphan.txt"])
+            self.assertEqual(res["bytes_uploaded"], 3)
+            self.assertEqual(self.drive.get("synced/sub/b.txt").read(), b"bb")
+
+            with open(os.path.join(d, "a.txt"), "w") as f:
+                f.write("changed")
+            res = self.drive.sync_dir(d, "synced/")
+            self.assertEqual(res["uploaded"], ["synced/a.txt"])
+            self.assertEqual(res["skipped"], ["synced/sub/b.txt"])
+            self.assertEqual(res["bytes_saved"], 2)
+
+
 class TestBaseMethods(unittest.TestCase):
     def setUp(self):
         key = os.getenv("DETA_SDK_TEST_PROJECT_KEY")
@@ -345,6 +469,76 @@ class TestBaseMethods(unittest.TestCase):
         )
         self.assertEqual(res8, expectedItem)
 
+    def test_fetch_columns(self):
+        res = self.db.fetch({"value?gte": 7}, columns=["key", "value"])
+        self.assertEqual(res.columns, {"key": ["existing2", "existing3"], "value": [7, 44]})
+        self.assertEqual(len(res), 2)
+        self.assertEqual(
+            list(res),
+            [{"key": "existing2", "value": 7}, {"key": "existing3", "value": 44}],
+        )
+
+        res = self.db.fetch({"value": "test"})
+        self.assertEqual(res.columns, {"key": ["existing1"], "value": ["test"]})
+
+    def test_count_and_aggregates(self):
+        self.assertEqual(self.db.count(), 5)
+        self.assertEqual(self.db.count({"value?gte": 7}), 2)
+        # overlapping OR-branches are counted once
+        self.assertEqual(self.db.count([{"value?gte": 7}, {"value?lt": 50}]), 3)
+        self.assertEqual(self.db.sum("value"), 51)
+        self.assertEqual(self.db.min("value", {"value?gte": 0}), 0)
+        self.assertEqual(self.db.max("value", {"value?gte": 0}), 44)
+        # strings sort after numbers, dicts are skipped
+        self.assertEqual(self.db.min("value"), 0)
+        self.assertEqual(self.db.max("value"), "test")
+        self.assertIsNone(self.db.max("doesNotExist"))
+        self.assertEqual(self.db.group_count("value.name"), {'"patrick"': 1})
+
+    def test_iter_fetch(self):
+        keys = [i["key"] for i in self.db.iter_fetch(limit=2)]
+        self.assertEqual(len(keys), 5)
+        self.assertEqual(set(keys), {i["key"] for i in self.db.fetch().items})
+
+    def test_export(self):
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, "export.jsonl")
+            stats = self.db.export(path, query={"value?gte": 7})
+            self.assertEqual(stats["items"], 2)
+            with open(path) as f:
+                self.assertEqual(
+                    f.read(),
+                    '{"key": "existing2", "value": 7}\n{"key": "existing3", "value": 44}\n',
+                )
+
+            path = os.path.join(d, "export.csv")
+            stats = self.db.export(path, "csv", partitions=["existing", "%"])
+            self.assertEqual(stats["items"], 5)
+
+        self.assertRaises(ValueError, self.db.export, "export.xml", "xml")
+
+    def test_import_file(self):
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, "import.jsonl")
+            with open(path, "w") as f:
+                for i in range(60):
+                    f.write('{"key": "imported%d", "value": %d}\n' % (i, i))
+            stats = self.db.import_file(path, concurrency=2)
+            self.assertEqual(stats["items"], 60)
+            self.assertFalse(os.path.exists(path + ".checkpoint"))
+            self.assertEqual(self.db.get("imported59"), {"key": "imported59", "value": 59})
+
+            # resume after the first 50 items
+            with open(path + ".checkpoint", "w") as f:
+                f.write('{"offset": 50}')
+            self.assertEqual(self.db.import_file(path)["items"], 10)
+
+            path = os.path.join(d, "import.csv")
+            with open(path, "w") as f:
+                f.write("key,value\ncsv1,a\ncsv2,b\n")
+            self.assertEqual(self.db.import_file(path, checkpoint=False)["items"], 2)
+            self.assertEqual(self.db.get("csv2"), {"key": "csv2", "value": "b"})
+
     def test_update(self):
         self.assertIsNone(self.db.update(
             {"value.name": "spongebob"}, "existing4"))